@@ -1,35 +1,100 @@
-from dash import Dash, html, dcc, callback, Output, Input
+import os
+from dash import Dash, html, dcc, callback, Output, Input, State, no_update
+from dash.exceptions import PreventUpdate
 from webapp.ui.sidebar import get_sidebar_layout
-from webapp.ui.plot import make_stock_figure
+from webapp.ui.plot import make_stock_figure, chart_state, bars_requested, history_patch
+from webapp.db.connection import reader
 from webapp.db.stock_db import StockDatabase
+from webapp.db.connection import set_db_path
+from webapp.db.symbols import get_symbol_index
+from webapp import metrics
 
-app = Dash(suppress_callback_exceptions=True)
+# 样式和侧栏的 clientside 回调在 webapp/assets
+app = Dash(suppress_callback_exceptions=True,
+           assets_folder=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'webapp', 'assets'))
+
+# 图表区间（交易日）；长区间自动换成周线/月线
+CHART_RANGES = [("3M", 60), ("1Y", 250), ("3Y", 750), ("5Y", 1250), ("10Y", 2500), ("All", 0)]
+if metrics.ENABLED:
+    metrics.install(app.server)
 
 # Sidebar with tabs
-app.layout = html.Div([
-    # Inject global dark background for html and body
-    get_sidebar_layout(),
-    html.Div([
-        # html.H1(children='A股量化系统', style={'textAlign': 'center', 'color': '#f5f5f5'}),
-        dcc.Input(value='江西铜业', id='dropdown-selection', type='text', debounce=True, placeholder='输入股票名称或代码', style={'width': '320px', 'backgroundColor': '#222', 'color': '#f5f5f5', 'border': '1px solid #444'}),
-        html.Button('Add to Favorites', id='add-favorite-btn', n_clicks=0, style={'marginLeft': '10px', 'backgroundColor': '#333', 'color': '#f5f5f5', 'border': '1px solid #444'}),
-        dcc.Graph(id='graph-content'),
-    ], style={'flex': '1', 'padding': '10px', 'backgroundColor': '#181818', 'color': '#f5f5f5'})
-], style={'display': 'flex', 'height': '100vh', 'backgroundColor': '#111', 'color': '#f5f5f5'})
+# 布局按请求生成，侧栏列表的初始数据每次打开页面时读一次
+def serve_layout():
+    return html.Div([
+        # Inject global dark background for html and body
+        get_sidebar_layout(),
+        html.Div([
+            # html.H1(children='A股量化系统', style={'textAlign': 'center', 'color': '#f5f5f5'}),
+            dcc.Input(value='江西铜业', id='dropdown-selection', type='text', debounce=0.3, list='symbol-suggestions', placeholder='输入股票名称或代码', style={'width': '320px', 'backgroundColor': '#222', 'color': '#f5f5f5', 'border': '1px solid #444'}),
+            html.Datalist(id='symbol-suggestions'),
+            html.Button('Add to Favorites', id='add-favorite-btn', n_clicks=0, style={'marginLeft': '10px', 'backgroundColor': '#333', 'color': '#f5f5f5', 'border': '1px solid #444'}),
+            dcc.RadioItems(
+                id='chart-range',
+                options=[{'label': label, 'value': days} for label, days in CHART_RANGES],
+                value=60,
+                inline=True,
+                style={'display': 'inline-block', 'marginLeft': '10px'},
+                inputStyle={'marginLeft': '8px', 'marginRight': '2px'},
+            ),
+            dcc.Graph(id='graph-content'),
+            # 图上已加载的日期范围，拖到更早的日期时只补缺的那一段
+            dcc.Store(id='chart-loaded'),
+        ], style={'flex': '1', 'padding': '10px', 'backgroundColor': '#181818', 'color': '#f5f5f5'})
+    ], style={'display': 'flex', 'height': '100vh', 'backgroundColor': '#111', 'color': '#f5f5f5'})
+
+app.layout = serve_layout
 
 @callback(
     Output('graph-content', 'figure'),
+    Output('chart-loaded', 'data'),
     Input('dropdown-selection', 'value'),
-    Input('sidebar-tabs', 'value')
+    Input('chart-range', 'value'),
 )
-def update_graph(value, tab):
+@metrics.instrument
+def update_graph(value, day_count=60):
     if not value:
-        return {}
+        return {}, None
+    index = get_symbol_index()
+    stock = index.resolve(value)
+    if stock is None:
+        # 输入还不完整时保留当前图表；stocks 表为空时按原样查询
+        if len(index):
+            raise PreventUpdate
+        stock = value
     try:
-        fig = make_stock_figure(value)
+        fig = make_stock_figure(stock, day_count=day_count or None)
     except Exception as e:
-        return {}
-    return fig
+        return {}, None
+    # 周期取自图本身：“全部”按实际K线数选日/周/月线
+    return fig, chart_state(stock, fig)
+
+@callback(
+    Output('graph-content', 'figure', allow_duplicate=True),
+    Output('chart-loaded', 'data', allow_duplicate=True),
+    Input('graph-content', 'relayoutData'),
+    State('chart-loaded', 'data'),
+    prevent_initial_call=True,
+)
+@metrics.instrument
+def load_older_bars(relayout, loaded):
+    # 只发送新增K线的增量，不重建整张图；超出点数预算时才整张换成周线/月线
+    need, x_range = bars_requested(relayout, loaded)
+    if need <= 0:
+        raise PreventUpdate
+    patch, loaded = history_patch(reader(), loaded, need, x_range)
+    return (patch if patch is not None else no_update), loaded
+
+@callback(
+    Output('symbol-suggestions', 'children'),
+    Input('dropdown-selection', 'value'),
+)
+@metrics.instrument
+def update_suggestions(value):
+    return [
+        html.Option(value=name, label=f"{code} {initials}")
+        for code, name, initials in get_symbol_index().search(value, limit=20)
+    ]
 
 if __name__ == '__main__':
     import sys
@@ -42,18 +107,51 @@ if __name__ == '__main__':
         if len(sys.argv) < 3:
             print("provide db command")
             exit()
-        db = StockDatabase()
+        import argparse
+        parser = argparse.ArgumentParser(prog=f"app.py db {sys.argv[2]}")
+        parser.add_argument("limit", nargs="?", default=None, help="Only process the first N stocks")
+        parser.add_argument("--workers", type=int, default=1, help="Concurrent download workers")
+        parser.add_argument("--rps", type=float, default=None, help="Global request rate limit (requests/sec)")
+        parser.add_argument("--offline", type=float, default=None, metavar="LATENCY",
+                            help="Use the local akshare stand-in with the given per-call latency (seconds)")
+        parser.add_argument("--plan-only", action="store_true", help="Print pending stocks/days and exit without fetching")
+        parser.add_argument("--rebuild", action="store_true", help="Rebuild derived stores from scratch")
+        parser.add_argument("--db", default=None, help="SQLite DB path (default: $STOCK_DB_PATH or stock_data.db)")
+        parser.add_argument("--cache", choices=["cache", "refresh", "replay", "off"], default=None,
+                            help="akshare response cache mode (default: $STOCK_AK_CACHE, or cache for live akshare)")
+        args = parser.parse_args(sys.argv[3:])
+        if args.db:
+            set_db_path(args.db)
+
+        source = None
+        if args.offline is not None:
+            from webapp.db.fake_akshare import FakeAkshare
+            source = FakeAkshare(latency=args.offline)
+        db = StockDatabase(source=source, cache=args.cache)
         if sys.argv[2] == 'fetch':
             limit = None
-            if len(sys.argv) > 3:
+            if args.limit is not None:
                 try:
-                    limit = int(sys.argv[3])
+                    limit = int(args.limit)
                 except Exception:
                     print("Invalid limit, using all stocks.")
                     limit = None
-            db.fetch_daily_data(limit=limit, sleep_sec=0.0)
+            db.fetch_daily_data(limit=limit, sleep_sec=0.0, workers=args.workers, rps=args.rps,
+                                plan_only=args.plan_only)
         if sys.argv[2] == 'get-list':
             db.update_stock_info()
+        if sys.argv[2] == 'columnar':
+            db.sync_columnar(rebuild=args.rebuild)
+        if sys.argv[2] == 'reset-raw':
+            db.reset_raw_prices()
+        if sys.argv[2] == 'latest':
+            db.refresh_latest_snapshot()
+    elif cmd == "backtest":
+        from webapp.backtest import main as backtest_main
+        backtest_main(sys.argv[2:])
+    elif cmd == "screen":
+        from webapp.screen import main as screen_main
+        screen_main(sys.argv[2:])
     elif cmd == "run":
         app.run(debug=True)
 
@@ -0,0 +1,309 @@
+"""Synthetic benchmark suite.
+
+Generates a stock_data.db of configurable size from the offline akshare
+stand-in, then times the main paths against it:
+
+    fetch       fetch_daily_data into an empty DB, serial and threaded (stubbed akshare)
+    query       query_daily_data, plain and with indicators
+    indicators  calculate_kdj / double_line per stock, the panel versions, IndicatorStore rebuild
+    figure      make_stock_figure, cold and cached
+    picker      StockPicker J screen + market value filter, declarative screen
+    merge       merge_tables over per-stock tables
+
+Results are written as JSON. Pass an earlier file to --compare to print
+the ratio of each timing to the old run.
+
+Usage:
+    python bench.py [--stocks 5000] [--years 6] [--workdir bench_data] [--out bench_output.json]
+                    [--only query,figure] [--compare old.json]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+
+from webapp.db.connection import set_db_path
+from webapp.db.fake_akshare import FakeAkshare
+from webapp.db.snapshot import ensure_tables as ensure_stock_tables, ingest_snapshot
+
+SUITES = ["fetch", "query", "indicators", "figure", "picker", "merge"]
+
+DAILY_DDL = """
+    CREATE TABLE IF NOT EXISTS daily_data (
+        stock TEXT NOT NULL,
+        日期 TEXT NOT NULL,
+        开盘 REAL,
+        最高 REAL,
+        最低 REAL,
+        收盘 REAL,
+        成交量 REAL,
+        涨跌幅 REAL,
+        振幅 REAL,
+        PRIMARY KEY(stock, 日期)
+    )
+"""
+
+def generate_db(path, stocks=5000, years=6, end_date=None):
+    """Write `stocks` stocks x `years` years of synthetic daily bars to `path`."""
+    end = pd.Timestamp(end_date or datetime.now().date())
+    start = (end - pd.DateOffset(years=years)).strftime("%Y-%m-%d")
+    fake = FakeAkshare(latency=0, stock_count=stocks)
+    spot = fake.stock_zh_a_spot_em()
+
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(DAILY_DDL)
+    ingest_snapshot(conn, spot, end)
+    cols = ["日期", "开盘", "最高", "最低", "收盘", "成交量", "涨跌幅", "振幅"]
+    rows = 0
+    started = time.monotonic()
+    for i, (code, name) in enumerate(zip(spot["代码"], spot["名称"]), start=1):
+        # 基准库沿用前复权价（旧库格式），与之前的结果可比
+        hist = fake._history(code, end, "qfq")
+        hist = hist[hist["日期"] >= start][cols]
+        conn.executemany(
+            "INSERT INTO daily_data (stock, 日期, 开盘, 最高, 最低, 收盘, 成交量, 涨跌幅, 振幅)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            ((name, *r) for r in hist.itertuples(index=False, name=None)),
+        )
+        rows += len(hist)
+        if i % 500 == 0 or i == len(spot):
+            conn.commit()
+            print(f"generated {i}/{len(spot)} stocks, {rows} rows, {time.monotonic() - started:.0f}s")
+    conn.close()
+    return rows
+
+
+def timed(fn, repeat=1):
+    """Best wall time of `repeat` calls, with the function's stdout swallowed."""
+    best, result = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        with redirect_stdout(StringIO()):
+            result = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def bench_fetch(args, db_path, sample):
+    from webapp.db.stock_db import StockDatabase
+
+    out = {}
+    for workers in (1, 8):
+        path = os.path.join(args.workdir, f"fetch_w{workers}.db")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        conn = sqlite3.connect(path)
+        ensure_stock_tables(conn)
+        conn.execute(f"ATTACH DATABASE ? AS src", (db_path,))
+        conn.execute(
+            "INSERT INTO stocks (code, name, mv, circ_mv) SELECT code, name, mv, circ_mv FROM src.stocks"
+            " ORDER BY code LIMIT ?",
+            (args.fetch_stocks,),
+        )
+        conn.commit()
+        conn.close()
+
+        db = StockDatabase(path, source=FakeAkshare(latency=args.latency))
+        seconds, _ = timed(lambda: db.fetch_daily_data(limit=None, sleep_sec=0.0, workers=workers))
+        rows = db.conn.execute("SELECT COUNT(*) FROM daily_data").fetchone()[0]
+        out[f"workers_{workers}"] = {"seconds": seconds, "stocks": args.fetch_stocks, "rows": rows,
+                                     "rows_per_sec": rows / seconds}
+    return out
+
+
+def bench_query(args, db_path, sample):
+    from webapp.db.stock_db import StockDatabase
+
+    db = StockDatabase(db_path)
+    out = {}
+    for label, kwargs in (("plain_60", {"day_count": 60}),
+                          ("plain_750", {"day_count": 750}),
+                          ("indicators_180", {"day_count": 180, "with_indicators": True})):
+        seconds, _ = timed(lambda: [db.query_daily_data(s, **kwargs) for s in sample], args.repeat)
+        out[label] = {"seconds": seconds, "per_op_ms": seconds / len(sample) * 1e3}
+    seconds, _ = timed(lambda: db.query_daily_panel(sample, day_count=60), args.repeat)
+    out["panel_60"] = {"seconds": seconds, "stocks": len(sample)}
+    return out
+
+
+def bench_indicators(args, db_path, sample):
+    from webapp.db.stock_db import StockDatabase
+    from webapp.ui.plot import calculate_kdj, double_line
+    from webapp.panel import PricePanel, kdj_panel, double_line_panel
+
+    db = StockDatabase(db_path)
+    frames = [db.query_daily_data(s, 180) for s in sample]
+    out = {}
+
+    def per_stock():
+        for df in frames:
+            calculate_kdj(df.copy())
+            double_line(df.copy())
+
+    seconds, _ = timed(per_stock, args.repeat)
+    out["per_stock_180"] = {"seconds": seconds, "per_op_ms": seconds / len(frames) * 1e3}
+
+    panel = PricePanel.from_frame(db.query_daily_panel(sample, day_count=180), length=180)
+    seconds, _ = timed(lambda: (kdj_panel(panel["最高"], panel["最低"], panel["收盘"]),
+                                double_line_panel(panel["收盘"])), args.repeat)
+    out["panel_180"] = {"seconds": seconds, "stocks": len(panel)}
+
+    seconds, written = timed(lambda: db.update_indicators(rebuild=True))
+    out["store_rebuild"] = {"seconds": seconds, "rows": written}
+    return out
+
+
+def bench_figure(args, db_path, sample):
+    from webapp.ui.plot import make_stock_figure, figure_cache
+
+    def build():
+        for s in sample:
+            make_stock_figure(s, 60)
+
+    figure_cache.invalidate()
+    cold, _ = timed(build)
+    warm, _ = timed(build, args.repeat)
+    return {"cold": {"seconds": cold, "per_op_ms": cold / len(sample) * 1e3},
+            "cached": {"seconds": warm, "per_op_ms": warm / len(sample) * 1e3}}
+
+
+def bench_picker(args, db_path, sample):
+    from webapp.picker import StockPicker
+    from webapp.screen import run_screen, DEFAULT_SPEC
+
+    def picker():
+        p = StockPicker()
+        matches, cols = p.find_stocks_with_j_below(["code", "name"], threshold=12)
+        return p.filter_by_market_value(matches, cols, min_value=80_0000_0000)[0]
+
+    out = {}
+    seconds, matches = timed(picker)
+    out["stock_picker"] = {"seconds": seconds, "matches": len(matches)}
+    seconds, df = timed(lambda: run_screen(StockPicker().db, DEFAULT_SPEC))
+    out["screen_spec"] = {"seconds": seconds, "matches": len(df)}
+    return out
+
+
+def bench_merge(args, db_path, sample):
+    from webapp.db.merge_tables import merge_tables, quote_ident
+
+    path = os.path.join(args.workdir, "merge.db")
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.execute("ATTACH DATABASE ? AS src", (db_path,))
+    for name in sample:
+        conn.execute(
+            f"CREATE TABLE {quote_ident(name)} AS SELECT 日期, 开盘, 最高, 最低, 收盘, 成交量"
+            f" FROM src.daily_data WHERE stock = ?", (name,),
+        )
+    conn.commit()
+    rows = conn.execute("SELECT COUNT(*) FROM src.daily_data WHERE stock IN (%s)"
+                        % ",".join("?" * len(sample)), sample).fetchone()[0]
+    conn.close()
+    seconds, _ = timed(lambda: merge_tables(path))
+    return {"merge_tables": {"seconds": seconds, "tables": len(sample), "rows": rows, "rows_per_sec": rows / seconds}}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+    for suite, cases in results.items():
+        for case, values in cases.items():
+            old = baseline.get(suite, {}).get(case, {}).get("seconds")
+            if old:
+                ratio = values["seconds"] / old
+                flag = "  REGRESSION" if ratio > 1.2 else ""
+                print(f"{suite}.{case}: {old:.3f}s -> {values['seconds']:.3f}s ({ratio:.2f}x){flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic benchmark suite")
+    parser.add_argument("--stocks", type=int, default=5000, help="Stocks in the generated DB")
+    parser.add_argument("--years", type=int, default=6, help="Years of daily bars per stock")
+    parser.add_argument("--workdir", default="bench_data", help="Directory for generated databases")
+    parser.add_argument("--reuse", action="store_true", help="Reuse an existing generated DB of the same size")
+    parser.add_argument("--only", default=None, help=f"Comma-separated suites ({','.join(SUITES)})")
+    parser.add_argument("--sample", type=int, default=200, help="Stocks used by the per-stock benchmarks")
+    parser.add_argument("--fetch-stocks", type=int, default=200, help="Stocks fetched by the fetch benchmark")
+    parser.add_argument("--latency", type=float, default=0.0, help="Stubbed akshare latency per call (seconds)")
+    parser.add_argument("--repeat", type=int, default=3, help="Best-of repeats for the cheap benchmarks")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for choosing the sample stocks")
+    parser.add_argument("--out", default="bench_output.json", help="JSON results path")
+    parser.add_argument("--compare", default=None, help="Earlier JSON results to compare against")
+    args = parser.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    db_path = os.path.join(args.workdir, f"stock_data_{args.stocks}x{args.years}y.db")
+    if not (args.reuse and os.path.exists(db_path)):
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+        # 派生存储跟着库重新生成
+        shutil.rmtree(os.path.splitext(db_path)[0] + ".columnar", ignore_errors=True)
+        generate_db(db_path, args.stocks, args.years)
+    set_db_path(db_path)
+
+    conn = sqlite3.connect(db_path)
+    names = [r[0] for r in conn.execute("SELECT DISTINCT stock FROM daily_data")]
+    rows = conn.execute("SELECT COUNT(*) FROM daily_data").fetchone()[0]
+    conn.close()
+    sample = sorted(random.Random(args.seed).sample(names, min(args.sample, len(names))))
+
+    suites = args.only.split(",") if args.only else SUITES
+    results = {}
+    for suite in suites:
+        started = time.perf_counter()
+        results[suite] = globals()[f"bench_{suite}"](args, db_path, sample)
+        print(f"{suite}: done in {time.perf_counter() - started:.1f}s")
+        for case, values in results[suite].items():
+            print(f"  {case}: {values['seconds']:.3f}s")
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "sqlite": sqlite3.sqlite_version,
+            "stocks": len(names),
+            "years": args.years,
+            "rows": rows,
+            "sample": len(sample),
+        },
+        "results": results,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"results written to {args.out}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
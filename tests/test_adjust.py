@@ -0,0 +1,124 @@
+"""Raw bars + hfq factors: factor_lookup, to_qfq/to_hfq, detect_actions and the raw-mode 涨跌幅."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from webapp.db import adjust, compact_schema
+from webapp.db.adjust import detect_actions, factor_lookup, fetch_factors, load_factors, to_hfq, to_qfq
+from webapp.db.fake_akshare import FakeAkshare
+from webapp.db.stock_db import StockDatabase
+
+STOCKS = 5
+# 价格保留两位小数，复权后再四舍五入最多差半分
+PRICE_TOL = 0.0051
+
+
+@pytest.fixture(scope="module")
+def raw_db(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("adjust") / "raw.db")
+    db = StockDatabase(path, source=FakeAkshare(latency=0, stock_count=STOCKS))
+    db.update_stock_info()
+    db.fetch_daily_data(limit=None, sleep_sec=0, workers=2)
+    assert adjust.price_mode(db.conn) == "raw"
+    return db
+
+
+def _factors(rows):
+    df = pd.DataFrame(rows, columns=["stock", "日期", "factor"])
+    df["日期"] = pd.to_datetime(df["日期"])
+    return df
+
+
+def test_factor_lookup_steps():
+    factors = _factors([
+        ("甲", "2020-06-01", 1.1), ("甲", "2020-01-02", 1.0), ("甲", "2021-05-10", 1.21),
+        ("乙", "2019-01-01", 2.0),
+    ])
+    df = pd.DataFrame({
+        "stock": ["甲", "甲", "甲", "甲", "甲", "乙", "丙"],
+        "日期": ["2019-12-31", "2020-01-02", "2020-05-29", "2020-06-01", "2022-01-04", "2020-03-02", "2020-03-02"],
+    })
+    per_row, latest = factor_lookup(df, factors)
+    # 首档之前的K线按首档因子；没有因子的股票是 1.0
+    np.testing.assert_allclose(per_row, [1.0, 1.0, 1.0, 1.1, 1.21, 2.0, 1.0])
+    np.testing.assert_allclose(latest, [1.21] * 5 + [2.0, 1.0])
+
+    one, one_latest = factor_lookup(df[df["stock"] == "甲"].drop(columns="stock"), factors, stock="甲")
+    np.testing.assert_allclose(one, per_row[:5])
+    np.testing.assert_allclose(one_latest, latest[:5])
+
+
+def test_factor_lookup_without_factors():
+    df = pd.DataFrame({"stock": ["甲"], "日期": ["2020-01-02"]})
+    per_row, latest = factor_lookup(df, _factors([]))
+    assert per_row.tolist() == latest.tolist() == [1.0]
+
+
+@pytest.mark.parametrize("code", ["600000", "000001", "300750"])
+def test_to_qfq_and_to_hfq_match_fake_adjusted_prices(code):
+    fake = FakeAkshare(latency=0)
+    end = pd.Timestamp.today().normalize()
+    factors = fetch_factors(fake, code).assign(stock="甲")
+    factors["日期"] = pd.to_datetime(factors["日期"])
+    raw = fake._history(code, end, "").assign(stock="甲")
+    for fn, mode in ((to_qfq, "qfq"), (to_hfq, "hfq")):
+        out = fn(raw, factors)
+        expected = fake._history(code, end, mode)
+        for col in adjust.PRICE_COLS:
+            np.testing.assert_allclose(out[col], expected[col], rtol=0, atol=PRICE_TOL)
+    # 未复权的列原样保留
+    pd.testing.assert_series_equal(to_qfq(raw, factors)["成交量"], raw["成交量"])
+
+
+def test_to_qfq_scales_averages_by_latest_factor():
+    factors = _factors([("甲", "2020-01-02", 1.0), ("甲", "2021-01-04", 2.0)])
+    df = pd.DataFrame({"stock": ["甲", "甲"], "日期": ["2020-06-01", "2021-06-01"],
+                       "收盘": [10.0, 5.0], "short": [20.0, 10.0], "long": [18.0, 9.0]})
+    out = to_qfq(df, factors)
+    np.testing.assert_allclose(out["收盘"], [5.0, 5.0])
+    np.testing.assert_allclose(out["short"], [10.0, 5.0])
+    np.testing.assert_allclose(out["long"], [9.0, 4.5])
+
+
+def test_detect_actions(raw_db):
+    fake = FakeAkshare(latency=0)
+    stocks = raw_db.get_a_share_list_local()
+    code, name = stocks.iloc[0]["code"], stocks.iloc[0]["name"]
+    last = pd.Timestamp(raw_db.conn.execute(
+        "SELECT MAX(日期) FROM daily_data WHERE stock = ?", (name,)).fetchone()[0])
+    ex_dates = [pd.Timestamp(d) for d, _ in fake._actions(code) if pd.Timestamp(d) <= last]
+    ex_date = ex_dates[-1]
+
+    assert detect_actions(raw_db.conn, {}) == set()
+    # 除权日落在新K线里：交易所涨跌幅和不复权收盘价对不上
+    assert detect_actions(raw_db.conn, {name: ex_date.strftime("%Y%m%d")}) == {name}
+    after = ex_date + pd.Timedelta(days=1)
+    if after <= last:
+        assert detect_actions(raw_db.conn, {name: after.strftime("%Y%m%d")}) == set()
+
+
+def _pct(db):
+    return pd.read_sql("SELECT stock, 日期, 涨跌幅, 振幅 FROM daily_data ORDER BY stock, 日期", db.conn)
+
+
+@pytest.mark.parametrize("compact", [False, True])
+@pytest.mark.parametrize("incremental", [False, True])
+def test_raw_pct_matches_exchange(raw_db, tmp_path, compact, incremental):
+    # 交易所的涨跌幅按除权后的前收盘计算，等于后复权价的涨跌幅
+    path = str(tmp_path / "copy.db")
+    with raw_db.pool.writer() as conn:
+        conn.execute("VACUUM INTO ?", (path,))
+    if compact:
+        compact_schema.migrate(path, vacuum=False)
+    db = StockDatabase(path)
+    expected = _pct(db)
+    with db.pool.writer() as conn:
+        conn.execute("UPDATE daily_data SET 涨跌幅 = NULL, 振幅 = NULL")
+
+    assert db.calculate_pct_and_amp_for_all(incremental=incremental, batch_size=2) > 0
+    got = _pct(db)
+    first = got.groupby("stock").cumcount() == 0
+    assert got.loc[first, "涨跌幅"].isna().all()
+    np.testing.assert_allclose(got.loc[~first, "涨跌幅"], expected.loc[~first, "涨跌幅"], atol=0.011)
+    np.testing.assert_allclose(got.loc[~first, "振幅"], expected.loc[~first, "振幅"], atol=0.011)
+    assert not load_factors(db.conn).empty
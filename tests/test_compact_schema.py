@@ -0,0 +1,98 @@
+"""compact_schema.migrate: the daily_data view, its triggers and fetching into a migrated db."""
+import shutil
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import bench
+from webapp.db import compact_schema
+from webapp.db.fake_akshare import FakeAkshare
+from webapp.db.stock_db import StockDatabase
+
+STOCKS = 6
+ALL_ROWS = "SELECT * FROM daily_data ORDER BY stock, 日期"
+
+
+@pytest.fixture
+def legacy_path(tmp_path):
+    # 数据截止到两周前，抓取时每只股票还有几天要补
+    path = str(tmp_path / "legacy.db")
+    end = (pd.Timestamp.today() - pd.Timedelta(days=14)).strftime("%Y-%m-%d")
+    bench.generate_db(path, stocks=STOCKS, years=1, end_date=end)
+    return path
+
+
+def _migrated_copy(legacy_path, tmp_path, **kwargs):
+    path = str(tmp_path / "compact.db")
+    shutil.copy(legacy_path, path)
+    compact_schema.migrate(path, vacuum=False, **kwargs)
+    return path
+
+
+def _tables(path):
+    conn = sqlite3.connect(path)
+    try:
+        return dict(conn.execute("SELECT name, type FROM sqlite_master WHERE type IN ('table', 'view')"))
+    finally:
+        conn.close()
+
+
+def _read(path, sql=ALL_ROWS):
+    conn = sqlite3.connect(path)
+    try:
+        return pd.read_sql(sql, conn)
+    finally:
+        conn.close()
+
+
+def test_migrate_keeps_rows_and_legacy_table(legacy_path, tmp_path):
+    path = _migrated_copy(legacy_path, tmp_path)
+    tables = _tables(path)
+    assert tables["daily_data"] == "view"
+    assert tables["daily_bars"] == "table"
+    assert tables["daily_data_legacy"] == "table"
+    pd.testing.assert_frame_equal(_read(path), _read(legacy_path))
+
+
+def test_drop_legacy(legacy_path, tmp_path):
+    path = _migrated_copy(legacy_path, tmp_path, drop_legacy=True)
+    assert "daily_data_legacy" not in _tables(path)
+    pd.testing.assert_frame_equal(_read(path), _read(legacy_path))
+
+
+def test_view_triggers(legacy_path, tmp_path):
+    path = _migrated_copy(legacy_path, tmp_path)
+    conn = sqlite3.connect(path)
+    stock = conn.execute("SELECT stock FROM daily_data LIMIT 1").fetchone()[0]
+    before = conn.execute("SELECT COUNT(*) FROM daily_bars").fetchone()[0]
+
+    conn.execute("INSERT OR REPLACE INTO daily_data (stock, 日期, 收盘) VALUES ('新股', '2030-01-02', 9.5)")
+    conn.execute("INSERT OR REPLACE INTO daily_data (stock, 日期, 收盘) VALUES ('新股', '2030-01-02', 9.8)")
+    conn.execute("UPDATE daily_data SET 涨跌幅 = 1.5 WHERE stock = '新股' AND 日期 = '2030-01-02'")
+    assert conn.execute("SELECT 收盘, 涨跌幅 FROM daily_data WHERE stock = '新股'").fetchall() == [(9.8, 1.5)]
+    assert conn.execute("SELECT COUNT(*) FROM stock_ids WHERE name = '新股'").fetchone()[0] == 1
+    assert conn.execute("SELECT COUNT(*) FROM daily_bars").fetchone()[0] == before + 1
+
+    conn.execute("DELETE FROM daily_data WHERE stock = ?", (stock,))
+    assert conn.execute("SELECT COUNT(*) FROM daily_data WHERE stock = ?", (stock,)).fetchone()[0] == 0
+    conn.close()
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_fetch_into_compact_matches_legacy(legacy_path, tmp_path, workers):
+    path = _migrated_copy(legacy_path, tmp_path)
+    for p in (legacy_path, path):
+        db = StockDatabase(p, source=FakeAkshare(latency=0, stock_count=STOCKS))
+        db.fetch_daily_data(limit=None, sleep_sec=0, workers=workers)
+
+    # 紧凑库没有建出 daily_data 表，新抓的K线都在 daily_bars
+    assert _tables(path)["daily_data"] == "view"
+    legacy_db, compact_db = StockDatabase(legacy_path), StockDatabase(path)
+    pd.testing.assert_frame_equal(_read(path), _read(legacy_path))
+    assert len(_read(path)) > len(_read(path, "SELECT * FROM daily_data_legacy"))
+    for stock in _read(path, "SELECT DISTINCT stock FROM daily_data")["stock"]:
+        pd.testing.assert_frame_equal(
+            compact_db.query_daily_data(stock, day_count=30, with_indicators=True),
+            legacy_db.query_daily_data(stock, day_count=30, with_indicators=True),
+        )
@@ -0,0 +1,131 @@
+"""ConcurrentFetcher against FakeAkshare: rate limit, failing batches, plan_fetch day counts."""
+import sqlite3
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from webapp.db import fetcher
+from webapp.db.connection import get_pool
+from webapp.db.fake_akshare import FakeAkshare
+from webapp.db.fetcher import DEFAULT_START_DATE, REQUIRED_COLS, ConcurrentFetcher, FetchTask, TokenBucket, plan_fetch
+
+DAILY_DDL = f"""
+CREATE TABLE IF NOT EXISTS daily_data (
+    stock TEXT NOT NULL,
+    {', '.join(f'{c} REAL' if c != '日期' else '日期 TEXT NOT NULL' for c in REQUIRED_COLS)},
+    PRIMARY KEY (stock, 日期)
+)
+"""
+
+
+class FlakyPool:
+    """The real pool, except that the writer fails for the flush numbers in `fail`."""
+
+    def __init__(self, path, fail, on_enter=True):
+        self.pool = get_pool(path)
+        self.fail = set(fail)
+        self.on_enter = on_enter
+        self.calls = 0
+
+    @contextmanager
+    def writer(self):
+        self.calls += 1
+        failing = self.calls in self.fail
+        if failing and self.on_enter:
+            raise sqlite3.OperationalError("database is locked")
+        with self.pool.writer() as conn:
+            yield conn
+            if failing:
+                raise sqlite3.OperationalError("disk I/O error")
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "fetch.db")
+    with get_pool(path).writer() as conn:
+        conn.execute(DAILY_DDL)
+    return path
+
+
+# 2024-01-01 到 01-12 共 10 个工作日，FakeAkshare 每天一根
+DAYS = 10
+
+
+def _tasks(count, end_date="20240112"):
+    return [FetchTask(f"{600000 + i:06d}", f"股票{i}", "20240101", end_date, DAYS) for i in range(count)]
+
+
+def _count_rows(path):
+    return get_pool(path).reader().execute("SELECT COUNT(*) FROM daily_data").fetchone()[0]
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=50, capacity=1)
+    started = time.monotonic()
+    for _ in range(11):
+        bucket.acquire()
+    # 第一个令牌现成，其余 10 个每个至少等 1/50 秒
+    assert time.monotonic() - started >= 10 / 50 * 0.9
+
+
+def test_fetch_writes_every_task(db_path):
+    tasks = _tasks(5)
+    stats = ConcurrentFetcher(db_path, FakeAkshare(latency=0), workers=3, rps=200).run(tasks)
+    assert stats["stocks"] == 5
+    assert stats["failed"] == 0
+    assert stats["rows"] == _count_rows(db_path) == 5 * DAYS
+
+
+def test_failing_batch_is_counted_and_queue_drains(db_path, monkeypatch):
+    flaky = FlakyPool(db_path, fail={2})
+    monkeypatch.setattr(fetcher, "get_pool", lambda path: flaky)
+    tasks = _tasks(6)
+    f = ConcurrentFetcher(db_path, FakeAkshare(latency=0), workers=2, queue_size=1, commit_every=1)
+    stats = f.run(tasks)
+    assert stats["failed"] == 1
+    assert stats["stocks"] == 5
+    assert _count_rows(db_path) == stats["rows"] == 5 * DAYS
+
+
+def test_every_batch_failing_does_not_hang(db_path, monkeypatch):
+    flaky = FlakyPool(db_path, fail=range(1, 100))
+    monkeypatch.setattr(fetcher, "get_pool", lambda path: flaky)
+    f = ConcurrentFetcher(db_path, FakeAkshare(latency=0), workers=4, queue_size=1, commit_every=2)
+    stats = f.run(_tasks(12))
+    assert stats["failed"] == 12
+    assert stats["stocks"] == stats["rows"] == _count_rows(db_path) == 0
+
+
+@pytest.mark.parametrize("on_enter", [True, False])
+def test_failed_batch_counts_each_stock_once(db_path, monkeypatch, on_enter):
+    flaky = FlakyPool(db_path, fail={1}, on_enter=on_enter)
+    monkeypatch.setattr(fetcher, "get_pool", lambda path: flaky)
+    f = ConcurrentFetcher(db_path, FakeAkshare(latency=0))
+    good = fetcher.prepare_hist(FakeAkshare(latency=0).stock_zh_a_hist("600000", end_date="20240112"), "股票0")
+    bad = good.assign(不存在的列=1.0)
+    f._flush([("600000", "股票0", good), ("600001", "股票1", bad), ("600002", "股票2", good)])
+    assert f.write_errors == 3
+    assert f.stocks_written == f.rows_written == 0
+
+
+def test_plan_fetch_counts_business_days():
+    conn = sqlite3.connect(":memory:")
+    conn.execute(DAILY_DDL)
+    conn.executemany("INSERT INTO daily_data (stock, 日期) VALUES (?, ?)",
+                     [("落后股", "2024-01-04"), ("落后股", "2024-01-05"), ("最新股", "2024-01-12")])
+    stock_list = pd.DataFrame({"code": ["000002", "000001", "000003"], "name": ["落后股", "最新股", "新股"]})
+
+    tasks = plan_fetch(conn, stock_list, end_date="20240112")
+
+    # 最新股已经是最新，不再抓取；新股从默认起点开始，排在最前
+    assert [t.name for t in tasks] == ["新股", "落后股"]
+    new, stale = tasks
+    assert new.start_date == DEFAULT_START_DATE
+    assert new.days == np.busday_count(np.datetime64("2020-01-01"), np.datetime64("2024-01-13"))
+    # 2024-01-05 是周五，下一个交易日起到 01-12 共 5 个工作日
+    assert stale.start_date == "20240106"
+    assert stale.days == 5
+    assert all(t.end_date == "20240112" for t in tasks)
@@ -0,0 +1,108 @@
+"""IndicatorStore extended bar by bar matches calculate_kdj / double_line over the full history."""
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import bench
+from webapp.db.indicator_store import INDICATOR_COLS, IndicatorStore
+from webapp.ui.plot import calculate_kdj, double_line
+
+STOCKS = 6
+
+
+@pytest.fixture(scope="module")
+def bars(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("indicators") / "src.db")
+    bench.generate_db(path, stocks=STOCKS, years=1)
+    conn = sqlite3.connect(path)
+    df = pd.read_sql("SELECT * FROM daily_data ORDER BY stock, 日期", conn)
+    conn.close()
+    # 最后一只股票晚上市，增量过程中才第一次出现
+    late = df["stock"].unique()[-1]
+    late_days = df.loc[df["stock"] == late, "日期"]
+    return df[(df["stock"] != late) | (df["日期"] >= late_days.iloc[150])].reset_index(drop=True)
+
+
+def _append(conn, df):
+    cols = list(df.columns)
+    conn.executemany(f"INSERT INTO daily_data ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+                     df.itertuples(index=False, name=None))
+    conn.commit()
+
+
+def _expected(bars):
+    parts = []
+    for _, df in bars.groupby("stock", sort=True):
+        df = double_line(calculate_kdj(df.reset_index(drop=True)))
+        parts.append(df[["stock", "日期"] + INDICATOR_COLS])
+    return pd.concat(parts, ignore_index=True)
+
+
+def _stored(conn):
+    return pd.read_sql(f"SELECT stock, 日期, {', '.join(INDICATOR_COLS)} FROM indicators ORDER BY stock, 日期", conn)
+
+
+def _assert_matches(conn, bars):
+    got, expected = _stored(conn), _expected(bars)
+    assert got[["stock", "日期"]].values.tolist() == expected[["stock", "日期"]].values.tolist()
+    for col in INDICATOR_COLS:
+        np.testing.assert_allclose(got[col].to_numpy(dtype=float), expected[col].to_numpy(dtype=float),
+                                   rtol=1e-9, atol=1e-9, err_msg=col)
+
+
+def test_incremental_updates_match_full_history(bars, tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "store.db"))
+    conn.execute(bench.DAILY_DDL)
+    store = IndicatorStore(conn)
+    dates = sorted(bars["日期"].unique())
+
+    # 先写 5 根（不够一个 KDJ 窗口），再按 1 根、3 根、一个月交替追加
+    steps = [5]
+    while sum(steps) < len(dates):
+        steps.append([1, 3, 21][len(steps) % 3])
+    done = 0
+    for i, step in enumerate(steps):
+        window = set(dates[done:done + step])
+        _append(conn, bars[bars["日期"].isin(window)])
+        done += step
+        if i == len(steps) // 2:
+            # 中途重建一部分股票，之后继续增量
+            rebuilt = sorted(bars["stock"].unique())[:2]
+            assert store.update(rebuilt, rebuild=True) > 0
+            store.update()
+        else:
+            store.update()
+
+    _assert_matches(conn, bars)
+    state = store.load_state()
+    last = bars.groupby("stock")["日期"].max()
+    assert state["日期"].to_dict() == last.to_dict()
+    latest = store.latest().set_index("stock")
+    assert latest["日期"].to_dict() == last.to_dict()
+
+
+def test_rebuild_matches_incremental(bars, tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "store.db"))
+    conn.execute(bench.DAILY_DDL)
+    store = IndicatorStore(conn)
+    half = sorted(bars["日期"].unique())[len(bars["日期"].unique()) // 2]
+    _append(conn, bars[bars["日期"] <= half])
+    store.update()
+    _append(conn, bars[bars["日期"] > half])
+    store.update()
+    incremental = _stored(conn)
+
+    assert store.update(rebuild=True) == len(bars)
+    pd.testing.assert_frame_equal(_stored(conn), incremental)
+    _assert_matches(conn, bars)
+
+
+def test_update_without_new_bars_writes_nothing(bars, tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "store.db"))
+    conn.execute(bench.DAILY_DDL)
+    _append(conn, bars)
+    store = IndicatorStore(conn)
+    assert store.update() == len(bars)
+    assert store.update() == 0
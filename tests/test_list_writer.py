@@ -0,0 +1,49 @@
+"""ListWriter keeps and retries a batch whose commit fails."""
+import sqlite3
+from contextlib import contextmanager
+
+import pytest
+
+from webapp.db import connection
+from webapp.ui import list_writer
+from webapp.ui.list_writer import ListWriter, load_list
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "lists.db")
+    monkeypatch.setattr(connection, "_db_path", path)
+    monkeypatch.setattr(list_writer, "RETRY_DELAY", 0.01)
+    return path
+
+
+def test_failed_batch_is_retried(db_path, monkeypatch):
+    failures = []
+
+    @contextmanager
+    def flaky_writer():
+        if len(failures) < 2:
+            failures.append(1)
+            raise sqlite3.OperationalError("database is locked")
+        with connection.writer() as conn:
+            yield conn
+
+    monkeypatch.setattr(list_writer, "writer", flaky_writer)
+    w = ListWriter(flush_delay=0)
+    w.submit({"list": "favorite", "op": "add", "query": "江西铜业", "ts": "t1"})
+    w.submit({"list": "recent", "op": "touch", "query": "600000", "ts": "t2"})
+    w.flush()
+
+    assert len(failures) == 2
+    assert [i["query"] for i in load_list("favorite")] == ["江西铜业"]
+    assert [i["query"] for i in load_list("recent")] == ["600000"]
+
+
+def test_ops_collapse_to_the_last_per_query(db_path):
+    w = ListWriter(flush_delay=0.05)
+    for op in ("add", "remove", "add"):
+        w.submit({"list": "favorite", "op": op, "query": "中原银行", "ts": op})
+    w.submit({"list": "favorite", "op": "add", "query": "华东医药", "ts": "x"})
+    w.submit({"list": "favorite", "op": "remove", "query": "华东医药"})
+    w.flush()
+    assert load_list("favorite") == [{"query": "中原银行", "ts": "add"}]
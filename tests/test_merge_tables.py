@@ -0,0 +1,40 @@
+"""merge_tables only touches per-stock tables, never the tables the app creates."""
+import sqlite3
+
+import bench
+from webapp.db import adjust, latest_snapshot
+from webapp.db.merge_tables import EXCLUDE_TABLES, get_user_tables, merge_tables
+from webapp.db.stock_db import StockDatabase
+from webapp.ui.list_writer import ensure_tables as ensure_list_tables
+
+
+def test_merge_skips_app_tables(tmp_path):
+    path = str(tmp_path / "merge.db")
+    bench.generate_db(path, stocks=4, years=1)
+    db = StockDatabase(path)
+    db.update_indicators()
+    db.refresh_latest_snapshot()
+    with db.pool.writer() as conn:
+        adjust.ensure_tables(conn)
+        ensure_list_tables(conn)
+
+    conn = sqlite3.connect(path)
+    app_tables = EXCLUDE_TABLES & {
+        r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert {"stock_snapshots", latest_snapshot.TABLE, "indicator_state", "adj_factors", "adj_checked"} <= app_tables
+    # 旧格式：每只股票一张表
+    for name in ("旧表甲", "旧表乙"):
+        conn.execute(f'CREATE TABLE "{name}" (日期 TEXT, 开盘 REAL, 最高 REAL, 最低 REAL, 收盘 REAL, 成交量 REAL)')
+        conn.execute(f'INSERT INTO "{name}" VALUES (\'2001-01-02\', 1, 2, 0.5, 1.5, 100)')
+    conn.commit()
+    assert sorted(get_user_tables(conn)) == ["旧表乙", "旧表甲"]
+    conn.close()
+
+    merge_tables(path, drop_source=True)
+
+    conn = sqlite3.connect(path)
+    tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert app_tables <= tables
+    assert not {"旧表甲", "旧表乙"} & tables
+    assert conn.execute("SELECT COUNT(*) FROM daily_data WHERE 日期 = '2001-01-02'").fetchone()[0] == 2
+    conn.close()
@@ -0,0 +1,81 @@
+"""The latest_snapshot fast path and the panel path of run_screen agree."""
+import numpy as np
+import pandas as pd
+import pytest
+
+import bench
+from webapp import screen
+from webapp.db import latest_snapshot
+from webapp.db.stock_db import StockDatabase
+
+SPECS = [
+    screen.DEFAULT_SPEC,
+    {"short_above_long": True},
+    {"short_above_long": True, "K": {"min": 20}, "D": {"max": 70}, "circ_market_value": {"min": 10}},
+    {"market_value": {"min": 50}, "exclude_st": True, "active_within_days": 10,
+     "price": {"min": 3, "max": 50}, "J": {"max": 30}, "double_volume": {"within": 1}},
+]
+
+
+def _make_db(path, stocks=120):
+    bench.generate_db(str(path), stocks=stocks, years=2)
+    db = StockDatabase(str(path))
+    db.update_indicators()
+    db.refresh_latest_snapshot()
+    return db
+
+
+def _assert_paths_agree(db, spec, monkeypatch):
+    assert screen.snapshot_ready(db.conn, spec)
+    fast = screen.run_screen(db, spec)
+    with monkeypatch.context() as m:
+        m.setattr(latest_snapshot, "exists", lambda conn: False)
+        slow = screen.run_screen(db, spec)
+
+    assert list(fast.columns) == list(slow.columns)
+    assert fast["name"].tolist() == slow["name"].tolist()
+    floats = [c for c in fast.columns if c not in ("code", "name")]
+    np.testing.assert_allclose(fast[floats].to_numpy(dtype=float), slow[floats].to_numpy(dtype=float),
+                               rtol=1e-6, atol=1e-6)
+
+
+@pytest.fixture(scope="module")
+def db(tmp_path_factory):
+    return _make_db(tmp_path_factory.mktemp("screen") / "screen.db")
+
+
+@pytest.mark.parametrize("spec", SPECS)
+def test_snapshot_matches_panel(db, spec, monkeypatch):
+    _assert_paths_agree(db, spec, monkeypatch)
+
+
+def test_rebuild_refreshes_snapshot(tmp_path, monkeypatch):
+    db = _make_db(tmp_path / "rebuild.db", stocks=40)
+    stocks = [r[0] for r in db.conn.execute("SELECT DISTINCT stock FROM daily_data ORDER BY stock LIMIT 10")]
+    placeholders = ",".join("?" * len(stocks))
+    with db.pool.writer() as conn:
+        # 改写最后一根K线，再整段重算指标和涨跌幅
+        conn.execute(
+            f"""
+            UPDATE daily_data SET 收盘 = 收盘 * 1.3, 最高 = 最高 * 1.3, 涨跌幅 = NULL
+            WHERE stock IN ({placeholders}) AND 日期 = (SELECT MAX(日期) FROM daily_data)
+            """,
+            stocks,
+        )
+    db.update_indicators(stocks, rebuild=True)
+    db.calculate_pct_and_amp_for_all(incremental=True)
+
+    snap = latest_snapshot.read(db.conn).set_index("stock")
+    bars = db.query_daily_panel(stocks, day_count=1, columns=["日期", "收盘", "涨跌幅"]).set_index("stock")
+    np.testing.assert_allclose(snap.loc[stocks, "收盘"], bars.loc[stocks, "收盘"])
+    np.testing.assert_allclose(snap.loc[stocks, "涨跌幅"], bars.loc[stocks, "涨跌幅"])
+    for spec in SPECS[:2]:
+        _assert_paths_agree(db, spec, monkeypatch)
+
+
+def test_reset_clears_snapshot(tmp_path):
+    db = _make_db(tmp_path / "reset.db", stocks=20)
+    assert screen.snapshot_ready(db.conn, screen.DEFAULT_SPEC)
+    db.reset_raw_prices()
+    assert not latest_snapshot.exists(db.conn)
+    assert not screen.snapshot_ready(db.conn, screen.DEFAULT_SPEC)
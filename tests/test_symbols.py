@@ -0,0 +1,64 @@
+"""The symbol index follows meta.stocks_version; the analyze panel resolves input through it."""
+import sqlite3
+
+import pytest
+
+import bench
+from webapp.db import connection, events, symbols
+from webapp.db.fake_akshare import FakeAkshare
+from webapp.db.snapshot import ingest_snapshot
+from webapp.ui import analyze_panel
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "symbols.db")
+    bench.generate_db(path, stocks=5, years=1)
+    monkeypatch.setattr(connection, "_db_path", path)
+    monkeypatch.setattr(symbols, "_index", None)
+    return path
+
+
+def test_index_reloads_when_stocks_change(db_path):
+    reader = connection.reader(db_path)
+    index = symbols.get_symbol_index(reader)
+    assert len(index) == 5
+    assert symbols.get_symbol_index(reader) is index
+
+    # 另一个进程导入了新的股票列表
+    other = sqlite3.connect(db_path)
+    spot = FakeAkshare(latency=0, stock_count=6).stock_zh_a_spot_em()
+    before = events.stocks_version(other)
+    ingest_snapshot(other, spot)
+    assert events.stocks_version(other) == before + 1
+    other.close()
+
+    reloaded = symbols.get_symbol_index(reader)
+    assert reloaded is not index
+    assert len(reloaded) == 6
+    code, name = spot["代码"].iloc[-1], spot["名称"].iloc[-1]
+    assert reloaded.resolve(code) == name
+
+
+def test_quote_only_import_keeps_index(db_path):
+    reader = connection.reader(db_path)
+    index = symbols.get_symbol_index(reader)
+    other = sqlite3.connect(db_path)
+    spot = FakeAkshare(latency=0, stock_count=5).stock_zh_a_spot_em()
+    spot["最新价"] = spot["最新价"] + 1
+    before = events.stocks_version(other)
+    ingest_snapshot(other, spot)
+    assert events.stocks_version(other) == before
+    other.close()
+    assert symbols.get_symbol_index(reader) is index
+
+
+def test_analyze_resolves_code_and_initials(db_path):
+    index = symbols.get_symbol_index()
+    code, name, initials = index.entries[0]
+    by_name = analyze_panel.analyze_main_chart(1, name)
+    assert "当前的J值" in by_name
+    assert analyze_panel.analyze_main_chart(1, code) == by_name
+    if index.resolve(initials) == name:
+        assert analyze_panel.analyze_main_chart(1, initials.lower()) == by_name
+    assert analyze_panel.analyze_main_chart(1, "不存在的股票") == "未找到 不存在的股票"
@@ -0,0 +1,137 @@
+// 侧栏的最近/收藏列表：数据在 dcc.Store 里，渲染和点击都在浏览器完成，
+// 修改以 op 的形式交给服务端后台落库（webapp/ui/list_writer.py）。
+(function () {
+    var RECENT_LIMIT = 10;
+    var FAVORITE_LIMIT = 20;
+    var LIST_STYLE = {background: '#181818', color: '#f5f5f5', padding: '0', listStyle: 'none'};
+    var EMPTY_STYLE = {color: '#888'};
+
+    function html(type, props) {
+        return {namespace: 'dash_html_components', type: type, props: props};
+    }
+
+    function now() {
+        // 与 Python datetime.utcnow().isoformat() 同格式
+        return new Date().toISOString().replace('Z', '');
+    }
+
+    function noUpdate(n) {
+        var out = [];
+        for (var i = 0; i < n; i++) {
+            out.push(window.dash_clientside.no_update);
+        }
+        return out;
+    }
+
+    // 触发回调的按钮：{id, value}；新渲染出的按钮 n_clicks 为 0，不算点击
+    function clicked() {
+        var triggered = window.dash_clientside.callback_context.triggered || [];
+        for (var i = 0; i < triggered.length; i++) {
+            var propId = triggered[i].prop_id;
+            var value = triggered[i].value;
+            var raw = propId.slice(0, propId.lastIndexOf('.'));
+            var id = raw.charAt(0) === '{' ? JSON.parse(raw) : raw;
+            if (value) {
+                return {id: id, value: value};
+            }
+        }
+        return null;
+    }
+
+    function moveToFront(items, query, limit) {
+        var rest = (items || []).filter(function (item) { return item.query !== query; });
+        return [{query: query, ts: now()}].concat(rest).slice(0, limit);
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        sidebar: {
+            showTab: function (tab) {
+                var show = {display: 'block'};
+                var hide = {display: 'none'};
+                return [
+                    tab === 'recent' ? show : hide,
+                    tab === 'favorite' ? show : hide,
+                    tab === 'analyze' ? show : hide,
+                    tab === 'analyze' ? Date.now() : window.dash_clientside.no_update,
+                ];
+            },
+
+            renderRecent: function (items) {
+                if (!items || !items.length) {
+                    return html('Div', {children: 'No recent queries yet.', style: EMPTY_STYLE});
+                }
+                return html('Ul', {style: LIST_STYLE, children: items.map(function (item) {
+                    return html('Li', {
+                        key: item.query,
+                        style: {background: '#181818', color: '#f5f5f5', marginBottom: '2px'},
+                        children: html('Button', {
+                            id: {type: 'recent-query', key: item.query},
+                            n_clicks: 0,
+                            children: item.query + '  (' + item.ts + ')',
+                            style: {width: '100%', textAlign: 'left', border: 'none', background: '#222', color: '#f5f5f5', padding: '6px 0'},
+                        }),
+                    });
+                })});
+            },
+
+            renderFavorites: function (items) {
+                if (!items || !items.length) {
+                    return html('Div', {children: 'No favorites yet.', style: EMPTY_STYLE});
+                }
+                return html('Ul', {style: LIST_STYLE, children: items.map(function (item) {
+                    return html('Li', {
+                        key: item.query,
+                        style: {display: 'flex', alignItems: 'center', background: '#181818', color: '#f5f5f5', marginBottom: '2px'},
+                        children: [
+                            html('Button', {
+                                id: {type: 'favorite-query', key: item.query},
+                                n_clicks: 0,
+                                children: item.query + '  (' + item.ts + ')',
+                                style: {width: '70%', textAlign: 'left', border: 'none', background: '#222', color: '#f5f5f5', padding: '6px 0'},
+                            }),
+                            html('Button', {
+                                id: {type: 'remove-favorite', key: item.query},
+                                n_clicks: 0,
+                                children: 'Remove',
+                                style: {marginLeft: '8px', color: '#FF5555', background: '#222', border: 'none'},
+                            }),
+                        ],
+                    });
+                })});
+            },
+
+            // -> [主图输入框, recent-store, recent-op]
+            onRecentClick: function (nClicks, items) {
+                var hit = clicked();
+                if (!hit || typeof hit.id !== 'object') {
+                    return noUpdate(3);
+                }
+                var query = hit.id.key;
+                var next = moveToFront(items, query, RECENT_LIMIT);
+                return [query, next, {list: 'recent', op: 'touch', query: query, ts: next[0].ts}];
+            },
+
+            // -> [主图输入框, favorite-store, favorite-op]
+            onFavoriteAction: function (addClicks, openClicks, removeClicks, value, items) {
+                var hit = clicked();
+                if (!hit) {
+                    return noUpdate(3);
+                }
+                var noop = window.dash_clientside.no_update;
+                if (hit.id === 'add-favorite-btn') {
+                    if (!value) {
+                        return noUpdate(3);
+                    }
+                    var added = moveToFront(items, value, FAVORITE_LIMIT);
+                    return [noop, added, {list: 'favorite', op: 'add', query: value, ts: added[0].ts}];
+                }
+                var query = hit.id.key;
+                if (hit.id.type === 'favorite-query') {
+                    return [query, noop, noop];
+                }
+                var kept = (items || []).filter(function (item) { return item.query !== query; });
+                return [noop, kept, {list: 'favorite', op: 'remove', query: query, ts: now()}];
+            },
+        },
+    });
+})();
@@ -0,0 +1,234 @@
+"""Vectorized backtests over the whole market.
+
+Bars are loaded once into a stocks x days panel. Indicators are computed per
+stock with the panel functions, so they match the charts, and are then
+moved onto shared trading days. A signal is a stocks x days boolean array. It
+is either a function of the context dict or an expression over its arrays,
+e.g. `(J < 12) & (mv > 80)`.
+
+Trading rules:
+- a signal at day t's close buys at day t+1's open
+- a position is sold at the close once it has been held `hold` days or
+  the exit signal fires, whichever comes first
+- one position per stock at a time
+- the portfolio holds every open position with equal weight, rebalanced
+  daily, and sits in cash on days with no position
+
+The simulation steps through days and handles every stock at once.
+
+`mv` is the current market value in 亿 from the `stocks` table, so it
+carries look-ahead into older periods.
+
+Usage:
+    python app.py backtest [--days 750] [--entry "(J < 12) & (mv > 80)"] [--hold 5]
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+
+from webapp.panel import PricePanel, kdj_panel, double_line_panel
+from webapp.db.fetcher import last_dates
+
+# 指标预热所需的额外K线数
+WARMUP = 120
+TRADING_DAYS = 252
+
+
+def shift(values, n=1):
+    """Shift a panel right by `n` days along the date axis (NaN fill)."""
+    out = np.full(values.shape, np.nan)
+    if n < values.shape[1]:
+        out[:, n:] = values[:, :values.shape[1] - n]
+    return out
+
+
+def cross_above(a, b):
+    return (a > b) & (shift(a) <= shift(b))
+
+
+def cross_below(a, b):
+    return (a < b) & (shift(a) >= shift(b))
+
+
+def load_context(db, days=750, stocks=None, chunk_size=1000):
+    """
+    Aligned stocks x days arrays for the last `days` trading days:
+    open/high/low/close/volume, K/D/J, short/long and mv (亿).
+    """
+    if stocks is None:
+        stocks = sorted(last_dates(db.conn))
+    frames = []
+    for start in range(0, len(stocks), chunk_size):
+        frames.append(db.query_daily_panel(stocks[start:start + chunk_size], day_count=days + WARMUP))
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    panel = PricePanel.from_frame(df)
+
+    k, d, j = kdj_panel(panel["最高"], panel["最低"], panel["收盘"])
+    short, long = double_line_panel(panel["收盘"])
+    names = ["open", "high", "low", "close", "volume", "K", "D", "J", "short", "long"]
+    arrays = [panel["开盘"], panel["最高"], panel["最低"], panel["收盘"], panel["成交量"], k, d, j, short, long]
+    calendar, aligned = panel.to_calendar(*arrays)
+
+    ctx = {name: arr[:, -days:] for name, arr in zip(names, aligned)}
+    ctx["dates"] = calendar[-days:]
+    ctx["stocks"] = np.asarray(panel.stocks, dtype=object)
+
+    mv = pd.read_sql("SELECT name, mv FROM stocks", db.conn)
+    mv = pd.to_numeric(mv["mv"].astype(str).str.replace(",", ""), errors="coerce").groupby(mv["name"]).last()
+    mv = mv.reindex(panel.stocks).to_numpy(dtype=float) / 1e8
+    ctx["mv"] = np.broadcast_to(mv[:, None], ctx["close"].shape)
+    ctx.update(shift=shift, cross_above=cross_above, cross_below=cross_below)
+    return ctx
+
+
+def evaluate_signal(signal, ctx):
+    """Boolean stocks x days array from a function of ctx or an expression over its arrays."""
+    if callable(signal):
+        out = signal(ctx)
+    else:
+        with np.errstate(invalid="ignore"):
+            out = eval(signal, {"__builtins__": {}, "np": np}, dict(ctx))
+    return np.broadcast_to(np.asarray(out, dtype=bool), ctx["close"].shape)
+
+
+class BacktestResult:
+    def __init__(self, trades, open_positions, equity, daily, exposure):
+        self.trades = trades
+        self.open_positions = open_positions
+        self.equity = equity
+        self.daily = daily
+        self.exposure = exposure
+
+    @property
+    def stats(self):
+        ret = self.trades["ret"]
+        eq = self.equity
+        days = len(eq)
+        drawdown = (eq / eq.cummax() - 1).min() if days else 0.0
+        std = self.daily.std()
+        return {
+            "trades": len(ret),
+            "win_rate": float((ret > 0).mean()) if len(ret) else 0.0,
+            "avg_trade": float(ret.mean()) if len(ret) else 0.0,
+            "median_trade": float(ret.median()) if len(ret) else 0.0,
+            "total_return": float(eq.iloc[-1] - 1) if days else 0.0,
+            "annual_return": float(eq.iloc[-1] ** (TRADING_DAYS / days) - 1) if days else 0.0,
+            "max_drawdown": float(drawdown),
+            "sharpe": float(self.daily.mean() / std * np.sqrt(TRADING_DAYS)) if std > 0 else 0.0,
+            "exposure": self.exposure,
+            "open_positions": len(self.open_positions),
+        }
+
+    def summary(self):
+        s = self.stats
+        return (
+            f"trades {s['trades']}  win {s['win_rate']:.1%}  avg {s['avg_trade']:.2%}  "
+            f"median {s['median_trade']:.2%}\n"
+            f"total {s['total_return']:.2%}  annual {s['annual_return']:.2%}  "
+            f"maxDD {s['max_drawdown']:.2%}  sharpe {s['sharpe']:.2f}  exposure {s['exposure']:.1%}"
+        )
+
+
+def run_backtest(ctx, entry, exit=None, hold=5, fee=0.0005):
+    """
+    Simulate `entry` / `exit` signals over `ctx` (see load_context).
+    `fee` is charged on each side as a fraction of the trade.
+    """
+    open_, close = ctx["open"], ctx["close"]
+    n, T = close.shape
+    entry_sig = evaluate_signal(entry, ctx)
+    exit_sig = evaluate_signal(exit, ctx) if exit is not None else np.zeros((n, T), dtype=bool)
+
+    in_pos = np.zeros(n, dtype=bool)
+    entry_day = np.zeros(n, dtype=np.int64)
+    entry_px = np.full(n, np.nan)
+    held = np.zeros((n, T), dtype=bool)
+    entered = np.zeros((n, T), dtype=bool)
+    exited = np.zeros((n, T), dtype=bool)
+    closed = []
+    for d in range(1, T):
+        # 前一日收盘出信号，当日开盘买入
+        enter = ~in_pos & entry_sig[:, d - 1] & (open_[:, d] > 0)
+        in_pos |= enter
+        entry_day[enter] = d
+        entry_px[enter] = open_[enter, d]
+        entered[:, d] = enter
+        held[:, d] = in_pos
+        # 停牌日没有收盘价，顺延到复牌后卖出
+        leave = in_pos & (close[:, d] > 0) & ((d - entry_day + 1 >= hold) | exit_sig[:, d])
+        if leave.any():
+            idx = np.nonzero(leave)[0]
+            closed.append((idx, entry_day[idx], np.full(len(idx), d), entry_px[idx], close[idx, d]))
+            exited[:, d] = leave
+            in_pos &= ~leave
+
+    dates, stocks = ctx["dates"], ctx["stocks"]
+
+    def trade_frame(idx, start, end, px_in, px_out):
+        return pd.DataFrame({
+            "stock": stocks[idx],
+            "entry_date": dates[start],
+            "exit_date": dates[end],
+            "entry_price": px_in,
+            "exit_price": px_out,
+            "days": end - start + 1,
+            "ret": px_out / px_in - 1 - 2 * fee,
+        })
+
+    if closed:
+        trades = trade_frame(*(np.concatenate(part) for part in zip(*closed)))
+    else:
+        trades = trade_frame(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64),
+                             np.empty(0, dtype=np.int64), np.empty(0), np.empty(0))
+    idx = np.nonzero(in_pos)[0]
+    last = pd.DataFrame(close).ffill(axis=1).to_numpy()[:, -1]
+    open_positions = trade_frame(idx, entry_day[idx], np.full(len(idx), T - 1), entry_px[idx], last[idx])
+
+    # 每个持仓格子的当日收益：买入日为 收盘/开盘，之后为 收盘/前收盘（停牌日为 0）
+    filled = pd.DataFrame(close).ffill(axis=1).to_numpy()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cc = filled / shift(filled) - 1
+        oc = filled / open_ - 1
+    cell = np.nan_to_num(np.where(entered, oc, cc), nan=0.0, posinf=0.0, neginf=0.0)
+    cell = np.where(held, cell, 0.0) - fee * entered - fee * exited
+    count = held.sum(axis=0)
+    daily = np.where(count > 0, cell.sum(axis=0) / np.maximum(count, 1), 0.0)
+
+    daily = pd.Series(daily, index=pd.DatetimeIndex(dates), name="daily")
+    equity = (1 + daily).cumprod().rename("equity")
+    return BacktestResult(trades, open_positions, equity, daily, float((count > 0).mean()) if T else 0.0)
+
+
+def main(argv=None):
+    from webapp.db.stock_db import StockDatabase
+    from webapp.db.connection import get_db_path, set_db_path
+
+    parser = argparse.ArgumentParser(prog="app.py backtest", description="Vectorized full-market backtest")
+    parser.add_argument("--days", type=int, default=750, help="Trading days to simulate")
+    parser.add_argument("--entry", default="(J < 12) & (mv > 80)",
+                        help="Entry signal expression over open/high/low/close/volume/K/D/J/short/long/mv")
+    parser.add_argument("--exit", default=None, help="Optional exit signal expression")
+    parser.add_argument("--hold", type=int, default=5, help="Maximum holding period in trading days")
+    parser.add_argument("--fee", type=float, default=0.0005, help="Cost per side as a fraction of the trade")
+    parser.add_argument("--trades", default=None, help="Write closed trades to this CSV")
+    parser.add_argument("--db", default=None, help="SQLite DB path (default: $STOCK_DB_PATH or stock_data.db)")
+    args = parser.parse_args(argv)
+    if args.db:
+        set_db_path(args.db)
+
+    started = time.monotonic()
+    db = StockDatabase(get_db_path(), columnar=True)
+    ctx = load_context(db, days=args.days)
+    loaded = time.monotonic()
+    print(f"loaded {len(ctx['stocks'])} stocks x {len(ctx['dates'])} days in {loaded - started:.1f}s")
+
+    result = run_backtest(ctx, args.entry, exit=args.exit, hold=args.hold, fee=args.fee)
+    print(f"simulated in {time.monotonic() - loaded:.1f}s")
+    print(result.summary())
+    if args.trades:
+        result.trades.to_csv(args.trades, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""Unadjusted prices plus hfq adjustment factors.
+
+daily_data stores raw (不复权) bars. `adj_factors` holds each stock's hfq
+factor as a step function: a row (stock, 日期, factor) applies from 日期
+until the next row. Query paths turn raw bars into qfq prices as
+
+    qfq = raw * factor(日期) / factor(latest)
+
+in one vectorized lookup. Indicators are computed on hfq prices
+(raw * factor), which never change for past days. KDJ is scale-free, and
+short/long only need dividing by factor(latest) at read time. A dividend
+or split therefore costs one small factor download per affected stock,
+not a history refetch.
+
+Factors are re-downloaded only for stocks that:
+- have never been checked
+- show a corporate action in the bars just fetched (the exchange's 涨跌幅
+  disagrees with the raw closes)
+- were last checked more than RECHECK_DAYS ago
+
+DBs filled before this change hold qfq prices. The `price_mode` key in
+meta marks them 'qfq', and they are served unchanged until they are reset
+and refetched (`python app.py db reset-raw`).
+"""
+import datetime
+from contextlib import nullcontext
+
+import numpy as np
+import pandas as pd
+
+PRICE_COLS = ["开盘", "最高", "最低", "收盘"]
+# 按后复权价计算并存储的均线，读出时除以最新因子
+SCALED_COLS = ["short", "long"]
+RECHECK_DAYS = 90
+# 交易所涨跌幅保留两位小数，超过这个差值说明前收盘被除权调整过
+PCT_TOLERANCE = 0.011
+
+
+def ensure_tables(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS adj_factors (
+            stock TEXT NOT NULL,
+            日期 TEXT NOT NULL,
+            factor REAL NOT NULL,
+            PRIMARY KEY(stock, 日期)
+        )
+        """
+    )
+    conn.execute("CREATE TABLE IF NOT EXISTS adj_checked (stock TEXT PRIMARY KEY, checked TEXT)")
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    conn.commit()
+
+
+def price_mode(conn):
+    """'raw' when daily_data holds unadjusted bars, 'qfq' for older databases."""
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'price_mode'").fetchone()
+    except Exception:
+        row = None
+    if row:
+        return row[0]
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'daily_data'").fetchone()
+    return "qfq" if exists else "raw"
+
+
+def set_price_mode(conn, mode):
+    ensure_tables(conn)
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('price_mode', ?)", (mode,))
+    conn.commit()
+
+
+def exchange_symbol(code):
+    code = str(code).strip()
+    if code.startswith(("6", "9")):
+        return "sh" + code
+    if code.startswith(("4", "8")):
+        return "bj" + code
+    return "sz" + code
+
+
+def fetch_factors(source, code, refresh=False):
+    """hfq factor steps for `code` as a (日期 'YYYY-MM-DD', factor) frame, oldest first."""
+    kwargs = {"symbol": exchange_symbol(code), "adjust": "hfq-factor"}
+    if refresh and hasattr(source, "refresh"):
+        df = source.refresh("stock_zh_a_daily", **kwargs)
+    else:
+        df = source.stock_zh_a_daily(**kwargs)
+    if df is None or df.empty:
+        return pd.DataFrame(columns=["日期", "factor"])
+    out = pd.DataFrame({
+        "日期": pd.to_datetime(df["date"]).dt.strftime("%Y-%m-%d"),
+        "factor": pd.to_numeric(df["hfq_factor"], errors="coerce"),
+    }).dropna()
+    return out.sort_values("日期").drop_duplicates("日期", keep="last").reset_index(drop=True)
+
+
+def store_factors(conn, name, factors):
+    """Replace `name`'s factor steps; True if they differ from what was stored."""
+    old = conn.execute("SELECT 日期, factor FROM adj_factors WHERE stock = ? ORDER BY 日期", (name,)).fetchall()
+    new = list(factors[["日期", "factor"]].itertuples(index=False, name=None))
+    changed = [(d, round(f, 8)) for d, f in old] != [(d, round(f, 8)) for d, f in new]
+    if changed:
+        conn.execute("DELETE FROM adj_factors WHERE stock = ?", (name,))
+        conn.executemany("INSERT INTO adj_factors (stock, 日期, factor) VALUES (?, ?, ?)",
+                         [(name, d, f) for d, f in new])
+    conn.execute("INSERT OR REPLACE INTO adj_checked (stock, checked) VALUES (?, ?)",
+                 (name, datetime.date.today().isoformat()))
+    return changed
+
+
+def detect_actions(conn, since):
+    """
+    Stocks whose bars from `since[stock]` ('YYYYMMDD') on contain a day
+    where the stored 涨跌幅 does not match the raw closes.
+    """
+    if not since:
+        return set()
+    from webapp.db.compact_schema import is_compact, INT_TO_DATE
+
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS _adj_since (stock TEXT PRIMARY KEY, since TEXT, prev TEXT)")
+    conn.execute("DELETE FROM _adj_since")
+    rows = []
+    for stock, start in since.items():
+        start = pd.Timestamp(str(start))
+        # 往前多取一个月，保证第一根新K线有前收盘
+        rows.append((stock, start.strftime("%Y-%m-%d"), (start - pd.Timedelta(days=31)).strftime("%Y-%m-%d")))
+    conn.executemany("INSERT INTO _adj_since VALUES (?, ?, ?)", rows)
+    if is_compact(conn):
+        bars = f"""
+            SELECT i.name AS stock, {INT_TO_DATE.format('b.日期')} AS 日期, b.收盘, b.涨跌幅
+            FROM _adj_since s JOIN stock_ids i ON i.name = s.stock
+            JOIN daily_bars b ON b.stock_id = i.id
+             AND b.日期 >= CAST(replace(s.prev, '-', '') AS INTEGER)
+        """
+    else:
+        bars = """
+            SELECT d.stock, d.日期, d.收盘, d.涨跌幅
+            FROM _adj_since s JOIN daily_data d ON d.stock = s.stock AND d.日期 >= s.prev
+        """
+    found = conn.execute(
+        f"""
+        SELECT DISTINCT x.stock FROM (
+            SELECT b.stock, b.日期, b.涨跌幅,
+                   (b.收盘 / LAG(b.收盘) OVER w - 1) * 100 AS raw_pct
+            FROM ({bars}) b
+            WINDOW w AS (PARTITION BY b.stock ORDER BY b.日期)
+        ) x JOIN _adj_since s ON s.stock = x.stock
+        WHERE x.日期 >= s.since AND x.raw_pct IS NOT NULL AND x.涨跌幅 IS NOT NULL
+          AND ABS(x.涨跌幅 - x.raw_pct) > ?
+        """,
+        (PCT_TOLERANCE,),
+    ).fetchall()
+    conn.commit()
+    return {r[0] for r in found}
+
+
+def stocks_due(conn, stocks, recheck_days=RECHECK_DAYS):
+    """Stocks never checked or last checked more than `recheck_days` ago."""
+    cutoff = (datetime.date.today() - datetime.timedelta(days=recheck_days)).isoformat()
+    checked = dict(conn.execute("SELECT stock, checked FROM adj_checked").fetchall())
+    return {s for s in stocks if checked.get(s, "") < cutoff}
+
+
+def update_factors(conn, source, tasks, recheck_days=RECHECK_DAYS, writer=None):
+    """
+    Refresh factors after a fetch of `tasks` (FetchTask list). Returns the
+    stocks whose factors changed; their hfq-based indicators need a rebuild.
+    `writer()` yields the connection the factors are stored through
+    (default: `conn`); it is only held while a batch is stored, never
+    while factors are downloaded.
+    """
+    writer = writer or (lambda: nullcontext(conn))
+    with writer() as w:
+        ensure_tables(w)
+    by_name = {t.name: t for t in tasks}
+    flagged = detect_actions(conn, {t.name: t.start_date for t in tasks})
+    due = sorted(stocks_due(conn, by_name, recheck_days) | flagged)
+    changed = set()
+    fetched = []
+    for i, name in enumerate(due, start=1):
+        try:
+            fetched.append((name, fetch_factors(source, by_name[name].code, refresh=name in flagged)))
+        except Exception as e:
+            print(f"factors for {name} failed: {e}")
+        if fetched and (len(fetched) >= 200 or i == len(due)):
+            with writer() as w:
+                changed.update(name for name, factors in fetched if store_factors(w, name, factors))
+                w.commit()
+            fetched = []
+    print(f"adj factors: {len(due)} checked ({len(flagged)} with corporate actions), {len(changed)} changed")
+    return changed
+
+
+def load_factors(conn, stocks=None):
+    """(stock, 日期 datetime64, factor) rows, empty when there is no factor table."""
+    try:
+        if stocks is None:
+            df = pd.read_sql("SELECT stock, 日期, factor FROM adj_factors", conn)
+        else:
+            stocks = list(stocks)
+            parts = []
+            for start in range(0, len(stocks), 900):
+                chunk = stocks[start:start + 900]
+                parts.append(pd.read_sql(
+                    f"SELECT stock, 日期, factor FROM adj_factors WHERE stock IN ({','.join('?' * len(chunk))})",
+                    conn, params=chunk,
+                ))
+            df = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=["stock", "日期", "factor"])
+    except Exception:
+        return pd.DataFrame(columns=["stock", "日期", "factor"])
+    df["日期"] = pd.to_datetime(df["日期"])
+    return df
+
+
+def factor_lookup(df, factors, stock=None):
+    """
+    Per-row factor at each bar's date and the stock's latest factor, as two
+    arrays aligned with `df` (1.0 where a stock has no factors).
+    """
+    n = len(df)
+    if factors.empty or n == 0:
+        return np.ones(n), np.ones(n)
+    names = df["stock"].to_numpy() if stock is None else np.full(n, stock, dtype=object)
+    cats = pd.Index(pd.unique(factors["stock"]))
+    row_code = cats.get_indexer(names)
+    f_code = cats.get_indexer(factors["stock"].to_numpy())
+    day = pd.to_datetime(df["日期"]).to_numpy().astype("datetime64[D]").astype(np.int64)
+    f_day = factors["日期"].to_numpy().astype("datetime64[D]").astype(np.int64)
+
+    # (股票编号, 日期) 合成一个可排序的键，一次 searchsorted 找到每行适用的因子
+    span = np.int64(1 << 20)
+    order = np.lexsort((f_day, f_code))
+    f_key = f_code[order] * span + (f_day[order] - f_day.min())
+    f_val = factors["factor"].to_numpy(dtype=float)[order]
+    f_stock = f_code[order]
+    row_key = row_code * span + np.clip(day - f_day.min(), -1, span - 1)
+    pos = np.searchsorted(f_key, row_key, side="right") - 1
+    hit = (row_code >= 0) & (pos >= 0) & (f_stock[np.maximum(pos, 0)] == row_code)
+    per_row = np.where(hit, f_val[np.maximum(pos, 0)], 1.0)
+
+    last_pos = np.searchsorted(f_stock, np.arange(len(cats)), side="right") - 1
+    latest = f_val[last_pos]
+    per_stock = np.where(row_code >= 0, latest[np.maximum(row_code, 0)], 1.0)
+    # 早于第一次因子记录的K线按第一档因子处理
+    first_pos = np.searchsorted(f_stock, np.arange(len(cats)), side="left")
+    first = f_val[np.minimum(first_pos, len(f_val) - 1)]
+    per_row = np.where((row_code >= 0) & ~hit, first[np.maximum(row_code, 0)], per_row)
+    return per_row, per_stock
+
+
+def to_qfq(df, factors, stock=None):
+    """Copy of `df` with raw prices turned into qfq and hfq averages into qfq units."""
+    if factors.empty or df.empty:
+        return df
+    f, latest = factor_lookup(df, factors, stock)
+    out = df.copy()
+    for col in PRICE_COLS:
+        if col in out.columns:
+            out[col] = out[col].to_numpy(dtype=float) * f / latest
+    for col in SCALED_COLS:
+        if col in out.columns:
+            out[col] = out[col].to_numpy(dtype=float) / latest
+    return out
+
+
+def to_hfq(df, factors, stock=None):
+    """Copy of `df` with raw prices turned into hfq prices."""
+    if factors.empty or df.empty:
+        return df
+    f, _ = factor_lookup(df, factors, stock)
+    out = df.copy()
+    for col in PRICE_COLS:
+        if col in out.columns:
+            out[col] = out[col].to_numpy(dtype=float) * f
+    return out
+
+
+def factor_ranges_sql(compact=False):
+    """
+    SELECT over adj_factors with one (k, since, until, factor) row per
+    factor step, `until` NULL on the latest one. k/since are keyed like
+    daily_data (stock name, 'YYYY-MM-DD') or, with compact=True, like
+    daily_bars (stock_id, YYYYMMDD), so bars join their factor on a range
+    instead of running a lookup per row. Bars before the first step match
+    no range (factor 1.0).
+    """
+    if not compact:
+        return """
+            SELECT stock AS k, 日期 AS since, LEAD(日期) OVER (PARTITION BY stock ORDER BY 日期) AS until, factor
+            FROM adj_factors
+        """
+    from webapp.db.compact_schema import DATE_TO_INT
+
+    return f"""
+        SELECT k, since, LEAD(since) OVER (PARTITION BY k ORDER BY since) AS until, factor FROM (
+            SELECT i.id AS k, {DATE_TO_INT.format('a.日期')} AS since, a.factor
+            FROM adj_factors a JOIN stock_ids i ON i.name = a.stock
+        )
+    """
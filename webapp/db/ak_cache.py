@@ -0,0 +1,279 @@
+"""On-disk response cache for akshare calls.
+
+`CachedAkshare(source)` stands in for the akshare module (or FakeAkshare).
+Any `source.<function>(...)` call is keyed by function name plus
+arguments and its DataFrame result is stored as a zlib-compressed pickle
+under `<root>/<function>/`. A small SQLite index next to the files tracks
+each entry's creation time, last access and size.
+
+Modes:
+    cache    serve fresh entries, call the source on a miss or an expired entry (default)
+    refresh  always call the source and overwrite the entry
+    replay   serve recorded entries only, never touch the network;
+             a miss raises CacheMiss
+
+TTLs are per function (TTLS). A stock_zh_a_hist range that ends before
+today never changes, so it never expires. Once the total size passes
+`max_bytes`, the least recently used entries are evicted. Responses are
+stored as soon as they arrive, so re-running a fetch that died halfway
+only downloads the stocks that are missing.
+
+Usage:
+    python -m webapp.db.ak_cache [--root akshare_cache] stats|purge|clear
+"""
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import date
+
+import pandas as pd
+
+DEFAULT_ROOT = "akshare_cache"
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+MODES = ("cache", "refresh", "replay", "off")
+
+# 秒；None 表示不过期
+TTLS = {
+    "stock_zh_a_hist": 12 * 3600,
+    "stock_zh_a_spot_em": 6 * 3600,
+    "stock_individual_info_em": 24 * 3600,
+}
+DEFAULT_TTL = 24 * 3600
+
+
+class CacheMiss(LookupError):
+    pass
+
+
+def default_mode(fallback="cache"):
+    return os.environ.get("STOCK_AK_CACHE") or fallback
+
+
+class CachedAkshare:
+    def __init__(self, source, root=DEFAULT_ROOT, mode="cache", max_bytes=DEFAULT_MAX_BYTES, ttls=None):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}")
+        self.source = source
+        self.root = root
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.ttls = dict(TTLS, **(ttls or {}))
+        self.hits = self.misses = 0
+        # 可重入：持锁的方法里第一次访问索引时 _db() 还要再拿一次
+        self._lock = threading.RLock()
+        # 索引库在第一次真正访问缓存时才打开，只读调用方不会建目录
+        self._index = None
+
+    def _db(self):
+        """The SQLite index, opened (and the cache directory created) on first use."""
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    os.makedirs(self.root, exist_ok=True)
+                    index = sqlite3.connect(os.path.join(self.root, "index.db"), check_same_thread=False)
+                    index.execute(
+                        """
+                        CREATE TABLE IF NOT EXISTS entries (
+                            key TEXT PRIMARY KEY,
+                            func TEXT,
+                            args TEXT,
+                            path TEXT,
+                            created REAL,
+                            accessed REAL,
+                            size INTEGER
+                        )
+                        """
+                    )
+                    index.commit()
+                    self._index = index
+        return self._index
+
+    def close(self):
+        with self._lock:
+            if self._index is not None:
+                self._index.close()
+                self._index = None
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        target = getattr(self.source, name) if self.mode != "replay" else None
+        if target is not None and not callable(target):
+            return target
+
+        def call(*args, **kwargs):
+            return self.call(name, target, args, kwargs)
+        call.__name__ = name
+        return call
+
+    @staticmethod
+    def make_key(func, args, kwargs):
+        text = json.dumps([func, list(args), kwargs], sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(text.encode("utf-8")).hexdigest(), text
+
+    def ttl(self, func, kwargs):
+        if func == "stock_zh_a_hist":
+            # 结束日期在今天之前的历史区间不会再变
+            end = str(kwargs.get("end_date", ""))
+            if end and end < date.today().strftime("%Y%m%d"):
+                return None
+        return self.ttls.get(func, DEFAULT_TTL)
+
+    def call(self, func, target, args, kwargs):
+        key, text = self.make_key(func, args, kwargs)
+        if self.mode != "refresh":
+            value = self.get(key, None if self.mode == "replay" else self.ttl(func, kwargs))
+            if value is not None:
+                self.hits += 1
+                return value
+        if self.mode == "replay":
+            raise CacheMiss(f"no recorded response for {text}")
+        self.misses += 1
+        value = target(*args, **kwargs)
+        # 空结果可能是临时失败，不缓存
+        if value is not None and not (isinstance(value, pd.DataFrame) and value.empty):
+            self.put(key, func, text, value)
+        return value
+
+    def refresh(self, func, *args, **kwargs):
+        """Call the source and overwrite the stored response."""
+        key, text = self.make_key(func, args, kwargs)
+        value = getattr(self.source, func)(*args, **kwargs)
+        if value is not None and not (isinstance(value, pd.DataFrame) and value.empty):
+            self.put(key, func, text, value)
+        return value
+
+    def get(self, key, ttl):
+        with self._lock:
+            row = self._db().execute("SELECT path, created FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        path, created = row
+        if ttl is not None and time.time() - created > ttl:
+            return None
+        try:
+            with open(os.path.join(self.root, path), "rb") as f:
+                value = pickle.loads(zlib.decompress(f.read()))
+        except (OSError, zlib.error, pickle.UnpicklingError, EOFError):
+            self._delete([key])
+            return None
+        with self._lock:
+            self._db().execute("UPDATE entries SET accessed = ? WHERE key = ?", (time.time(), key))
+            self._db().commit()
+        return value
+
+    def put(self, key, func, text, value):
+        rel = os.path.join(func, key[:2], key + ".pkl.z")
+        path = os.path.join(self.root, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), 6)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        now = time.time()
+        with self._lock:
+            self._db().execute(
+                "INSERT OR REPLACE INTO entries (key, func, args, path, created, accessed, size)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, func, text, rel, now, now, len(data)),
+            )
+            self._db().commit()
+        self.evict()
+
+    def total_bytes(self):
+        with self._lock:
+            return self._db().execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def evict(self):
+        """Drop least recently used entries until the store is under 90% of max_bytes."""
+        total = self.total_bytes()
+        if total <= self.max_bytes:
+            return 0
+        target = self.max_bytes * 0.9
+        victims = []
+        with self._lock:
+            for key, size in self._db().execute("SELECT key, size FROM entries ORDER BY accessed"):
+                if total <= target:
+                    break
+                victims.append(key)
+                total -= size
+        self._delete(victims)
+        return len(victims)
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            rows = self._db().execute("SELECT key, func, args, created FROM entries").fetchall()
+        expired = []
+        for key, func, text, created in rows:
+            kwargs = json.loads(text)[2]
+            ttl = self.ttl(func, kwargs)
+            if ttl is not None and now - created > ttl:
+                expired.append(key)
+        self._delete(expired)
+        return len(expired)
+
+    def clear(self):
+        with self._lock:
+            keys = [r[0] for r in self._db().execute("SELECT key FROM entries")]
+        self._delete(keys)
+        return len(keys)
+
+    def _delete(self, keys):
+        if not keys:
+            return
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                for (rel,) in self._db().execute(f"SELECT path FROM entries WHERE key IN ({placeholders})", chunk):
+                    try:
+                        os.remove(os.path.join(self.root, rel))
+                    except OSError:
+                        pass
+                self._db().execute(f"DELETE FROM entries WHERE key IN ({placeholders})", chunk)
+            self._db().commit()
+
+    def stats(self):
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT func, COUNT(*), SUM(size) FROM entries GROUP BY func ORDER BY func"
+            ).fetchall()
+        return {func: {"entries": n, "bytes": size} for func, n, size in rows}
+
+
+def wrap(source, mode=None, root=None, max_bytes=DEFAULT_MAX_BYTES):
+    """`source` behind a CachedAkshare, or unchanged when mode is 'off'."""
+    mode = mode or default_mode()
+    if mode == "off":
+        return source
+    return CachedAkshare(source, root=root or os.environ.get("STOCK_AK_CACHE_DIR", DEFAULT_ROOT),
+                         mode=mode, max_bytes=max_bytes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or prune the akshare response cache")
+    parser.add_argument("command", choices=["stats", "purge", "clear"])
+    parser.add_argument("--root", default=os.environ.get("STOCK_AK_CACHE_DIR", DEFAULT_ROOT), help="Cache directory")
+    args = parser.parse_args()
+
+    cache = CachedAkshare(None, root=args.root, mode="replay")
+    if args.command == "stats":
+        for func, s in cache.stats().items():
+            print(f"{func}: {s['entries']} entries, {s['bytes'] / 1e6:.1f}MB")
+        print(f"total {cache.total_bytes() / 1e6:.1f}MB")
+    elif args.command == "purge":
+        print(f"removed {cache.purge_expired()} expired entries")
+    elif args.command == "clear":
+        print(f"removed {cache.clear()} entries")
+
+
+if __name__ == "__main__":
+    main()
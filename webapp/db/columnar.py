@@ -0,0 +1,218 @@
+"""Columnar, memory-mapped copy of daily_data.
+
+Layout of the store directory (default `stock_data.columnar/` next to the
+database):
+
+    manifest.json          segment list and each stock's last synced 日期
+    seg-000001/
+        index.json         stocks with their row offsets and counts
+        date.npy           int32 YYYYMMDD
+        open.npy ... amp.npy
+
+Inside a segment rows are sorted by (stock, 日期), so a stock is one
+contiguous slice of every column. `sync` appends only the rows newer than
+each stock's last synced date as a new segment and compacts once there
+are too many segments. Arrays are opened with `np.load(mmap_mode='r')`,
+so reads decode nothing row by row. Rows rewritten in place in SQLite
+(e.g. by calculate_pct_and_amp_for_all) need `sync(rebuild=True)`.
+"""
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+from webapp.db.fetcher import last_dates
+
+# daily_data 列名 -> 文件名
+FIELDS = {
+    "开盘": "open",
+    "最高": "high",
+    "最低": "low",
+    "收盘": "close",
+    "成交量": "volume",
+    "涨跌幅": "pct",
+    "振幅": "amp",
+}
+MAX_SEGMENTS = 8
+
+
+def dates_to_int(values):
+    s = pd.Series(values, dtype=str).str.slice(0, 10).str.replace("-", "", regex=False)
+    return s.astype(np.int32).to_numpy()
+
+
+# 与 pd.to_datetime 解析 'YYYY-MM-DD' 得到的精度一致，SQLite 与列式读出的帧才完全相同
+_DATE_DTYPE = pd.to_datetime(pd.Series(["2000-01-01"])).dtype
+
+
+def int_to_dates(values):
+    """YYYYMMDD integers -> datetime64 array, by arithmetic instead of parsing."""
+    values = np.asarray(values, dtype=np.int64)
+    months = (values // 10000 - 1970) * 12 + values // 100 % 100 - 1
+    days = months.astype("datetime64[M]").astype("datetime64[D]") + (values % 100 - 1).astype("timedelta64[D]")
+    return days.astype(_DATE_DTYPE)
+
+
+class _Segment:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "index.json"), encoding="utf-8") as f:
+            index = json.load(f)
+        self.stocks = index["stocks"]
+        self.position = {s: i for i, s in enumerate(self.stocks)}
+        self.offsets = np.asarray(index["offsets"], dtype=np.int64)
+        self.counts = np.asarray(index["counts"], dtype=np.int64)
+        self.columns = {"date": np.load(os.path.join(path, "date.npy"), mmap_mode="r")}
+        for name in FIELDS.values():
+            self.columns[name] = np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+
+    def tail_rows(self, stocks, day_count):
+        """Row numbers of the last `day_count` rows for each requested stock."""
+        pos = np.array([self.position[s] for s in stocks if s in self.position], dtype=np.int64)
+        if len(pos) == 0:
+            return np.empty(0, dtype=np.int64)
+        counts = self.counts[pos]
+        lens = counts if day_count is None else np.minimum(counts, day_count)
+        starts = self.offsets[pos] + counts - lens
+        # 把每段 [start, start+len) 拼成一个行号数组
+        first = np.cumsum(lens) - lens
+        return np.repeat(starts - first, lens) + np.arange(lens.sum())
+
+
+class ColumnarStore:
+    def __init__(self, root):
+        self.root = root
+        self._segments = None
+        self._manifest = None
+
+    @staticmethod
+    def default_root(db_path):
+        return os.path.splitext(db_path)[0] + ".columnar"
+
+    def exists(self):
+        return os.path.exists(os.path.join(self.root, "manifest.json"))
+
+    @property
+    def manifest(self):
+        if self._manifest is None:
+            path = os.path.join(self.root, "manifest.json")
+            if os.path.exists(path):
+                with open(path, encoding="utf-8") as f:
+                    self._manifest = json.load(f)
+            else:
+                self._manifest = {"segments": [], "last_date": {}, "next_segment": 1}
+        return self._manifest
+
+    @property
+    def segments(self):
+        if self._segments is None:
+            self._segments = [_Segment(os.path.join(self.root, name)) for name in self.manifest["segments"]]
+        return self._segments
+
+    def has_stock(self, stock):
+        return stock in self.manifest["last_date"]
+
+    def _save_manifest(self):
+        tmp = os.path.join(self.root, "manifest.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(self.root, "manifest.json"))
+        self._segments = None
+
+    def _write_segment(self, df):
+        name = f"seg-{self.manifest['next_segment']:06d}"
+        self.manifest["next_segment"] += 1
+        path = os.path.join(self.root, name)
+        os.makedirs(path, exist_ok=True)
+        df = df.sort_values(["stock", "日期"], kind="stable").reset_index(drop=True)
+        stocks, counts = np.unique(df["stock"].to_numpy(), return_counts=True)
+        offsets = np.cumsum(counts) - counts
+        np.save(os.path.join(path, "date.npy"), dates_to_int(df["日期"]))
+        for col, fname in FIELDS.items():
+            if col in df.columns:
+                values = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=np.float64)
+            else:
+                values = np.full(len(df), np.nan)
+            np.save(os.path.join(path, f"{fname}.npy"), values)
+        with open(os.path.join(path, "index.json"), "w", encoding="utf-8") as f:
+            json.dump({"stocks": stocks.tolist(), "offsets": offsets.tolist(), "counts": counts.tolist()},
+                      f, ensure_ascii=False)
+        return name
+
+    def sync(self, conn, rebuild=False):
+        """Copy rows newer than each stock's last synced date; returns rows added."""
+        if rebuild and os.path.exists(self.root):
+            shutil.rmtree(self.root)
+            self._manifest = None
+        os.makedirs(self.root, exist_ok=True)
+        synced = self.manifest["last_date"]
+        newest = last_dates(conn)
+        behind = {s: synced.get(s, "") for s, d in newest.items() if str(d)[:10] > synced.get(s, "")}
+        if not behind:
+            return 0
+
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS _columnar_since (stock TEXT PRIMARY KEY, since TEXT)")
+        conn.execute("DELETE FROM _columnar_since")
+        conn.executemany("INSERT INTO _columnar_since VALUES (?, ?)", list(behind.items()))
+        cols = ", ".join(f"d.{c}" for c in ["stock", "日期", *FIELDS])
+        df = pd.read_sql(
+            f"""
+            SELECT {cols} FROM _columnar_since s
+            JOIN daily_data d ON d.stock = s.stock AND d.日期 > s.since
+            """,
+            conn,
+        )
+        # 结束临时表写入开启的事务，释放主库上的共享锁
+        conn.commit()
+        if df.empty:
+            return 0
+        self.manifest["segments"].append(self._write_segment(df))
+        df["日期"] = df["日期"].astype(str).str.slice(0, 10)
+        synced.update(df.groupby("stock")["日期"].max().to_dict())
+        self._save_manifest()
+        if len(self.manifest["segments"]) > MAX_SEGMENTS:
+            self.compact()
+        return len(df)
+
+    def compact(self):
+        """Merge every segment into one."""
+        old = list(self.manifest["segments"])
+        if len(old) <= 1:
+            return
+        df = self.scan()
+        self.manifest["segments"] = [self._write_segment(df)]
+        self._save_manifest()
+        for name in old:
+            shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+
+    def scan(self, stocks=None, day_count=None, columns=None):
+        """
+        Long frame (stock, 日期, fields...) sorted by stock and 日期, limited
+        to each stock's last `day_count` rows when given.
+        """
+        columns = [c for c in (columns or FIELDS) if c in FIELDS]
+        parts = []
+        for seg in self.segments:
+            wanted = seg.stocks if stocks is None else stocks
+            rows = seg.tail_rows(wanted, day_count)
+            if len(rows) == 0:
+                continue
+            stock_idx = np.searchsorted(seg.offsets, rows, side="right") - 1
+            part = {"stock": np.asarray(seg.stocks, dtype=object)[stock_idx],
+                    "日期": np.asarray(seg.columns["date"][rows])}
+            for col in columns:
+                part[col] = np.asarray(seg.columns[FIELDS[col]][rows])
+            parts.append(pd.DataFrame(part))
+        if not parts:
+            return pd.DataFrame(columns=["stock", "日期", *columns])
+        df = pd.concat(parts, ignore_index=True)
+        df = df.sort_values(["stock", "日期"], kind="stable")
+        if day_count is not None and len(parts) > 1:
+            df = df.groupby("stock", sort=False).tail(day_count)
+        df["日期"] = int_to_dates(df["日期"].to_numpy())
+        return df.reset_index(drop=True)
+
+    def query(self, stock, day_count=30):
+        """Same frame as StockDatabase.query_daily_data for one stock."""
+        return self.scan([stock], day_count)
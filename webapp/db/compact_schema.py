@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""Migrate `daily_data` to the compact storage schema.
+
+The legacy table keys every row by the stock's Chinese name and a
+'YYYY-MM-DD' string, on a rowid table, so each key is stored twice. The
+compact schema stores:
+
+- `stock_ids`: one integer id per stock name (with its code)
+- `daily_bars`: (stock_id INTEGER, 日期 INTEGER YYYYMMDD, prices...) as a
+  clustered WITHOUT ROWID table, so a stock's bars are one contiguous
+  range of the primary key b-tree
+
+and replaces `daily_data` with a view of the same columns. INSTEAD OF
+triggers on the view keep the old INSERT/UPDATE/DELETE statements
+(calculate_pct_and_amp_for_all, db_manipulate.py) working. StockDatabase
+reads `daily_bars` directly on its hot paths, and the fetchers write it
+directly through `write_bars`.
+
+By default the old table is kept as `daily_data_legacy`, so the file
+only gets smaller with --drop-legacy (then VACUUM gives the pages back).
+
+Usage:
+    python -m webapp.db.compact_schema [--db stock_data.db] [--drop-legacy] [--no-vacuum]
+"""
+import argparse
+import os
+import sqlite3
+import time
+
+BAR_COLS = ["开盘", "最高", "最低", "收盘", "成交量", "涨跌幅", "振幅"]
+
+# YYYY-MM-DD 文本 <-> YYYYMMDD 整数
+DATE_TO_INT = "CAST(replace(substr({0}, 1, 10), '-', '') AS INTEGER)"
+INT_TO_DATE = "printf('%04d-%02d-%02d', {0} / 10000, {0} / 100 % 100, {0} % 100)"
+
+
+def is_compact(conn: sqlite3.Connection) -> bool:
+    cur = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='daily_bars'")
+    return cur.fetchone() is not None
+
+
+def create_compact_tables(conn: sqlite3.Connection):
+    cols = "".join(f"            {c} REAL,\n" for c in BAR_COLS)
+    conn.executescript(
+        f"""
+        CREATE TABLE IF NOT EXISTS stocks (
+            code TEXT PRIMARY KEY,
+            name TEXT,
+            mv TEXT,
+            circ_mv TEXT
+        );
+        CREATE TABLE IF NOT EXISTS stock_ids (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE,
+            code TEXT
+        );
+        CREATE TABLE IF NOT EXISTS daily_bars (
+            stock_id INTEGER NOT NULL,
+            日期 INTEGER NOT NULL,
+{cols}            PRIMARY KEY(stock_id, 日期)
+        ) WITHOUT ROWID;
+        """
+    )
+
+
+def create_compat_view(conn: sqlite3.Connection):
+    """`daily_data` view with the legacy columns, writable through triggers."""
+    cols = ", ".join(f"b.{c}" for c in BAR_COLS)
+    new_cols = ", ".join(f"NEW.{c}" for c in BAR_COLS)
+    set_cols = ", ".join(f"{c} = NEW.{c}" for c in BAR_COLS)
+    old_key = (
+        "stock_id = (SELECT id FROM stock_ids WHERE name = OLD.stock)"
+        f" AND 日期 = {DATE_TO_INT.format('OLD.日期')}"
+    )
+    conn.executescript(
+        f"""
+        CREATE VIEW IF NOT EXISTS daily_data AS
+            SELECT i.name AS stock, {INT_TO_DATE.format('b.日期')} AS 日期, {cols}
+            FROM daily_bars b JOIN stock_ids i ON i.id = b.stock_id;
+
+        CREATE TRIGGER IF NOT EXISTS daily_data_insert INSTEAD OF INSERT ON daily_data
+        BEGIN
+            -- 不用 INSERT OR IGNORE：外层 INSERT OR REPLACE 会覆盖冲突策略并换掉 id
+            INSERT INTO stock_ids (name, code)
+                SELECT NEW.stock, (SELECT code FROM stocks WHERE name = NEW.stock)
+                WHERE NOT EXISTS (SELECT 1 FROM stock_ids WHERE name = NEW.stock);
+            INSERT OR REPLACE INTO daily_bars (stock_id, 日期, {", ".join(BAR_COLS)})
+                VALUES ((SELECT id FROM stock_ids WHERE name = NEW.stock),
+                        {DATE_TO_INT.format('NEW.日期')}, {new_cols});
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS daily_data_update INSTEAD OF UPDATE ON daily_data
+        BEGIN
+            UPDATE daily_bars SET {set_cols} WHERE {old_key};
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS daily_data_delete INSTEAD OF DELETE ON daily_data
+        BEGIN
+            DELETE FROM daily_bars WHERE {old_key};
+        END;
+        """
+    )
+
+
+def write_bars(conn: sqlite3.Connection, hist):
+    """Upsert a daily_data-layout frame (stock, 日期, bar columns) into either schema."""
+    hist = hist.astype(object).where(hist.notna(), None)
+    if not is_compact(conn):
+        cols = list(hist.columns)
+        conn.executemany(
+            f"INSERT OR REPLACE INTO daily_data ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+            hist.itertuples(index=False, name=None),
+        )
+        return
+    names = list(dict.fromkeys(hist["stock"]))
+    conn.executemany(
+        """
+        INSERT INTO stock_ids (name, code)
+        SELECT ?, (SELECT code FROM stocks WHERE name = ?)
+        WHERE NOT EXISTS (SELECT 1 FROM stock_ids WHERE name = ?)
+        """,
+        [(n, n, n) for n in names],
+    )
+    placeholders = ",".join("?" * len(names))
+    ids = dict(conn.execute(f"SELECT name, id FROM stock_ids WHERE name IN ({placeholders})", names))
+    cols = [c for c in BAR_COLS if c in hist.columns]
+    # sqlite3 不接受 numpy 整数，日期先转成 Python int
+    dates = [int(str(d)[:10].replace("-", "")) for d in hist["日期"]]
+    rows = zip(hist["stock"].map(ids).tolist(), dates, *(hist[c].tolist() for c in cols))
+    conn.executemany(
+        f"INSERT OR REPLACE INTO daily_bars (stock_id, 日期{''.join(', ' + c for c in cols)})"
+        f" VALUES ({', '.join('?' * (len(cols) + 2))})",
+        rows,
+    )
+
+
+def migrate(db_path: str, drop_legacy: bool = False, vacuum: bool = True):
+    conn = sqlite3.connect(db_path)
+    try:
+        if is_compact(conn):
+            print("daily_data already uses the compact schema")
+            return
+        size_before = os.path.getsize(db_path)
+        started = time.monotonic()
+        legacy_cols = [r[1] for r in conn.execute("PRAGMA table_info(daily_data)")]
+        if not legacy_cols:
+            print("no daily_data table; creating an empty compact schema")
+
+        create_compact_tables(conn)
+        if legacy_cols:
+            # id 按代码顺序分配，同一板块的股票在 B 树中相邻
+            conn.execute(
+                """
+                INSERT INTO stock_ids (name, code)
+                SELECT d.stock, (SELECT code FROM stocks s WHERE s.name = d.stock) AS code
+                FROM (SELECT stock FROM daily_data GROUP BY stock) d
+                ORDER BY code IS NULL, code, d.stock
+                """
+            )
+            src_cols = ", ".join(f"d.{c}" if c in legacy_cols else "NULL" for c in BAR_COLS)
+            conn.execute(
+                f"""
+                INSERT OR REPLACE INTO daily_bars (stock_id, 日期, {", ".join(BAR_COLS)})
+                SELECT i.id, {DATE_TO_INT.format('d.日期')}, {src_cols}
+                FROM daily_data d JOIN stock_ids i ON i.name = d.stock
+                ORDER BY i.id, 2
+                """
+            )
+            if drop_legacy:
+                conn.execute("DROP TABLE daily_data")
+            else:
+                conn.execute("ALTER TABLE daily_data RENAME TO daily_data_legacy")
+        create_compat_view(conn)
+        conn.commit()
+
+        rows = conn.execute("SELECT COUNT(*) FROM daily_bars").fetchone()[0]
+        stocks = conn.execute("SELECT COUNT(*) FROM stock_ids").fetchone()[0]
+        print(f"migrated {rows} rows for {stocks} stocks in {time.monotonic() - started:.1f}s")
+        if vacuum:
+            conn.execute("VACUUM")
+            conn.execute("ANALYZE")
+            size_after = os.path.getsize(db_path)
+            print(f"db size {size_before / 1e6:.1f}MB -> {size_after / 1e6:.1f}MB"
+                  + ("" if drop_legacy else " (legacy table kept as daily_data_legacy)"))
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate daily_data to the compact WITHOUT ROWID schema")
+    parser.add_argument("--db", default="stock_data.db", help="SQLite DB path")
+    parser.add_argument("--drop-legacy", action="store_true", help="Drop the old daily_data table instead of renaming it to daily_data_legacy "
+                             "(destructive; without it the file does not shrink)")
+    parser.add_argument("--no-vacuum", action="store_true", help="Skip VACUUM/ANALYZE after migrating")
+    args = parser.parse_args()
+
+    migrate(args.db, drop_legacy=args.drop_legacy, vacuum=not args.no_vacuum)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Shared SQLite connections for the whole package.
+
+Every connection is opened in WAL mode with the pragmas below, so readers
+(the Dash callbacks) never block on the fetcher and vice versa. Reads use
+one pooled connection per thread; writes go through a single dedicated
+writer connection guarded by a lock.
+
+The database path defaults to `stock_data.db` and can be changed with the
+STOCK_DB_PATH environment variable or `set_db_path()`.
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from webapp import metrics
+
+DEFAULT_DB_PATH = "stock_data.db"
+
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -64000,        # KiB, ~64MB page cache per connection
+    "mmap_size": 268435456,      # 256MB memory-mapped reads
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,
+}
+
+_db_path = os.environ.get("STOCK_DB_PATH", DEFAULT_DB_PATH)
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_db_path():
+    return _db_path
+
+
+def set_db_path(path):
+    global _db_path
+    _db_path = path
+
+
+def connect(path=None, check_same_thread=True):
+    # STOCK_METRICS=1 时每条语句计时，慢查询写日志
+    factory = metrics.TimedConnection if metrics.ENABLED else sqlite3.Connection
+    conn = sqlite3.connect(path or get_db_path(), timeout=PRAGMAS["busy_timeout"] / 1000,
+                           check_same_thread=check_same_thread, factory=factory)
+    for name, value in PRAGMAS.items():
+        conn.execute(f"PRAGMA {name}={value}")
+    return conn
+
+
+class ConnectionPool:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._writer = None
+        self._write_lock = threading.RLock()
+
+    def reader(self):
+        """This thread's connection; opened on first use and reused afterwards."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect(self.path)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def writer(self):
+        """The shared writer connection; commits on exit, rolls back on error."""
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = connect(self.path, check_same_thread=False)
+            try:
+                yield self._writer
+                self._writer.commit()
+            except Exception:
+                self._writer.rollback()
+                raise
+
+
+def get_pool(path=None):
+    key = os.path.abspath(path or get_db_path())
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(key)
+        return pool
+
+
+def reader(path=None):
+    return get_pool(path).reader()
+
+
+def writer(path=None):
+    return get_pool(path).writer()
@@ -0,0 +1,67 @@
+"""Notifications for writes to daily_data.
+
+Two channels:
+
+- In-process: caches register with `on_bars_written`; StockDatabase calls
+  `bars_written(stocks)` after it has written bars for those stocks
+  (stocks=None: any stock). Only listeners in the writing process hear it.
+- Cross-process: the writer also bumps the `bars_version` row in `meta`
+  (`bump_bars_version`). `python app.py db fetch` runs in its own process,
+  so the Dash server puts `bars_version(conn)` into its figure cache key
+  instead of relying on the listener; a bump makes every cached figure
+  miss, including changes MAX(日期) does not show (new factors, reset-raw,
+  recomputed 涨跌幅).
+
+`stocks_version` works the same way for the `stocks` table: the snapshot
+import bumps it when a code is added or renamed, and the symbol index
+reloads when it moves.
+"""
+import sqlite3
+
+VERSION_KEY = "bars_version"
+STOCKS_VERSION_KEY = "stocks_version"
+
+_listeners = []
+
+
+def on_bars_written(fn):
+    _listeners.append(fn)
+    return fn
+
+
+def bars_written(stocks):
+    if stocks is not None:
+        stocks = list(stocks)
+        if not stocks:
+            return
+    for fn in list(_listeners):
+        try:
+            fn(stocks)
+        except Exception as e:
+            print(f"bars_written listener {fn.__name__} failed: {e}")
+
+
+def bump_bars_version(conn, key=VERSION_KEY):
+    """Increment meta.bars_version (or another version key); call on the writer connection."""
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    conn.execute(
+        "INSERT INTO meta (key, value) VALUES (?, '1')"
+        " ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1",
+        (key,),
+    )
+
+
+def bars_version(conn, key=VERSION_KEY):
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return int(row[0]) if row else 0
+
+
+def bump_stocks_version(conn):
+    bump_bars_version(conn, STOCKS_VERSION_KEY)
+
+
+def stocks_version(conn):
+    return bars_version(conn, STOCKS_VERSION_KEY)
@@ -0,0 +1,144 @@
+"""Offline stand-in for the akshare endpoints used by StockDatabase.
+
+The responses are synthetic but deterministic per symbol, and every call
+sleeps for `latency` seconds to mimic the network round trip, so fetch
+throughput can be benchmarked without touching the real API:
+
+    python app.py db fetch 200 --workers 16 --rps 40 --offline 0.3
+"""
+import time
+import zlib
+import numpy as np
+import pandas as pd
+
+HISTORY_START = "2015-01-01"
+
+# 地名 + 行业 + 后缀拼出的名称，形如 江西铜业、华东科技股份
+_REGIONS = ["江西", "华东", "中原", "长江", "浙江", "广汇", "海南", "北方", "西部", "东方",
+            "南京", "天山", "金山", "中金", "华夏", "新疆", "四川", "福建", "山东", "湖南",
+            "上海", "深圳", "武汉", "大连", "宁波", "青岛", "苏州", "合肥", "成都", "厦门"]
+_TRADES = ["铜业", "科技", "医药", "电子", "能源", "银行", "证券", "地产", "化工", "钢铁",
+           "电力", "汽车", "食品", "建设", "传媒", "环保", "材料", "机械", "电气", "通信",
+           "航空", "港口", "物流", "软件", "光电", "纺织", "农业", "矿业", "水务", "旅游",
+           "精工", "生物", "智能", "新材", "重工", "轻工", "实业", "发展", "信息", "半导"]
+_SUFFIXES = ["", "股份", "集团", "控股", "科技"]
+
+
+def fake_names(count):
+    """`count` distinct, deterministic stock names."""
+    rng = np.random.default_rng(1)
+    names = []
+    # 先用不带后缀的四字名，用完再加后缀
+    for suffix in _SUFFIXES:
+        group = [r + t + suffix for r in _REGIONS for t in _TRADES]
+        names += [group[i] for i in rng.permutation(len(group))]
+    names = names[:count]
+    return names + [f"模拟股份{i}" for i in range(len(names) + 1, count + 1)]
+
+
+class FakeAkshare:
+    def __init__(self, latency=0.3, stock_count=5000):
+        self.latency = latency
+        self.stock_count = stock_count
+
+    def _symbol_seed(self, symbol):
+        return zlib.crc32(str(symbol).encode("utf-8"))
+
+    def _dates(self, end_date):
+        days = np.arange(np.datetime64(HISTORY_START), np.datetime64(pd.Timestamp(end_date).date()) + 1)
+        return days[np.is_busday(days)]
+
+    def _actions(self, symbol):
+        """(ex-date, hfq ratio) per year: a cash dividend, now and then a bonus share issue."""
+        rng = np.random.default_rng(self._symbol_seed(symbol) + 1)
+        first_year = int(HISTORY_START[:4])
+        out = []
+        for year in range(first_year + 1, 2051):
+            day = np.busday_offset(np.datetime64(f"{year}-05-01"), int(rng.integers(0, 60)), roll="forward")
+            ratio = 1.3 if rng.random() < 0.1 else 1 + rng.uniform(0.005, 0.03)
+            out.append((day, ratio))
+        return out
+
+    def _factors(self, symbol, dates):
+        factor = np.ones(len(dates))
+        for day, ratio in self._actions(symbol):
+            factor[dates >= day] *= ratio
+        return factor
+
+    def _history(self, symbol, end_date, adjust=""):
+        # 从固定起点生成整段走势再切片，保证增量抓取时同一天的数据一致
+        dates = self._dates(end_date)
+        rng = np.random.default_rng(self._symbol_seed(symbol))
+        n = len(dates)
+        base = rng.uniform(3, 80)
+        # 连续走势即后复权价，除以后复权因子得到不复权价
+        close = base * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+        open_ = close * (1 + rng.normal(0, 0.01, n))
+        high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.01, n)))
+        low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.01, n)))
+        volume = rng.lognormal(11, 0.6, n).round()
+        factor = self._factors(symbol, dates)
+        raw = {name: (values / factor).round(2) for name, values in
+               (("开盘", open_), ("收盘", close), ("最高", high), ("最低", low))}
+        # 交易所的前收盘按除权除息调整
+        prev_close = np.concatenate([[raw["收盘"][0]], raw["收盘"][:-1] * factor[:-1] / factor[1:]])
+        scale = {"qfq": factor / factor[-1], "hfq": factor}.get(adjust, np.ones(n)) if n else np.ones(n)
+        return pd.DataFrame({
+            "日期": np.datetime_as_string(dates, unit="D"),
+            "股票代码": symbol,
+            "开盘": (raw["开盘"] * scale).round(2),
+            "收盘": (raw["收盘"] * scale).round(2),
+            "最高": (raw["最高"] * scale).round(2),
+            "最低": (raw["最低"] * scale).round(2),
+            "成交量": volume,
+            "成交额": (volume * raw["收盘"] * 100).round(2),
+            "振幅": ((raw["最高"] - raw["最低"]) / prev_close * 100).round(2),
+            "涨跌幅": ((raw["收盘"] - prev_close) / prev_close * 100).round(2),
+            "涨跌额": (raw["收盘"] - prev_close).round(2),
+            "换手率": rng.uniform(0.1, 5, n).round(2),
+        })
+
+    def stock_zh_a_hist(self, symbol="000001", period="daily", start_date="19700101",
+                        end_date="20500101", adjust=""):
+        time.sleep(self.latency)
+        end = min(pd.Timestamp(end_date), pd.Timestamp.today().normalize())
+        df = self._history(symbol, end, adjust)
+        start = pd.Timestamp(start_date).strftime("%Y-%m-%d")
+        return df[df["日期"] >= start].reset_index(drop=True)
+
+    def stock_zh_a_daily(self, symbol="sh600000", start_date="19900101", end_date="21000101",
+                         adjust="hfq-factor"):
+        """Only the factor tables: hfq-factor steps, newest first, with the listing-day base row."""
+        time.sleep(self.latency)
+        if adjust != "hfq-factor":
+            raise NotImplementedError(f"FakeAkshare.stock_zh_a_daily does not serve adjust={adjust!r}")
+        code = str(symbol)[-6:]
+        today = np.datetime64(pd.Timestamp.today().date())
+        rows = [(np.datetime64(HISTORY_START), 1.0)]
+        factor = 1.0
+        for day, ratio in self._actions(code):
+            if day > today:
+                break
+            factor *= ratio
+            rows.append((day, factor))
+        df = pd.DataFrame(rows, columns=["date", "hfq_factor"])
+        df["date"] = pd.to_datetime(df["date"])
+        return df.iloc[::-1].reset_index(drop=True)
+
+    def stock_zh_a_spot_em(self):
+        time.sleep(self.latency)
+        rng = np.random.default_rng(0)
+        codes = [f"{600000 + i:06d}" if i % 2 else f"{i:06d}" for i in range(1, self.stock_count + 1)]
+        mv = rng.lognormal(23, 1.2, len(codes)).round()
+        return pd.DataFrame({
+            "代码": codes,
+            "名称": fake_names(len(codes)),
+            "总市值": mv,
+            "流通市值": (mv * rng.uniform(0.3, 1, len(codes))).round(),
+            "最新价": rng.uniform(3, 80, len(codes)).round(2),
+            "换手率": rng.uniform(0.1, 5, len(codes)).round(2),
+        })
+
+    def stock_individual_info_em(self, symbol="000001"):
+        time.sleep(self.latency)
+        return pd.DataFrame({"item": ["股票代码"], "value": [symbol]})
@@ -0,0 +1,258 @@
+"""Concurrent, rate-limited download pipeline for daily bars.
+
+A pool of worker threads calls `stock_zh_a_hist` (the time is almost all
+network wait, so threads are enough), a global token bucket keeps the
+request rate under `rps`, and every result goes over a bounded queue to a
+single writer thread that commits through the shared writer connection.
+"""
+import queue
+import sqlite3
+import threading
+import time
+import datetime
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from webapp.db.connection import get_pool
+from webapp.db.compact_schema import is_compact, write_bars, INT_TO_DATE
+
+REQUIRED_COLS = ["日期", "开盘", "最高", "最低", "收盘", "成交量", "涨跌幅", "振幅"]
+DEFAULT_START_DATE = "20200101"
+
+FetchTask = namedtuple("FetchTask", ["code", "name", "start_date", "end_date", "days"])
+
+
+def last_dates(conn):
+    """{stock: last 日期} for every stock in daily_data, in one grouped query.
+
+    GROUP BY stock walks the (stock, 日期) primary key index, so this is a
+    single index scan instead of one MAX() lookup per symbol.
+    """
+    try:
+        if is_compact(conn):
+            cur = conn.execute(
+                f"""
+                SELECT i.name, {INT_TO_DATE.format('b.last')} FROM
+                    (SELECT stock_id, MAX(日期) AS last FROM daily_bars GROUP BY stock_id) b
+                JOIN stock_ids i ON i.id = b.stock_id
+                """
+            )
+        else:
+            cur = conn.execute("SELECT stock, MAX(日期) FROM daily_data GROUP BY stock")
+    except sqlite3.OperationalError:
+        return {}
+    return dict(cur.fetchall())
+
+
+def plan_fetch(conn, stock_list, end_date=None):
+    """Turn the stock list into an ordered work list of FetchTask.
+
+    Stocks with no pending business day are dropped; the rest are ordered
+    stalest first so an interrupted run has already caught up the laggards.
+    """
+    if end_date is None:
+        end_date = datetime.date.today().strftime('%Y%m%d')
+    end_day = np.datetime64(datetime.datetime.strptime(end_date, '%Y%m%d').date())
+    resume = last_dates(conn)
+
+    tasks = []
+    for row in stock_list.itertuples(index=False):
+        code = str(row.code).strip()
+        name = str(row.name).strip()
+        last_date = resume.get(name)
+        if last_date is None:
+            start_date = DEFAULT_START_DATE
+        else:
+            # 从最后日期的下一天开始
+            last_dt = datetime.datetime.strptime(str(last_date)[:10], '%Y-%m-%d')
+            start_date = (last_dt + datetime.timedelta(days=1)).strftime('%Y%m%d')
+        start_day = np.datetime64(datetime.datetime.strptime(start_date, '%Y%m%d').date())
+        days = int(np.busday_count(start_day, end_day + 1)) if start_day <= end_day else 0
+        if days <= 0:
+            continue
+        tasks.append(FetchTask(code, name, start_date, end_date, days))
+    tasks.sort(key=lambda t: (t.start_date, t.code))
+    return tasks
+
+
+def summarize_plan(tasks, total):
+    new = sum(1 for t in tasks if t.start_date == DEFAULT_START_DATE)
+    days = sum(t.days for t in tasks)
+    lines = [
+        f"{len(tasks)}/{total} stocks pending ({total - len(tasks)} already current, {new} without history)",
+        f"{days} stock-days pending",
+    ]
+    if tasks:
+        lines.append(f"oldest resume date {tasks[0].start_date}, end date {tasks[0].end_date}")
+    return "\n".join(lines)
+
+
+def prepare_hist(hist, name):
+    """Trim an akshare history frame to the daily_data layout; None if unusable."""
+    if not isinstance(hist, pd.DataFrame) or hist.empty:
+        return None
+    if not all(col in hist.columns for col in REQUIRED_COLS):
+        return None
+    hist = hist[REQUIRED_COLS].copy()
+    hist["stock"] = name
+    return hist[["stock"] + REQUIRED_COLS]
+
+
+class TokenBucket:
+    """Thread-safe token bucket: refills `rate` tokens per second up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.ts = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.ts) * self.rate)
+                self.ts = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ConcurrentFetcher:
+    _STOP = object()
+    PUT_TIMEOUT = 1.0
+
+    def __init__(self, db_path, source, workers=8, rps=None, queue_size=None, commit_every=50, adjust="qfq"):
+        self.db_path = db_path
+        self.source = source
+        # "" 抓不复权价（配合 adj_factors），"qfq" 为旧库的前复权价
+        self.adjust = adjust
+        self.workers = max(1, int(workers))
+        self.bucket = TokenBucket(rps) if rps else None
+        self.queue = queue.Queue(maxsize=queue_size or self.workers * 4)
+        self.commit_every = commit_every
+        self.rows_written = 0
+        self.stocks_written = 0
+        self.write_errors = 0
+        # 写线程退出后抓取线程不再往满队列里塞数据
+        self.writer_stopped = threading.Event()
+
+    def _put(self, item):
+        while True:
+            if self.writer_stopped.is_set():
+                raise RuntimeError("writer thread stopped")
+            try:
+                self.queue.put(item, timeout=self.PUT_TIMEOUT)
+                return
+            except queue.Full:
+                continue
+
+    def _fetch(self, task):
+        code, name, start_date, end_date = task.code, task.name, task.start_date, task.end_date
+        if self.bucket is not None:
+            self.bucket.acquire()
+        hist = self.source.stock_zh_a_hist(
+            symbol=code,
+            period="daily",
+            start_date=start_date,
+            end_date=end_date,
+            adjust=self.adjust,
+        )
+        hist = prepare_hist(hist, name)
+        if hist is not None:
+            # 队列满时阻塞，写线程跟不上就让抓取线程等待
+            self._put((code, name, hist))
+        return 0 if hist is None else len(hist)
+
+    def _write(self, conn, hist):
+        # 紧凑库直接写 daily_bars，不经过 daily_data 视图的触发器
+        write_bars(conn, hist)
+
+    def _flush(self, batch):
+        # 每批只短暂占用共享写连接，网页端的收藏等写入可以插进来
+        written = []
+        errors = 0
+        try:
+            with get_pool(self.db_path).writer() as conn:
+                for code, name, hist in batch:
+                    try:
+                        # 单条语句失败只回滚该语句，批内其他股票不受影响
+                        self._write(conn, hist)
+                        written.append(len(hist))
+                    except Exception as e:
+                        errors += 1
+                        print(f"write failed for {code} {name}: {e}")
+        except Exception as e:
+            # 打开写连接或提交失败：整批回滚，整批都算失败（单条失败不再另计）
+            self.write_errors += len(batch)
+            print(f"batch of {len(batch)} stocks not written: {e}")
+            return
+        self.write_errors += errors
+        self.stocks_written += len(written)
+        self.rows_written += sum(written)
+
+    def _writer(self):
+        batch = []
+        try:
+            while True:
+                item = self.queue.get()
+                if item is self._STOP:
+                    break
+                batch.append(item)
+                if len(batch) >= self.commit_every or self.queue.empty():
+                    self._flush(batch)
+                    batch = []
+            if batch:
+                self._flush(batch)
+        finally:
+            self.writer_stopped.set()
+
+    def run(self, tasks):
+        """Fetch every FetchTask from plan_fetch; returns a stats dict."""
+        total = len(tasks)
+        started = time.monotonic()
+        writer = threading.Thread(target=self._writer, name="daily-data-writer", daemon=True)
+        writer.start()
+        failed = 0
+        pool = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            futures = {pool.submit(self._fetch, task): task for task in tasks}
+            for i, future in enumerate(as_completed(futures), start=1):
+                task = futures[future]
+                try:
+                    rows = future.result()
+                    status = f"{rows} rows" if rows else "no data"
+                except Exception as e:
+                    failed += 1
+                    status = f"failed: {e}"
+                print(f"[{i}/{total}] {task.code} {task.name} {task.start_date}-{task.end_date}: {status}")
+        except KeyboardInterrupt:
+            print("\nInterrupted by user. Waiting for running requests...")
+            pool.shutdown(wait=True, cancel_futures=True)
+        finally:
+            pool.shutdown(wait=True)
+            try:
+                self._put(self._STOP)
+            except RuntimeError:
+                print("writer thread stopped early; remaining batches were not written")
+            writer.join()
+
+        elapsed = time.monotonic() - started
+        stats = {
+            "tasks": total,
+            "stocks": self.stocks_written,
+            "rows": self.rows_written,
+            "failed": failed + self.write_errors,
+            "seconds": round(elapsed, 2),
+        }
+        rate = total / elapsed if elapsed > 0 else 0.0
+        print(f"Fetched {total} stocks ({stats['rows']} rows, {stats['failed']} failed) "
+              f"in {elapsed:.1f}s, {rate:.1f} stocks/s")
+        return stats
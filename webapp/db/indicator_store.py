@@ -0,0 +1,212 @@
+"""Persisted K/D/J and double_line averages, extended incrementally.
+
+`indicators` holds one row per (stock, 日期). `indicator_state` keeps, per
+stock, the recursive state after its last stored bar: every EWM's running
+mean and weight, plus the date where the KDJ rolling window starts. New
+bars only need that state and the previous n-1 highs/lows, so appending a
+day costs one small read instead of a recompute over full history.
+
+Values are computed over each stock's whole history. They match
+`calculate_kdj` / `double_line` run on the full series; charts that used
+to recompute on a 180-bar window differ slightly in the long averages.
+On raw-price databases (see webapp.db.adjust) the store is computed from
+hfq prices, so short/long are in hfq units until read back through
+`to_qfq`.
+"""
+import sqlite3
+import numpy as np
+import pandas as pd
+
+from webapp.panel import ewm_panel, rolling_panel
+from webapp.db.adjust import load_factors, price_mode, to_hfq
+
+KDJ_N, KDJ_M1, KDJ_M2 = 9, 3, 3
+SHORT_SPAN = 10
+LONG_SPANS = (14, 28, 57, 114)
+INDICATOR_COLS = ["K", "D", "J", "short", "long"]
+
+# 每个 EWM 的 (均值, 权重) 状态列
+EWM_STATES = ["k", "d", "s1", "s2"] + [f"l{span}" for span in LONG_SPANS]
+STATE_COLS = [c for name in EWM_STATES for c in (name, f"{name}_w")]
+
+
+class IndicatorStore:
+    def __init__(self, conn: sqlite3.Connection, ensure: bool = True):
+        self.conn = conn
+        # 只读调用方（读连接上的 latest/load_state）传 ensure=False，不在读连接上跑 DDL
+        if ensure:
+            self.ensure_tables()
+
+    def ensure_tables(self):
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS indicators (
+                stock TEXT NOT NULL,
+                日期 TEXT NOT NULL,
+                K REAL,
+                D REAL,
+                J REAL,
+                short REAL,
+                long REAL,
+                PRIMARY KEY(stock, 日期)
+            )
+            """
+        )
+        state_cols = ",\n".join(f"{c} REAL" for c in STATE_COLS)
+        self.conn.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS indicator_state (
+                stock TEXT PRIMARY KEY,
+                日期 TEXT,
+                window_start TEXT,
+                {state_cols}
+            )
+            """
+        )
+        self.conn.commit()
+
+    def load_state(self, stocks=None):
+        df = pd.read_sql("SELECT * FROM indicator_state", self.conn)
+        if stocks is not None:
+            df = df[df["stock"].isin(set(stocks))]
+        return df.set_index("stock")
+
+    def update(self, stocks=None, chunk_size=500, rebuild=False):
+        """Extend the store for `stocks` (default: every stock in daily_data)."""
+        if stocks is None:
+            stocks = [r[0] for r in self.conn.execute("SELECT DISTINCT stock FROM daily_data")]
+        stocks = sorted(set(stocks))
+        if rebuild and stocks:
+            for start in range(0, len(stocks), chunk_size):
+                chunk = stocks[start:start + chunk_size]
+                placeholders = ",".join("?" * len(chunk))
+                self.conn.execute(f"DELETE FROM indicators WHERE stock IN ({placeholders})", chunk)
+                self.conn.execute(f"DELETE FROM indicator_state WHERE stock IN ({placeholders})", chunk)
+            self.conn.commit()
+
+        states = self.load_state(stocks)
+        written = 0
+        for start in range(0, len(stocks), chunk_size):
+            chunk = stocks[start:start + chunk_size]
+            written += self._update_chunk(chunk, states.reindex(chunk))
+            self.conn.commit()
+        return written
+
+    def _load_bars(self, states):
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS _indicator_resume (stock TEXT PRIMARY KEY, since TEXT)")
+        self.conn.execute("DELETE FROM _indicator_resume")
+        since = states["window_start"].where(states["window_start"].notna(), "")
+        self.conn.executemany("INSERT INTO _indicator_resume VALUES (?, ?)", list(zip(states.index, since)))
+        bars = pd.read_sql(
+            """
+            SELECT d.stock, d.日期, d.最高, d.最低, d.收盘 FROM _indicator_resume r
+            JOIN daily_data d ON d.stock = r.stock AND d.日期 >= r.since
+            ORDER BY d.stock, d.日期
+            """,
+            self.conn,
+        )
+        if price_mode(self.conn) == "raw":
+            # 不复权库按后复权价计算，历史值不随除权变化，可以增量续算
+            bars = to_hfq(bars, load_factors(self.conn, states.index))
+        return bars
+
+    def _update_chunk(self, chunk, states):
+        bars = self._load_bars(states)
+        if bars.empty:
+            return 0
+        bars["日期"] = bars["日期"].astype(str)
+        last = bars["stock"].map(states["日期"])
+        prefix = last.notna() & (bars["日期"] <= last)
+
+        names, idx = np.unique(bars["stock"].to_numpy(), return_inverse=True)
+        n_prefix = np.bincount(idx, weights=prefix.to_numpy(), minlength=len(names)).astype(int)
+        n_new = np.bincount(idx, minlength=len(names)) - n_prefix
+        if n_new.max() <= 0:
+            return 0
+
+        # 历史窗口右对齐到第 P-1 列，新K线从第 P 列开始，右侧补 NaN
+        P = KDJ_N - 1
+        width = P + int(n_new.max())
+        pos = bars.groupby("stock", sort=False).cumcount().to_numpy()
+        col = P - n_prefix[idx] + pos
+        keep = col >= 0
+        rows, col = idx[keep], col[keep]
+
+        def panel(values, fill=np.nan, dtype=float):
+            arr = np.full((len(names), width), fill, dtype=dtype)
+            arr[rows, col] = np.asarray(values)[keep]
+            return arr
+
+        high = panel(bars["最高"].to_numpy(dtype=float))
+        low = panel(bars["最低"].to_numpy(dtype=float))
+        close = panel(bars["收盘"].to_numpy(dtype=float))
+        dates = panel(bars["日期"].to_numpy(dtype=object), fill=None, dtype=object)
+        mask = np.zeros((len(names), width), dtype=bool)
+        mask[:, P:] = np.arange(width - P)[None, :] < n_new[:, None]
+
+        st = states.reindex(names)
+
+        def state(name):
+            return st[name].to_numpy(dtype=float), st[f"{name}_w"].fillna(1.0).to_numpy(dtype=float)
+
+        new_state = {}
+        low_list = rolling_panel(low, KDJ_N, "min")
+        high_list = rolling_panel(high, KDJ_N, "max")
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rsv = (close - low_list) / (high_list - low_list) * 100
+        k, new_state["k"] = ewm_panel(rsv, 1.0 / KDJ_M1, state=state("k"), mask=mask)
+        d, new_state["d"] = ewm_panel(k, 1.0 / KDJ_M2, state=state("d"), mask=mask)
+        j = 3 * k - 2 * d
+
+        alpha = 2.0 / (SHORT_SPAN + 1)
+        s1, new_state["s1"] = ewm_panel(close, alpha, adjust=True, state=state("s1"), mask=mask)
+        short, new_state["s2"] = ewm_panel(s1, alpha, adjust=True, state=state("s2"), mask=mask)
+        long = np.zeros_like(close)
+        for span in LONG_SPANS:
+            out, new_state[f"l{span}"] = ewm_panel(close, 2.0 / (span + 1), adjust=True,
+                                                   state=state(f"l{span}"), mask=mask)
+            long += out
+        long *= 0.25
+
+        r, c = np.nonzero(mask)
+        out = pd.DataFrame({
+            "stock": names[r],
+            "日期": dates[r, c],
+            "K": k[r, c], "D": d[r, c], "J": j[r, c],
+            "short": short[r, c], "long": long[r, c],
+        })
+        out = out.astype(object).where(out.notna(), None)
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO indicators (stock, 日期, K, D, J, short, long) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            out.itertuples(index=False, name=None),
+        )
+
+        # 保存状态：最后一根K线的日期和 KDJ 窗口起点（最近 n-1 根的第一根）
+        touched = np.nonzero(n_new > 0)[0]
+        last_col = P + n_new - 1
+        start_col = np.maximum(last_col - (KDJ_N - 2), 0)
+        state_rows = []
+        for i in touched:
+            window = [x for x in dates[i, start_col[i]:last_col[i] + 1] if x is not None]
+            values = []
+            for name in EWM_STATES:
+                mean, weight = new_state[name]
+                values += [None if np.isnan(mean[i]) else float(mean[i]), float(weight[i])]
+            state_rows.append((names[i], dates[i, last_col[i]], window[0], *values))
+        placeholders = ",".join("?" * (3 + len(STATE_COLS)))
+        self.conn.executemany(
+            f"INSERT OR REPLACE INTO indicator_state (stock, 日期, window_start, {', '.join(STATE_COLS)})"
+            f" VALUES ({placeholders})",
+            state_rows,
+        )
+        return len(out)
+
+    def latest(self):
+        """K/D/J/short/long at each stock's last stored bar, one row per stock."""
+        return pd.read_sql(
+            """
+            SELECT i.* FROM indicator_state s
+            JOIN indicators i ON i.stock = s.stock AND i.日期 = s.日期
+            """,
+            self.conn,
+        )
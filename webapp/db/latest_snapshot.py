@@ -0,0 +1,118 @@
+"""Materialized per-stock latest state.
+
+`latest_snapshot` has one row per stock with its last bar, the volume
+ratio against the previous bar, the stored indicators at that bar and the
+market values from `stocks`:
+
+    stock, code, 日期, 收盘, 涨跌幅, 成交量, volume_ratio,
+    K, D, J, short, long, mv, circ_mv
+
+Prices and short/long are qfq, like every other read path. Rows are
+rebuilt by `StockDatabase.refresh_latest_snapshot` for the stocks a fetch
+touched, and mv/circ_mv are re-copied after each stock list update, so a
+daily screen is one SELECT over ~5000 rows (see `webapp.screen`).
+"""
+import pandas as pd
+
+TABLE = "latest_snapshot"
+COLUMNS = ["stock", "code", "日期", "收盘", "涨跌幅", "成交量", "volume_ratio",
+           "K", "D", "J", "short", "long", "mv", "circ_mv"]
+
+DDL = f"""
+    CREATE TABLE IF NOT EXISTS {TABLE} (
+        stock TEXT PRIMARY KEY,
+        code TEXT,
+        日期 TEXT,
+        收盘 REAL,
+        涨跌幅 REAL,
+        成交量 REAL,
+        volume_ratio REAL,
+        K REAL,
+        D REAL,
+        J REAL,
+        short REAL,
+        long REAL,
+        mv REAL,
+        circ_mv REAL
+    )
+"""
+
+
+def ensure_table(conn):
+    conn.execute(DDL)
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{TABLE}_j ON {TABLE}(J)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{TABLE}_mv ON {TABLE}(mv)")
+    conn.commit()
+
+
+def exists(conn):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (TABLE,)).fetchone()
+    return row is not None and conn.execute(f"SELECT 1 FROM {TABLE} LIMIT 1").fetchone() is not None
+
+
+def build_rows(bars, indicators, stocks_info):
+    """
+    One row per stock from its last two bars (`bars`: stock, 日期, 收盘,
+    涨跌幅, 成交量, oldest first), the indicators at the last bar and the
+    `stocks` table (code, name, mv, circ_mv).
+    """
+    if bars.empty:
+        return pd.DataFrame(columns=COLUMNS)
+    bars = bars.assign(prev_volume=bars.groupby("stock", sort=False)["成交量"].shift(1))
+    last = bars.groupby("stock", sort=False).tail(1).set_index("stock")
+    out = last[["日期", "收盘", "涨跌幅", "成交量"]].copy()
+    out["volume_ratio"] = out["成交量"] / last["prev_volume"].where(last["prev_volume"] > 0)
+    out["日期"] = pd.to_datetime(out["日期"]).dt.strftime("%Y-%m-%d")
+
+    ind = indicators.copy()
+    if not ind.empty:
+        ind["日期"] = pd.to_datetime(ind["日期"]).dt.strftime("%Y-%m-%d")
+        ind = ind.set_index("stock")
+        # 只用与最后一根K线同一天的指标，落后的留空
+        same_day = ind["日期"].reindex(out.index) == out["日期"]
+        for col in ["K", "D", "J", "short", "long"]:
+            out[col] = ind[col].reindex(out.index).where(same_day)
+    else:
+        for col in ["K", "D", "J", "short", "long"]:
+            out[col] = float("nan")
+
+    info = stocks_info.drop_duplicates("name").set_index("name")
+    out["code"] = info["code"].reindex(out.index)
+    out["mv"] = info["mv"].reindex(out.index)
+    out["circ_mv"] = info["circ_mv"].reindex(out.index)
+    return out.reset_index().rename(columns={"index": "stock"})[COLUMNS]
+
+
+def write_rows(conn, rows):
+    ensure_table(conn)
+    if rows.empty:
+        return 0
+    values = rows[COLUMNS].astype(object).where(rows[COLUMNS].notna(), None).itertuples(index=False, name=None)
+    with conn:
+        conn.executemany(
+            f"INSERT OR REPLACE INTO {TABLE} ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+            values,
+        )
+    return len(rows)
+
+
+def sync_market_values(conn):
+    """Copy mv/circ_mv from `stocks` after a stock list update."""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (TABLE,)).fetchone() is None:
+        return 0
+    before = conn.total_changes
+    with conn:
+        conn.execute(
+            f"""
+            UPDATE {TABLE} AS t SET code = s.code, mv = s.mv, circ_mv = s.circ_mv
+            FROM stocks s WHERE s.name = t.stock
+              AND (t.mv IS NOT s.mv OR t.circ_mv IS NOT s.circ_mv OR t.code IS NOT s.code)
+            """
+        )
+    return conn.total_changes - before
+
+
+def read(conn, stock=None):
+    if stock is None:
+        return pd.read_sql(f"SELECT * FROM {TABLE}", conn)
+    return pd.read_sql(f"SELECT * FROM {TABLE} WHERE stock = ?", conn, params=(stock,))
@@ -3,21 +3,33 @@
 
 The script will:
 - create `daily_data` if missing with columns: stock, 日期, 开盘, 最高, 最低, 收盘, 成交量
-- iterate over user tables (skipping metadata tables)
+- iterate over user tables (skipping the EXCLUDE_TABLES the app itself creates)
 - validate each table has the required columns
-- insert rows using `INSERT OR REPLACE` to avoid duplicates
+- copy rows with `INSERT OR REPLACE ... SELECT`, so rows never pass through Python
+- commit every `--batch` tables, recording them in `merge_checkpoint` in the
+  same transaction; `--resume` skips tables already recorded there
 
 Usage:
-    python merge_tables.py [--db stock_data.db] [--drop] [--limit N]
+    python merge_tables.py [--db stock_data.db] [--drop] [--limit N] [--batch 50] [--resume]
 
 """
 import sqlite3
 import argparse
 import re
+import time
 from typing import List
 
 
 REQUIRED_COLS = ["日期", "开盘", "最高", "最低", "收盘", "成交量"]
+CHECKPOINT_TABLE = "merge_checkpoint"
+# 程序自己建的表，不是按股票拆分的旧表；--drop-source 也绝不能碰
+EXCLUDE_TABLES = {
+    "stocks", "stocks_untyped", "stock_snapshots", "latest_snapshot", "meta",
+    "recent_queries", "favorite_collection",
+    "daily_data", "daily_data_legacy", "daily_bars", "stock_ids",
+    "indicators", "indicator_state", "adj_factors", "adj_checked",
+    CHECKPOINT_TABLE,
+}
 
 
 def quote_ident(name: str) -> str:
@@ -28,9 +40,7 @@ def quote_ident(name: str) -> str:
 def get_user_tables(conn: sqlite3.Connection) -> List[str]:
     cur = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")
     tables = [r[0] for r in cur.fetchall()]
-    # exclude helper tables
-    exclude = {"stocks", "recent_queries", "daily_data"}
-    return [t for t in tables if t not in exclude]
+    return [t for t in tables if t not in EXCLUDE_TABLES]
 
 
 def table_has_columns(conn: sqlite3.Connection, table: str, required: List[str]) -> bool:
@@ -39,6 +49,23 @@ def table_has_columns(conn: sqlite3.Connection, table: str, required: List[str])
     return all(col in cols for col in required)
 
 
+def create_checkpoint_table(conn: sqlite3.Connection):
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} (
+            tbl TEXT PRIMARY KEY,
+            rows INTEGER,
+            merged_at TEXT
+        )
+        """
+    )
+    conn.commit()
+
+
+def merged_checkpoints(conn: sqlite3.Connection) -> List[str]:
+    return [r[0] for r in conn.execute(f"SELECT tbl FROM {CHECKPOINT_TABLE}")]
+
+
 def create_daily_table(conn: sqlite3.Connection):
     conn.execute(
         """
@@ -57,52 +84,76 @@ def create_daily_table(conn: sqlite3.Connection):
     conn.commit()
 
 
-def merge_tables(db_path: str, drop_first: bool = False, limit: int = None, drop_source: bool = False):
+def merge_tables(db_path: str, drop_first: bool = False, limit: int = None, drop_source: bool = False,
+                 batch: int = 50, resume: bool = False):
     conn = sqlite3.connect(db_path)
     try:
         create_daily_table(conn)
-
-        if drop_first:
-            conn.execute("DELETE FROM daily_data")
+        create_checkpoint_table(conn)
+
+        if resume:
+            done = set(merged_checkpoints(conn))
+            print(f"Resuming: {len(done)} tables already merged")
+        else:
+            done = set()
+            conn.execute(f"DELETE FROM {CHECKPOINT_TABLE}")
+            if drop_first:
+                conn.execute("DELETE FROM daily_data")
             conn.commit()
 
-        tables = get_user_tables(conn)
+        tables = [t for t in get_user_tables(conn) if t not in done]
         if limit:
             tables = tables[:limit]
 
         total = len(tables)
         print(f"Found {total} user tables to merge")
 
-        insert_sql = (
-            "INSERT OR REPLACE INTO daily_data (stock, 日期, 开盘, 最高, 最低, 收盘, 成交量)"
-            " VALUES (?, ?, ?, ?, ?, ?, ?)"
-        )
-
-        merged_tables = []
+        cols = ", ".join(quote_ident(c) for c in REQUIRED_COLS)
+        started = time.monotonic()
+        merged_rows = 0
+        pending = 0
         for idx, table in enumerate(tables, start=1):
+            if not table_has_columns(conn, table, REQUIRED_COLS):
+                print(f"Skipping {table}: missing required columns")
+                continue
+
+            # 每张表一个 savepoint，出错只回滚这一张表，不影响同批其他表
+            if not conn.in_transaction:
+                conn.execute("BEGIN")
+            conn.execute("SAVEPOINT merge_table")
             try:
-                if not table_has_columns(conn, table, REQUIRED_COLS):
-                    print(f"Skipping {table}: missing required columns")
-                    continue
+                rows = conn.execute(f"SELECT COUNT(*) FROM {quote_ident(table)}").fetchone()[0]
+                conn.execute(
+                    f"INSERT OR REPLACE INTO daily_data (stock, 日期, 开盘, 最高, 最低, 收盘, 成交量)"
+                    f" SELECT ?, {cols} FROM {quote_ident(table)}",
+                    (table,),
+                )
+                conn.execute(
+                    f"INSERT OR REPLACE INTO {CHECKPOINT_TABLE} (tbl, rows, merged_at) VALUES (?, ?, datetime('now'))",
+                    (table, rows),
+                )
+                conn.execute("RELEASE merge_table")
+            except Exception as e:
+                print(f"Error merging {table}: {e}")
+                conn.execute("ROLLBACK TO merge_table")
+                conn.execute("RELEASE merge_table")
+                continue
 
-                q = f"SELECT {', '.join(quote_ident(c) for c in REQUIRED_COLS)} FROM {quote_ident(table)}"
-                cur = conn.execute(q)
-                rows = cur.fetchall()
-                if not rows:
-                    continue
+            merged_rows += rows
+            pending += 1
+            if pending >= batch or idx == total:
+                conn.commit()
+                pending = 0
+                elapsed = time.monotonic() - started
+                print(f"[{idx}/{total}] merged {merged_rows} rows, {merged_rows / max(elapsed, 1e-9):.0f} rows/s")
+        conn.commit()
 
-                # prepare tuples with stock name first
-                params = [(table, r[0], r[1], r[2], r[3], r[4], r[5]) for r in rows]
+        elapsed = time.monotonic() - started
+        print(f"Merged {merged_rows} rows from {total} tables in {elapsed:.1f}s "
+              f"({merged_rows / max(elapsed, 1e-9):.0f} rows/s, batch={batch})")
 
-                # use a transaction per table
-                conn.executemany(insert_sql, params)
-                conn.commit()
-                print(f"[{idx}/{total}] merged {len(rows)} rows from {table}")
-                merged_tables.append(table)
-            except Exception as e:
-                print(f"Error merging {table}: {e}")
-                conn.rollback()
-        # optionally drop source tables that were successfully merged
+        # optionally drop source tables that were successfully merged (including earlier runs)
+        merged_tables = [t for t in merged_checkpoints(conn) if t not in EXCLUDE_TABLES]
         if drop_source and merged_tables:
             print(f"Dropping {len(merged_tables)} source tables...")
             for t in merged_tables:
@@ -122,9 +173,12 @@ def main():
     parser.add_argument("--drop", action="store_true", help="Drop existing rows in daily_data before merging")
     parser.add_argument("--limit", type=int, default=None, help="Limit number of tables to merge (for testing)")
     parser.add_argument("--drop-source", action="store_true", help="Drop source per-stock tables after successful merge (destructive)")
+    parser.add_argument("--batch", type=int, default=50, help="Tables per transaction")
+    parser.add_argument("--resume", action="store_true", help="Skip tables recorded in merge_checkpoint by an earlier run")
     args = parser.parse_args()
 
-    merge_tables(args.db, drop_first=args.drop, limit=args.limit, drop_source=args.drop_source)
+    merge_tables(args.db, drop_first=args.drop, limit=args.limit, drop_source=args.drop_source,
+                 batch=args.batch, resume=args.resume)
 
 
 if __name__ == "__main__":
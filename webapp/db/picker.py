@@ -39,17 +39,11 @@ class StockPicker:
         cols.append('J')
         return matches, cols
 
-    def filter_by_market_value(self, matches,cols, min_value=None, max_value=None):
-        filtered = []
-        for code, name, j in matches:
-            market_value = self.db.get_market_value_by_code(code)
-            if market_value is None:
-                continue
-            if (min_value is not None and market_value < min_value):
-                continue
-            if (max_value is not None and market_value > max_value):
-                continue
-            filtered.append((code, name, j, market_value/1e8))
+    def filter_by_market_value(self, matches,cols, min_value=None, max_value=None, as_of=None):
+        # as_of: 按该日的市值快照筛选，默认最新；一次索引范围查询后在内存中连接
+        in_range = self.db.codes_by_market_value(min_value, max_value, as_of=as_of)
+        mv = dict(zip(in_range["code"], in_range["mv"]))
+        filtered = [(code, name, j, mv[code] / 1e8) for code, name, j in matches if code in mv]
         
         cols.append('market_value')
         return filtered, cols
@@ -0,0 +1,195 @@
+"""Bulk loader for the full-market spot snapshot (stock_zh_a_spot_em).
+
+`stocks` holds the latest typed values per code:
+
+    code TEXT PRIMARY KEY, name TEXT,
+    mv REAL, circ_mv REAL        总市值 / 流通市值, 元
+    price REAL, turnover REAL    最新价 / 换手率 (when the snapshot has them)
+    updated TEXT                 snapshot date of the last change
+
+`stock_snapshots` keeps the history. A row (日期, code, ...) is written only
+when a stock's name, mv or circ_mv differ from what `stocks` held, so the
+values as of day D are each code's newest row with 日期 <= D (see
+`as_of_sql`). price and turnover move every trading day; they are kept
+current in `stocks` but do not on their own start a history row, so the
+price/turnover of a history row are the ones seen on its 日期.
+mv and circ_mv are indexed so market-value ranges are one index scan
+(`codes_by_market_value`).
+
+Older databases created `stocks` with TEXT mv/circ_mv. `ensure_tables`
+rebuilds that table once with typed columns, parsing the old text values.
+"""
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from webapp.db.events import bump_stocks_version
+
+SPOT_COLUMNS = {
+    "代码": "code",
+    "名称": "name",
+    "总市值": "mv",
+    "流通市值": "circ_mv",
+    "最新价": "price",
+    "换手率": "turnover",
+}
+VALUE_COLS = ["mv", "circ_mv", "price", "turnover"]
+# 只有这些列变化才写历史；价格和换手率每天都变，只更新 stocks
+DIFF_COLS = ["mv", "circ_mv"]
+QUOTE_COLS = ["price", "turnover"]
+
+STOCKS_DDL = """
+    CREATE TABLE IF NOT EXISTS stocks (
+        code TEXT PRIMARY KEY,
+        name TEXT,
+        mv REAL,
+        circ_mv REAL,
+        price REAL,
+        turnover REAL,
+        updated TEXT
+    )
+"""
+SNAPSHOTS_DDL = """
+    CREATE TABLE IF NOT EXISTS stock_snapshots (
+        日期 TEXT NOT NULL,
+        code TEXT NOT NULL,
+        name TEXT,
+        mv REAL,
+        circ_mv REAL,
+        price REAL,
+        turnover REAL,
+        PRIMARY KEY(code, 日期)
+    ) WITHOUT ROWID
+"""
+
+
+def _to_number(values):
+    # akshare 偶尔给出带逗号的文本或 '-'
+    return pd.to_numeric(pd.Series(values).astype(str).str.replace(",", "", regex=False), errors="coerce")
+
+
+def ensure_tables(conn):
+    cols = {r[1]: (r[2] or "").upper() for r in conn.execute("PRAGMA table_info(stocks)")}
+    if cols and (cols.get("mv") != "REAL" or "updated" not in cols):
+        # 旧表的市值是文本，重建一次换成数值列
+        conn.execute("ALTER TABLE stocks RENAME TO stocks_untyped")
+        conn.execute(STOCKS_DDL)
+        conn.execute(
+            """
+            INSERT INTO stocks (code, name, mv, circ_mv)
+            SELECT TRIM(code), TRIM(name),
+                   CAST(NULLIF(REPLACE(mv, ',', ''), '') AS REAL),
+                   CAST(NULLIF(REPLACE(circ_mv, ',', ''), '') AS REAL)
+            FROM stocks_untyped WHERE code IS NOT NULL
+            """
+        )
+        conn.execute("DROP TABLE stocks_untyped")
+        print("stocks: converted mv/circ_mv to REAL")
+    conn.execute(STOCKS_DDL)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_stocks_mv ON stocks(mv)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_stocks_circ_mv ON stocks(circ_mv)")
+    conn.execute(SNAPSHOTS_DDL)
+    conn.commit()
+
+
+def spot_to_frame(spot):
+    """Typed (code, name, mv, circ_mv, price, turnover) frame from a spot DataFrame."""
+    out = pd.DataFrame({"code": spot["代码"].astype(str).str.strip(), "name": spot["名称"].astype(str).str.strip()})
+    for src, col in SPOT_COLUMNS.items():
+        if col in VALUE_COLS:
+            out[col] = _to_number(spot[src]).to_numpy() if src in spot.columns else np.nan
+    return out.drop_duplicates("code", keep="last").reset_index(drop=True)
+
+
+def _differs(new, old, cols):
+    """Mask over `new`: rows not in `old` or differing from it in any of `cols`."""
+    merged = new.merge(old, on="code", how="left", suffixes=("", "_old"))
+    changed = np.zeros(len(merged), dtype=bool)
+    for col in cols:
+        a, b = merged[col], merged[f"{col}_old"]
+        same = (a == b) | (a.isna() & b.isna())
+        changed |= ~same.to_numpy()
+    return changed
+
+
+def ingest_snapshot(conn, spot, as_of=None):
+    """
+    Upsert a spot snapshot into `stocks` and `stock_snapshots` in one
+    transaction. Stocks whose name/mv/circ_mv changed get a history row;
+    the others only have price/turnover refreshed in `stocks`, and only
+    when those moved. Returns the number of changed stocks.
+    """
+    ensure_tables(conn)
+    as_of = pd.Timestamp(as_of or datetime.date.today()).strftime("%Y-%m-%d")
+    new = spot_to_frame(spot)
+    old = pd.read_sql("SELECT code, name, " + ", ".join(VALUE_COLS) + " FROM stocks", conn)
+    slow = _differs(new, old, ["name"] + DIFF_COLS)
+    quotes = new[~slow & _differs(new, old, QUOTE_COLS)]
+    # 新代码或改名才影响代码/名称/拼音索引
+    renamed = _differs(new, old, ["name"]).any()
+    changed = new[slow]
+    if changed.empty and quotes.empty:
+        return 0
+
+    cols = ["code", "name"] + VALUE_COLS
+    rows = list(changed[cols].astype(object).where(changed[cols].notna(), None).itertuples(index=False, name=None))
+    quote_rows = quotes[QUOTE_COLS + ["code"]].astype(object).where(quotes[QUOTE_COLS + ["code"]].notna(), None)
+    updates = ", ".join(f"{c} = excluded.{c}" for c in cols[1:] + ["updated"])
+    with conn:
+        conn.executemany(
+            f"UPDATE stocks SET {', '.join(c + ' = ?' for c in QUOTE_COLS)} WHERE code = ?",
+            quote_rows.itertuples(index=False, name=None),
+        )
+        conn.executemany(
+            f"INSERT INTO stocks ({', '.join(cols)}, updated) VALUES ({', '.join('?' * len(cols))}, ?)"
+            f" ON CONFLICT(code) DO UPDATE SET {updates}",
+            [(*r, as_of) for r in rows],
+        )
+        # 同一天多次导入时覆盖当天的记录
+        conn.executemany(
+            f"INSERT OR REPLACE INTO stock_snapshots (日期, {', '.join(cols)}) VALUES (?, {', '.join('?' * len(cols))})",
+            [(as_of, *r) for r in rows],
+        )
+        if renamed:
+            bump_stocks_version(conn)
+    return len(rows)
+
+
+def as_of_sql(as_of):
+    """
+    (sql, params) selecting code, name, mv, circ_mv, price, turnover as of
+    `as_of`; a subquery usable wherever `stocks` is.
+    """
+    day = pd.Timestamp(as_of).strftime("%Y-%m-%d")
+    sql = f"""
+        SELECT s.code, s.name, {", ".join("s." + c for c in VALUE_COLS)}
+        FROM stock_snapshots s
+        WHERE s.日期 = (SELECT MAX(x.日期) FROM stock_snapshots x WHERE x.code = s.code AND x.日期 <= ?)
+    """
+    return sql, [day]
+
+
+def codes_by_market_value(conn, min_value=None, max_value=None, column="mv", as_of=None):
+    """
+    (code, name, <column>) of every stock with min_value <= column <=
+    max_value (元, either bound optional), in code order. The latest
+    values come from one scan of the index on `column`; `as_of` reads the
+    snapshot history instead.
+    """
+    if column not in ("mv", "circ_mv"):
+        raise ValueError("column must be 'mv' or 'circ_mv'")
+    where, params = [f"{column} IS NOT NULL"], []
+    if min_value is not None:
+        where.append(f"{column} >= ?")
+        params.append(float(min_value))
+    if max_value is not None:
+        where.append(f"{column} <= ?")
+        params.append(float(max_value))
+    source, source_params = ("stocks", []) if as_of is None else as_of_sql(as_of)
+    if as_of is not None:
+        source = f"({source})"
+    # 不加 ORDER BY，免得优化器改走主键索引整表扫描
+    sql = f"SELECT code, name, {column} FROM {source} WHERE {' AND '.join(where)}"
+    df = pd.read_sql(sql, conn, params=source_params + params)
+    return df.sort_values("code").reset_index(drop=True)
@@ -1,30 +1,84 @@
 import sqlite3
+import threading
 import pandas as pd
 import akshare as ak
 import time
 from typing import Optional
-import os
-import pickle
+from webapp.db.fetcher import ConcurrentFetcher, last_dates, plan_fetch, prepare_hist, summarize_plan
+from webapp.db.indicator_store import IndicatorStore, INDICATOR_COLS
+from webapp.db.columnar import ColumnarStore
+from webapp.db.events import bars_written, bump_bars_version
+from webapp.db.connection import get_db_path, get_pool
+from webapp.db.compact_schema import is_compact, write_bars
+from webapp.db.columnar import int_to_dates
+from webapp.db.ak_cache import CachedAkshare, default_mode, wrap
+from webapp.db.snapshot import as_of_sql, codes_by_market_value, ensure_tables as ensure_stock_tables, ingest_snapshot
+from webapp.db import latest_snapshot
+from webapp.db.adjust import factor_ranges_sql, load_factors, price_mode, set_price_mode, to_qfq, update_factors
+
+# 已检查过 stocks 表结构的库（按绝对路径），每个进程只在写连接上跑一次 DDL
+_stock_tables_checked = set()
+_checked_lock = threading.Lock()
 
 class StockDatabase:
-    def __init__(self, path="stock_data.db"):
-        self.db_path = path
+    def __init__(self, path=None, source=None, columnar=False, cache=None):
+        self.db_path = path or get_db_path()
         self.candle_columns = ["日期","开盘","最高","最低","收盘","成交量"]
-        self.conn = sqlite3.connect(self.db_path)
+        self.pool = get_pool(self.db_path)
+        # akshare 或离线替身 (webapp.db.fake_akshare.FakeAkshare)，经过磁盘响应缓存
+        # cache: cache / refresh / replay / off；默认只缓存真实 akshare。
+        # 缓存目录和索引库在第一次调用 akshare 时才打开，只读的调用方不受影响
+        cache = cache or default_mode("cache" if source is None else "off")
+        self.ak = wrap(source if source is not None else ak, cache)
+        self.columnar = None
+        if columnar:
+            self.use_columnar()
+
+    def ensure_stock_tables(self):
+        """Create (or migrate) the stocks tables once per database per process, on the writer."""
+        with _checked_lock:
+            if self.pool.path in _stock_tables_checked:
+                return
+            with self.pool.writer() as w:
+                ensure_stock_tables(w)
+            _stock_tables_checked.add(self.pool.path)
+
+    def use_columnar(self, root=None):
+        """Serve query_daily_data / query_daily_panel from the columnar copy if it exists."""
+        store = ColumnarStore(root or ColumnarStore.default_root(self.db_path))
+        self.columnar = store if store.exists() else None
+        return self.columnar
 
-    def __del__(self):
-        self.conn.close()
+    def sync_columnar(self, root=None, rebuild=False):
+        store = ColumnarStore(root or ColumnarStore.default_root(self.db_path))
+        rows = store.sync(self.conn, rebuild=rebuild)
+        print(f"columnar: {rows} rows synced to {store.root}")
+        if self.columnar is not None:
+            self.columnar = store
+        return rows
+
+    def close(self):
+        """Close the akshare cache index if it was opened; pooled connections stay with the pool."""
+        if isinstance(self.ak, CachedAkshare):
+            self.ak.close()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # 只用于读：每个线程一条连接，由连接池持有，不在这里关闭；
+        # 写入一律走 `with self.pool.writer() as conn:`，与抓取线程、网页端共用一把写锁
+        return self.pool.reader()
 
     def get_a_stock_info(self):
-        return ak.stock_zh_a_spot_em() 
+        return self.ak.stock_zh_a_spot_em()
 
     def get_a_share_list_local(self,):
         return pd.read_sql_query("SELECT code, name FROM stocks", self.conn)
 
 
     def fetch_and_save_all_daily_data(self, limit: Optional[int], start_date: str, end_date: str, sleep_sec: float):
-        self.conn.execute(
-            """
+        with self.pool.writer() as conn:
+            conn.execute(
+                """
             CREATE TABLE IF NOT EXISTS daily_data (
                 stock TEXT NOT NULL,
                 日期 TEXT NOT NULL,
@@ -39,8 +93,7 @@ class StockDatabase:
                 PRIMARY KEY(stock, 日期)
             )
             """
-        )
-        self.conn.commit()
+            )
 
         df_list = self.get_a_share_list()
 
@@ -68,7 +121,8 @@ class StockDatabase:
                     # Reorder columns to match table
                     hist = hist[["stock"] + required_cols]
                     # Insert into daily_data
-                    hist.to_sql("daily_data", self.conn, if_exists="replace", index=False)
+                    with self.pool.writer() as conn:
+                        hist.to_sql("daily_data", conn, if_exists="replace", index=False)
                     print("saved to daily_data")
                 else:
                     print("no data")
@@ -82,68 +136,63 @@ class StockDatabase:
                 break
             time.sleep(sleep_sec)
     
-    def fetch_daily_data(self, limit: Optional[int], sleep_sec: float):
-        import datetime
-        self.conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS daily_data (
-                stock TEXT NOT NULL,
-                日期 TEXT NOT NULL,
-                开盘 REAL,
-                最高 REAL,
-                最低 REAL,
-                收盘 REAL,
-                成交量 REAL,
-                涨跌幅 REAL,
-                振幅 REAL,
-                PRIMARY KEY(stock, 日期)
-            )
-            """
-        )
-        self.conn.commit()
+    def fetch_daily_data(self, limit: Optional[int], sleep_sec: float, workers: int = 1, rps: Optional[float] = None,
+                         plan_only: bool = False):
+        # 新库存不复权价 + 复权因子；已有的前复权库保持原样，直到 reset-raw
+        mode = price_mode(self.conn)
+        adjust = "" if mode == "raw" else "qfq"
+        with self.pool.writer() as conn:
+            if mode == "raw":
+                set_price_mode(conn, mode)
+            # 紧凑库的 daily_data 是视图，K线在 daily_bars
+            if not is_compact(conn):
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS daily_data (
+                        stock TEXT NOT NULL,
+                        日期 TEXT NOT NULL,
+                        开盘 REAL,
+                        最高 REAL,
+                        最低 REAL,
+                        收盘 REAL,
+                        成交量 REAL,
+                        涨跌幅 REAL,
+                        振幅 REAL,
+                        PRIMARY KEY(stock, 日期)
+                    )
+                    """
+                )
 
         df_list = self.get_a_share_list_local()
+        if limit is not None:
+            df_list = df_list.head(limit)
 
-        total = len(df_list)
-        today = datetime.date.today().strftime('%Y%m%d')
-        for idx, row in df_list.iterrows():
-            code = str(row['code']).strip()
-            name = str(row['name']).strip()
-            i = idx + 1
-            # 查询该股票在daily_data表中的最后日期
-            cur = self.conn.cursor()
-            cur.execute("SELECT MAX(日期) FROM daily_data WHERE stock = ?", (name,))
-            last_date = cur.fetchone()[0]
-            if last_date is None:
-                start_date = '20200101'
-            else:
-                # 否则从最后日期的下一天开始
-                last_date_dt = datetime.datetime.strptime(last_date, '%Y-%m-%d')
-                start_date = (last_date_dt + datetime.timedelta(days=1)).strftime('%Y%m%d')
-            end_date = today
-            if start_date > end_date:
-                print(f"[{i}/{total}] {code} {name} 已是最新，无需更新")
-                continue
+        tasks = plan_fetch(self.conn, df_list)
+        print(summarize_plan(tasks, len(df_list)))
+        if plan_only:
+            return tasks
+
+        if workers > 1 or rps:
+            fetcher = ConcurrentFetcher(self.db_path, self.ak, workers=workers, rps=rps, adjust=adjust)
+            stats = fetcher.run(tasks)
+            self._after_fetch(tasks)
+            return stats
+
+        total = len(tasks)
+        for i, (code, name, start_date, end_date, _) in enumerate(tasks, start=1):
             try:
                 print(f"[{i}/{total}] Fetching {code} {name} from {start_date} to {end_date}...", end=" ")
-                hist:pd.DataFrame = ak.stock_zh_a_hist(
+                hist:pd.DataFrame = self.ak.stock_zh_a_hist(
                     symbol=code,
                     period="daily",
                     start_date=start_date,
                     end_date=end_date,
-                    adjust="qfq",
+                    adjust=adjust,
                 )
-                # print(hist)
-                if isinstance(hist, pd.DataFrame) and not hist.empty:
-                    required_cols = ["日期", "开盘", "最高", "最低", "收盘", "成交量", "涨跌幅", "振幅"]
-                    if not all(col in hist.columns for col in required_cols):
-                        print("missing columns; skipped")
-                        continue
-                    hist = hist[required_cols].copy()
-                    hist["stock"] = name
-                    # Reorder columns to match table
-                    hist = hist[["stock"] + required_cols]
-                    hist.to_sql("daily_data", self.conn, if_exists="append", index=False)
+                hist = prepare_hist(hist, name)
+                if hist is not None:
+                    with self.pool.writer() as conn:
+                        write_bars(conn, hist)
                     print("saved to daily_data")
                 else:
                     print("no data")
@@ -152,74 +201,231 @@ class StockDatabase:
                 break
             except Exception as e:
                 print(f"failed: {e}")
-            if limit is not None and i >= limit:
-                print(f"Reached limit {limit}; stopping.")
-                break
             time.sleep(sleep_sec)
+        self._after_fetch(tasks)
+
+    def _after_fetch(self, tasks):
+        stocks = [t.name for t in tasks]
+        if price_mode(self.conn) == "raw":
+            # 除权除息后只换因子，已存K线不动；后复权指标需要整段重算
+            changed = update_factors(self.conn, self.ak, tasks, writer=self.pool.writer)
+            self.update_indicators(sorted(changed), rebuild=True, refresh_snapshot=False)
+            self.update_indicators([s for s in stocks if s not in changed], refresh_snapshot=False)
+        else:
+            self.update_indicators(stocks, refresh_snapshot=False)
+        if ColumnarStore(ColumnarStore.default_root(self.db_path)).exists():
+            self.sync_columnar()
+        self.refresh_latest_snapshot(stocks)
+        self._bars_changed(stocks)
+
+    def _bars_changed(self, stocks=None):
+        """Tell caches that bars of `stocks` (None: any stock) changed, in this and other processes."""
+        if stocks is not None and not stocks:
+            return
+        with self.pool.writer() as conn:
+            bump_bars_version(conn)
+        bars_written(stocks)
+
+    def update_indicators(self, stocks=None, rebuild=False, refresh_snapshot=True):
+        """
+        Extend the persisted K/D/J/short/long store after new bars land.
+        latest_snapshot rows of the same stocks are refreshed afterwards
+        unless the caller does that itself (`_after_fetch`).
+        """
+        if stocks is not None and not stocks:
+            return 0
+        with self.pool.writer() as conn:
+            rows = IndicatorStore(conn).update(stocks, rebuild=rebuild)
+        print(f"indicators: {rows} rows written")
+        if refresh_snapshot and (rows or rebuild) and latest_snapshot.exists(self.conn):
+            self.refresh_latest_snapshot(stocks)
+        return rows
     
-    def query_daily_data(self, stock_name, day_count=30):
+    def refresh_latest_snapshot(self, stocks=None, chunk_size=1000):
+        """Rebuild the latest_snapshot rows of `stocks` (default: every stock with bars)."""
+        conn = self.conn
+        stocks = sorted(last_dates(conn)) if stocks is None else list(stocks)
+        self.ensure_stock_tables()
+        info = pd.read_sql("SELECT code, name, mv, circ_mv FROM stocks", conn)
+        written = 0
+        for start in range(0, len(stocks), chunk_size):
+            chunk = stocks[start:start + chunk_size]
+            bars = self.query_daily_panel(chunk, day_count=2, columns=["日期", "收盘", "涨跌幅", "成交量"])
+            rows = latest_snapshot.build_rows(bars, self.latest_indicators(chunk), info)
+            with self.pool.writer() as w:
+                written += latest_snapshot.write_rows(w, rows)
+        print(f"latest snapshot: {written} stocks refreshed")
+        return written
+
+    def latest_indicators(self, stocks):
+        """
+        (stock, 日期, K, D, J, short, long) at each stock's last stored
+        indicator bar, in qfq units. Both the latest_snapshot table and the
+        panel screen take their last-bar indicators from here.
+        """
+        stocks = list(stocks)
+        placeholders = ",".join("?" * len(stocks))
+        try:
+            ind = pd.read_sql(
+                f"""
+                SELECT i.stock, i.日期, {", ".join("i." + c for c in INDICATOR_COLS)} FROM indicator_state s
+                JOIN indicators i ON i.stock = s.stock AND i.日期 = s.日期
+                WHERE s.stock IN ({placeholders})
+                """,
+                self.conn, params=stocks,
+            )
+        except Exception:
+            # 指标表尚未建立
+            return pd.DataFrame(columns=["stock", "日期"] + INDICATOR_COLS)
+        if not ind.empty and price_mode(self.conn) == "raw":
+            # 只有 short/long 需要换算到前复权
+            ind = to_qfq(ind, load_factors(self.conn, stocks))
+        return ind
+
+    def _to_qfq(self, df, stock=None):
+        """Raw bars to qfq prices when the DB stores unadjusted prices."""
+        if df.empty or "日期" not in df.columns or price_mode(self.conn) != "raw":
+            return df
+        names = [stock] if stock is not None else pd.unique(df["stock"])
+        return to_qfq(df, load_factors(self.conn, names), stock)
+
+    def reset_raw_prices(self):
+        """
+        Drop the stored bars, indicators and factors and switch the DB to
+        raw prices; the next fetch downloads unadjusted history.
+        """
+        import shutil
+        with self.pool.writer() as conn:
+            table = "daily_bars" if is_compact(conn) else "daily_data"
+            for t in (table, "indicators", "indicator_state", "adj_factors", "adj_checked", latest_snapshot.TABLE):
+                if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (t,)).fetchone():
+                    conn.execute(f"DELETE FROM {t}")
+            set_price_mode(conn, "raw")
+        shutil.rmtree(ColumnarStore.default_root(self.db_path), ignore_errors=True)
+        self.columnar = None
+        self._bars_changed()
+        print("daily bars cleared; run `python app.py db fetch` to download raw prices")
+
+    def query_daily_data(self, stock_name, day_count=30, with_indicators=False):
+        if self.columnar is not None and not with_indicators and self.columnar.has_stock(stock_name):
+            return self._to_qfq(self.columnar.query(stock_name, day_count), stock_name)
         q = f"SELECT * FROM daily_data WHERE stock = ? ORDER BY 日期 DESC LIMIT ?"
-        df = pd.read_sql(q, self.conn, params=(stock_name, day_count))
+        df = None
+        if with_indicators:
+            cols = ", ".join(f"i.{c}" for c in INDICATOR_COLS)
+            q_ind = f"""
+                SELECT d.*, {cols} FROM daily_data d
+                LEFT JOIN indicators i ON i.stock = d.stock AND i.日期 = d.日期
+                WHERE d.stock = ? ORDER BY d.日期 DESC LIMIT ?
+            """
+            try:
+                df = pd.read_sql(q_ind, self.conn, params=(stock_name, day_count))
+            except Exception:
+                # 指标表尚未建立时退回到只读K线
+                df = None
+        if df is None and is_compact(self.conn):
+            # 紧凑表：按整数 id 和整数日期读取，不经过兼容视图
+            q = """
+                SELECT ? AS stock, 日期, 开盘, 最高, 最低, 收盘, 成交量, 涨跌幅, 振幅 FROM daily_bars
+                WHERE stock_id = (SELECT id FROM stock_ids WHERE name = ?)
+                ORDER BY 日期 DESC LIMIT ?
+            """
+            df = pd.read_sql(q, self.conn, params=(stock_name, stock_name, day_count))
+            df["日期"] = int_to_dates(df["日期"].to_numpy())
+        if df is None:
+            df = pd.read_sql(q, self.conn, params=(stock_name, day_count))
         if df.empty:
             return df
         df["日期"] = pd.to_datetime(df["日期"])
         df = df.sort_values("日期").reset_index(drop=True)
-        return df
+        return self._to_qfq(df, stock_name)
     
+    def query_daily_panel(self, stock_names, day_count=60, columns=None):
+        """
+        Last `day_count` bars of every stock in `stock_names`, in one query.
+        Returns a long DataFrame sorted by stock and 日期; each stock's rows
+        are read through the (stock, 日期) primary key.
+        """
+        columns = columns or self.candle_columns
+        stock_names = list(stock_names)
+        if self.columnar is not None:
+            return self._to_qfq(self.columnar.scan(stock_names, day_count, columns))
+        if not stock_names:
+            return pd.DataFrame(columns=["stock"] + columns)
+        placeholders = ",".join("?" * len(stock_names))
+        cols = ", ".join(columns)
+        if is_compact(self.conn):
+            q = f"""
+                SELECT i.name AS stock, {", ".join("b." + c for c in columns)} FROM (
+                    SELECT *, ROW_NUMBER() OVER (PARTITION BY stock_id ORDER BY 日期 DESC) AS rn
+                    FROM daily_bars
+                    WHERE stock_id IN (SELECT id FROM stock_ids WHERE name IN ({placeholders}))
+                ) b JOIN stock_ids i ON i.id = b.stock_id
+                WHERE rn <= ?
+                ORDER BY i.name, b.日期
+            """
+            df = pd.read_sql(q, self.conn, params=(*stock_names, day_count))
+            df["日期"] = int_to_dates(df["日期"].to_numpy())
+            return self._to_qfq(df)
+        q = f"""
+            SELECT stock, {cols} FROM (
+                SELECT stock, {cols},
+                       ROW_NUMBER() OVER (PARTITION BY stock ORDER BY 日期 DESC) AS rn
+                FROM daily_data WHERE stock IN ({placeholders})
+            )
+            WHERE rn <= ?
+            ORDER BY stock, 日期
+        """
+        df = pd.read_sql(q, self.conn, params=(*stock_names, day_count))
+        df["日期"] = pd.to_datetime(df["日期"])
+        return self._to_qfq(df)
+
     def get_stock_detailed_info(self, stock_code="000001"):
         try:
-            info_df = ak.stock_individual_info_em(symbol=stock_code)
+            info_df = self.ak.stock_individual_info_em(symbol=stock_code)
             return info_df
         except Exception as e:
             print(f"获取 {stock_code} 信息失败: {e}")
             return None
         
-    def download_stock_data(self, filename="stock_data.pkl"):
-        import pickle
-        df = self.get_a_stock_info()
-        with open(filename, "wb") as f:
-            pickle.dump(df, f)
-
-    def update_stock_info(self):
-        
-        cur = self.conn.cursor()
+    def download_stock_data(self):
+        """刷新缓存中的全市场快照（取代原来的 stock_data.pkl）"""
+        if isinstance(self.ak, CachedAkshare):
+            return self.ak.refresh("stock_zh_a_spot_em")
+        return self.get_a_stock_info()
 
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS stocks (
-                code TEXT PRIMARY KEY,
-                name TEXT,
-                mv TEXT,
-                circ_mv TEXT
-            )
-        ''')
-        if os.path.exists("stock_data.pkl"):
-            with open("stock_data.pkl", "rb") as f:
-                df = pickle.load(f)
-        else:
-            df = self.get_a_stock_info()
-#       
-        cnt = 0
-        for code in df['代码']:
-            print(f"{code}, {df['名称'][cnt]}")
-            cur.execute("INSERT OR IGNORE INTO stocks (code) VALUES (?)", (code,))
-            cur.execute(
-                "UPDATE stocks SET name=?, mv=?, circ_mv=? WHERE code=?",
-                (df['名称'][cnt], df['总市值'][cnt], df['流通市值'][cnt], code),
-            )
-            self.conn.commit()
-            cnt += 1
+    def update_stock_info(self, as_of=None):
+        """Load the spot snapshot into `stocks` / `stock_snapshots`; only changed rows are written."""
+        # 快照来自响应缓存，过期后自动重新下载
+        df = self.get_a_stock_info()
+        with self.pool.writer() as conn:
+            changed = ingest_snapshot(conn, df, as_of)
+            if changed:
+                latest_snapshot.sync_market_values(conn)
+        print(f"stocks: {len(df)} in snapshot, {changed} changed")
+        return changed
 
     def daily_update(self):
         self.download_stock_data()
         self.update_stock_info()
 
-    def get_market_value_by_code(self, code):
+    def codes_by_market_value(self, min_value=None, max_value=None, column="mv", as_of=None):
+        """Stocks whose market value (元) lies in [min_value, max_value], in one indexed query."""
+        self.ensure_stock_tables()
+        return codes_by_market_value(self.conn, min_value, max_value, column, as_of)
+
+    def get_market_value_by_code(self, code, as_of=None):
         """
-        Returns the market value (mv) for the given stock code as a float.
+        Returns the market value (mv) for the given stock code as a float,
+        from the latest snapshot or the one in effect on `as_of`.
         Returns None if not found or not convertible.
         """
         cur = self.conn.cursor()
-        cur.execute("SELECT mv FROM stocks WHERE code = ?", (code,))
+        if as_of is None:
+            cur.execute("SELECT mv FROM stocks WHERE code = ?", (code,))
+        else:
+            sql, params = as_of_sql(as_of)
+            cur.execute(f"SELECT mv FROM ({sql}) WHERE code = ?", (*params, code))
         row = cur.fetchone()
         if row and row[0] is not None:
             try:
@@ -229,33 +435,109 @@ class StockDatabase:
                 return None
         return None
 
-    def calculate_pct_and_amp_for_all(self):
+    def get_meta(self, key, default=None):
+        try:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        except sqlite3.OperationalError:
+            return default
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self.pool.writer() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def calculate_pct_and_amp_for_all(self, incremental=False, batch_size=200):
         """
         计算所有股票的涨跌幅和振幅，并更新到 daily_data 表。
         涨跌幅 = (收盘 - 前一日收盘) / 前一日收盘 * 100
         振幅 = (最高 - 最低) / 前一日收盘 * 100
+        每批股票只执行一条 UPDATE ... FROM，前收盘由 LAG() 窗口函数给出。
+        incremental=True 时只更新 涨跌幅 为空或日期晚于上次水位的行。
+        不复权库按后复权价计算，除权日的涨跌幅与交易所一致。
         """
-        cur = self.conn.cursor()
-        cur.execute("SELECT DISTINCT stock FROM daily_data")
-        stocks = [row[0] for row in cur.fetchall()]
-        for stock in stocks:
-            df = pd.read_sql(
-                "SELECT 日期, 开盘, 最高, 最低, 收盘 FROM daily_data WHERE stock = ? ORDER BY 日期 ASC",
-                self.conn, params=(stock,)
+        compact = is_compact(self.conn)
+        # 紧凑表直接更新 daily_bars，兼容视图不支持 UPDATE ... FROM
+        table, key = ("daily_bars", "stock_id") if compact else ("daily_data", "stock")
+        if compact:
+            keys = [r[0] for r in self.conn.execute("SELECT id FROM stock_ids ORDER BY id")]
+        else:
+            keys = [r[0] for r in self.conn.execute("SELECT stock FROM daily_data GROUP BY stock")]
+
+        watermark = self.get_meta("pct_amp_watermark") if incremental else None
+        if watermark is not None and compact:
+            watermark = int(watermark.replace("-", ""))
+        pending = "(涨跌幅 IS NULL OR 日期 > ?)" if watermark is not None else "涨跌幅 IS NULL"
+        # 不复权库：因子按区间预先展开成 CTE，每根K线按区间连接，不再逐行子查询
+        raw = price_mode(self.conn) == "raw"
+        factors = f"factors AS ({factor_ranges_sql(compact)})" if raw else None
+        factor = "COALESCE(fa.factor, 1.0)" if raw else "1.0"
+        factor_join = (f"LEFT JOIN factors fa ON fa.k = d.{key} AND d.日期 >= fa.since"
+                       " AND (fa.until IS NULL OR d.日期 < fa.until)") if raw else ""
+        window = f"""
+            SELECT k, day,
+                   ROUND((c * f - LAG(c * f) OVER w) / LAG(c * f) OVER w * 100, 3) AS pct,
+                   ROUND((hi - lo) * f / LAG(c * f) OVER w * 100, 3) AS amp
+            FROM (
+                SELECT d.{key} AS k, d.日期 AS day, d.收盘 AS c, d.最高 AS hi, d.最低 AS lo, {factor} AS f
+                FROM {table} d {factor_join} {{join}}
             )
-            if df.shape[0] < 2:
-                continue
-            df["前收盘"] = df["收盘"].shift(1)
-            df["涨跌幅"] = ((df["收盘"] - df["前收盘"]) / df["前收盘"] * 100).round(3)
-            df["振幅"] = ((df["最高"] - df["最低"]) / df["前收盘"] * 100).round(3)
-            for idx, row in df.iterrows():
-                if pd.isna(row["前收盘"]):
-                    continue
-                cur.execute(
-                    "UPDATE daily_data SET 涨跌幅=?, 振幅=? WHERE stock=? AND 日期=?",
-                    (row["涨跌幅"], row["振幅"], stock, row["日期"])
-                )
-            self.conn.commit()
+            WINDOW w AS (PARTITION BY k ORDER BY day)
+        """
+
+        total, updated = len(keys), 0
+        started = time.monotonic()
+        for start in range(0, total, batch_size):
+            chunk = keys[start:start + batch_size]
+            placeholders = ",".join("?" * len(chunk))
+            if incremental:
+                # 只为有待更新行的股票开窗，从第一条待更新行的前一根K线开始
+                sql = f"""
+                    WITH {factors + "," if factors else ""} pending AS (
+                        SELECT {key} AS k, MIN(日期) AS first FROM {table} p
+                        WHERE {key} IN ({placeholders}) AND {pending}
+                          -- 首根K线没有前收盘，涨跌幅永远为空，不算待更新
+                          AND 日期 > (SELECT MIN(x.日期) FROM {table} x WHERE x.{key} = p.{key})
+                        GROUP BY {key}
+                    ), bounds AS (
+                        SELECT p.k, COALESCE(
+                            (SELECT MAX(x.日期) FROM {table} x WHERE x.{key} = p.k AND x.日期 < p.first),
+                            p.first) AS since
+                        FROM pending p
+                    )
+                    UPDATE {table} AS t SET 涨跌幅 = c.pct, 振幅 = c.amp
+                    FROM ({window.format(join="JOIN bounds b ON b.k = d." + key + " AND d.日期 >= b.since")}) AS c
+                    WHERE t.{key} = c.k AND t.日期 = c.day AND c.pct IS NOT NULL
+                      AND {pending.replace("涨跌幅", "t.涨跌幅").replace("日期", "t.日期")}
+                """
+                params = [*chunk] + ([watermark, watermark] if watermark is not None else [])
+            else:
+                sql = f"""
+                    {"WITH " + factors if factors else ""}
+                    UPDATE {table} AS t SET 涨跌幅 = c.pct, 振幅 = c.amp
+                    FROM ({window.format(join=f"WHERE d.{key} IN ({placeholders})")}) AS c
+                    WHERE t.{key} = c.k AND t.日期 = c.day AND c.pct IS NOT NULL
+                """
+                params = chunk
+            with self.pool.writer() as conn:
+                changes = conn.total_changes
+                conn.execute(sql, params)
+                updated += conn.total_changes - changes
+            done = min(start + batch_size, total)
+            elapsed = time.monotonic() - started
+            print(f"[{done}/{total}] stocks, {updated} rows updated, {elapsed:.1f}s")
+
+        newest = self.conn.execute(f"SELECT MAX(日期) FROM {table}").fetchone()[0]
+        if newest is not None:
+            if compact:
+                newest = f"{newest // 10000:04d}-{newest // 100 % 100:02d}-{newest % 100:02d}"
+            self.set_meta("pct_amp_watermark", newest)
+        if updated:
+            # 涨跌幅变了，latest_snapshot 里的也要跟着更新
+            if latest_snapshot.exists(self.conn):
+                self.refresh_latest_snapshot()
+            self._bars_changed()
+        return updated
 
 if __name__=='__main__':
     import sys
@@ -276,6 +558,14 @@ if __name__=='__main__':
         code = sys.argv[2]
         print(db.get_stock_detailed_info(code))
     elif cmd == "calc_inc":
-        db.calculate_pct_and_amp_for_all()
+        db.calculate_pct_and_amp_for_all(incremental="--incremental" in sys.argv)
+    elif cmd == "columnar":
+        db.sync_columnar(rebuild="--rebuild" in sys.argv)
+    elif cmd == "indicators":
+        db.update_indicators(rebuild="--rebuild" in sys.argv)
+    elif cmd == "reset-raw":
+        db.reset_raw_prices()
+    elif cmd == "latest":
+        db.refresh_latest_snapshot()
     else:
         print("Unknown command or missing argument.")
\ No newline at end of file
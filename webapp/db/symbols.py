@@ -0,0 +1,131 @@
+"""In-memory symbol index over the `stocks` table.
+
+Every stock is reachable by its code, its name and the pinyin initials of
+its name (江西铜业 -> JXTY). Keys live in one sorted list, so a prefix
+lookup is a bisect plus a short scan and exact resolution is a dict hit.
+
+pypinyin is used for the initials when installed; otherwise they come
+from the GB2312 collation table, which covers the level-1 hanzi that
+nearly all stock names use.
+"""
+import threading
+from bisect import bisect_left
+
+import pandas as pd
+
+from webapp.db.connection import reader
+from webapp.db.events import stocks_version
+
+try:
+    from pypinyin import lazy_pinyin, Style
+except ImportError:  # optional dependency
+    lazy_pinyin = None
+
+# GB2312 一级汉字按拼音排序，每个声母的起始编码
+_GB2312_INITIALS = [
+    (0xB0A1, "A"), (0xB0C5, "B"), (0xB2C1, "C"), (0xB4EE, "D"), (0xB6EA, "E"),
+    (0xB7A2, "F"), (0xB8C1, "G"), (0xB9FE, "H"), (0xBBF7, "J"), (0xBFA6, "K"),
+    (0xC0AC, "L"), (0xC2E8, "M"), (0xC4C3, "N"), (0xC5B6, "O"), (0xC5BE, "P"),
+    (0xC6DA, "Q"), (0xC8BB, "R"), (0xC8F6, "S"), (0xCBFA, "T"), (0xCDDA, "W"),
+    (0xCEF4, "X"), (0xD1B9, "Y"), (0xD4D1, "Z"),
+]
+_GB2312_BOUNDS = [b for b, _ in _GB2312_INITIALS]
+_GB2312_LEVEL1_END = 0xD7F9
+
+
+def _char_initial(ch):
+    if ch.isascii():
+        return ch.upper() if ch.isalnum() else ""
+    try:
+        raw = ch.encode("gb2312")
+    except UnicodeEncodeError:
+        return ""
+    if len(raw) != 2:
+        return ""
+    code = raw[0] << 8 | raw[1]
+    if code < _GB2312_BOUNDS[0] or code > _GB2312_LEVEL1_END:
+        return ""
+    return _GB2312_INITIALS[bisect_left(_GB2312_BOUNDS, code + 1) - 1][1]
+
+
+def pinyin_initials(name):
+    if lazy_pinyin is not None:
+        return "".join(p[:1] for p in lazy_pinyin(name, style=Style.FIRST_LETTER, errors="ignore")).upper()
+    return "".join(_char_initial(ch) for ch in name)
+
+
+class SymbolIndex:
+    def __init__(self, rows):
+        self.entries = []
+        self._exact = {}
+        keys = []
+        for code, name in rows:
+            code, name = str(code).strip(), str(name).strip()
+            if not code or not name:
+                continue
+            initials = pinyin_initials(name)
+            i = len(self.entries)
+            self.entries.append((code, name, initials))
+            for key in {code, name.upper(), initials}:
+                if key:
+                    keys.append((key, i))
+            self._exact.setdefault(code, i)
+            self._exact.setdefault(name.upper(), i)
+        keys.sort()
+        self._keys = [k for k, _ in keys]
+        self._ids = [i for _, i in keys]
+
+    @classmethod
+    def load(cls, conn):
+        try:
+            df = pd.read_sql_query("SELECT code, name FROM stocks ORDER BY code", conn)
+        except Exception:
+            return cls([])
+        return cls(df.itertuples(index=False, name=None))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def search(self, query, limit=10):
+        """(code, name, initials) entries whose code, name or initials start with `query`."""
+        query = str(query or "").strip().upper()
+        if not query:
+            return []
+        out, seen = [], set()
+        i = bisect_left(self._keys, query)
+        while i < len(self._keys) and self._keys[i].startswith(query) and len(out) < limit:
+            idx = self._ids[i]
+            if idx not in seen:
+                seen.add(idx)
+                out.append(self.entries[idx])
+            i += 1
+        return out
+
+    def resolve(self, query):
+        """Stock name for an exact code/name, or for initials that match a single stock."""
+        query = str(query or "").strip().upper()
+        idx = self._exact.get(query)
+        if idx is not None:
+            return self.entries[idx][1]
+        matches = [e for e in self.search(query, limit=2) if e[2] == query]
+        return matches[0][1] if len(matches) == 1 else None
+
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+
+def get_symbol_index(conn=None, refresh=False):
+    """
+    Process-wide index, loaded from `stocks` on first use and reloaded when
+    meta.stocks_version moves (the stock list is imported by another process).
+    """
+    global _index, _index_version
+    conn = conn if conn is not None else reader()
+    version = stocks_version(conn)
+    with _index_lock:
+        if _index is None or refresh or version != _index_version:
+            _index = SymbolIndex.load(conn)
+            _index_version = version
+        return _index
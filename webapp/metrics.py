@@ -0,0 +1,216 @@
+"""Opt-in latency instrumentation.
+
+Set STOCK_METRICS=1 to enable. The app then records these latency
+histograms:
+
+    dash_callback_seconds{callback}   each Dash callback, end to end
+    http_request_seconds{path}        Flask requests; the gap to the
+                                      callback time is Dash's JSON encoding
+    stage_seconds{stage}              figure load / indicator / build steps
+    sqlite_query_seconds{op,phase}    every statement on a pooled connection,
+                                      split into execute and fetch
+
+`install(server)` serves them in the Prometheus text format at /metrics.
+Statements slower than STOCK_SLOW_QUERY_MS (default 100) are appended to
+STOCK_SLOW_QUERY_LOG (default slow_queries.log). With metrics disabled,
+`instrument` returns the callback unchanged and connections are plain
+sqlite3 connections.
+"""
+import functools
+import logging
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+ENABLED = os.environ.get("STOCK_METRICS", "") not in ("", "0")
+SLOW_QUERY_MS = float(os.environ.get("STOCK_SLOW_QUERY_MS", "100"))
+SLOW_QUERY_LOG = os.environ.get("STOCK_SLOW_QUERY_LOG", "slow_queries.log")
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+HELP = {
+    "dash_callback_seconds": "Dash callback latency",
+    "http_request_seconds": "Flask request latency",
+    "stage_seconds": "Latency of chart and analysis stages",
+    "sqlite_query_seconds": "SQLite statement latency",
+}
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._metrics.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = Histogram()
+            hist.observe(seconds)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._metrics.items()):
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, hist in sorted(series.items()):
+                    labels = ",".join(f'{k}="{_escape(v)}"' for k, v in key)
+                    sep = "," if labels else ""
+                    cumulative = 0
+                    for bound, n in zip(BUCKETS, hist.counts):
+                        cumulative += n
+                        lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {hist.count}')
+                    lines.append(f"{name}_sum{{{labels}}} {hist.sum}")
+                    lines.append(f"{name}_count{{{labels}}} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = Registry()
+
+
+@contextmanager
+def stage(name):
+    """Time a block as stage_seconds{stage=name}; no-op when disabled."""
+    if not ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe("stage_seconds", time.perf_counter() - started, stage=name)
+
+
+def instrument(fn):
+    """Decorator for Dash callbacks; put it under @callback."""
+    if not ENABLED:
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            registry.observe("dash_callback_seconds", time.perf_counter() - started, callback=fn.__name__)
+    return wrapper
+
+
+# ---- SQLite ----
+
+_slow_log = None
+_slow_log_lock = threading.Lock()
+
+
+def _slow_logger():
+    global _slow_log
+    with _slow_log_lock:
+        if _slow_log is None:
+            _slow_log = logging.getLogger("webapp.slow_query")
+            _slow_log.propagate = False
+            handler = logging.FileHandler(SLOW_QUERY_LOG, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            _slow_log.addHandler(handler)
+            _slow_log.setLevel(logging.INFO)
+        return _slow_log
+
+
+def _record_query(sql, seconds, phase):
+    sql = sql or ""
+    op = sql.lstrip().split(None, 1)[0].lower() if sql.strip() else "unknown"
+    registry.observe("sqlite_query_seconds", seconds, op=op, phase=phase)
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        _slow_logger().info("%.1fms %s %s", seconds * 1000, phase, " ".join(sql.split()))
+
+
+class TimedCursor(sqlite3.Cursor):
+    _sql = None
+
+    def execute(self, sql, parameters=()):
+        self._sql = sql
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_query(sql, time.perf_counter() - started, "execute")
+
+    def executemany(self, sql, seq_of_parameters):
+        self._sql = sql
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record_query(sql, time.perf_counter() - started, "execute")
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            _record_query(self._sql, time.perf_counter() - started, "fetch")
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            _record_query(self._sql, time.perf_counter() - started, "fetch")
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection whose cursors time every statement; pass as `factory=`."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+# ---- Flask ----
+
+def install(server):
+    """Time Flask requests and serve /metrics on `server` (the Dash app's Flask server)."""
+    from flask import Response, g, request
+
+    @server.before_request
+    def _start_timer():
+        g._metrics_started = time.perf_counter()
+
+    @server.after_request
+    def _stop_timer(response):
+        started = getattr(g, "_metrics_started", None)
+        if started is not None:
+            # Dash 的静态资源路径很多，只按内部接口分开统计
+            path = request.path if request.path.startswith("/_dash") else "other"
+            registry.observe("http_request_seconds", time.perf_counter() - started, path=path)
+        return response
+
+    @server.route("/metrics")
+    def metrics():
+        return Response(registry.render(), mimetype="text/plain; version=0.0.4")
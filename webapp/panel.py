@@ -0,0 +1,143 @@
+"""Stocks x days price panels and indicator math vectorized across stocks.
+
+`calculate_kdj` in webapp.ui.plot works on one stock's frame. The functions
+here compute the same numbers for thousands of stocks at once: every
+field is a 2D float array (one row per stock, one column per bar) and the
+recursive averages step through the columns with numpy ops over all rows.
+"""
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+class PricePanel:
+    """Right-aligned panel: column -1 is every stock's own latest bar.
+
+    Stocks with fewer bars than the panel length are padded with NaN on
+    the left, which matches what the per-stock pandas pipeline sees.
+    """
+
+    def __init__(self, stocks, dates, fields):
+        self.stocks = list(stocks)
+        self.dates = dates
+        self.fields = fields
+
+    def __getitem__(self, field):
+        return self.fields[field]
+
+    def __len__(self):
+        return len(self.stocks)
+
+    @classmethod
+    def from_frame(cls, df, fields=("开盘", "最高", "最低", "收盘", "成交量"), key="stock", length=None):
+        if df.empty:
+            empty = np.empty((0, length or 0))
+            return cls([], empty.astype("datetime64[ns]"), {f: empty.copy() for f in fields})
+        df = df.sort_values([key, "日期"], kind="stable").reset_index(drop=True)
+        codes, idx = np.unique(df[key].to_numpy(), return_inverse=True)
+        counts = np.bincount(idx)
+        if length is None:
+            length = int(counts.max())
+        pos = df.groupby(key, sort=False).cumcount().to_numpy()
+        col = length - counts[idx] + pos
+        keep = col >= 0
+        rows, col = idx[keep], col[keep]
+
+        dates = np.full((len(codes), length), np.datetime64("NaT"), dtype="datetime64[ns]")
+        dates[rows, col] = pd.to_datetime(df["日期"]).to_numpy()[keep]
+        arrays = {}
+        for f in fields:
+            arr = np.full((len(codes), length), np.nan)
+            arr[rows, col] = pd.to_numeric(df[f], errors="coerce").to_numpy(dtype=float)[keep]
+            arrays[f] = arr
+        return cls(codes, dates, arrays)
+
+    def to_calendar(self, *arrays):
+        """Move right-aligned arrays onto shared trading days.
+
+        Returns `(calendar, aligned)`: the sorted union of every stock's
+        dates and, for each array, a stocks x calendar copy with NaN on the
+        days a stock has no bar (suspended or not yet listed).
+        """
+        valid = ~np.isnat(self.dates)
+        calendar = np.unique(self.dates[valid])
+        rows, cols = np.nonzero(valid)
+        cal_cols = np.searchsorted(calendar, self.dates[rows, cols])
+        aligned = []
+        for arr in arrays:
+            out = np.full((len(self.stocks), len(calendar)), np.nan)
+            out[rows, cal_cols] = np.asarray(arr, dtype=float)[rows, cols]
+            aligned.append(out)
+        return calendar, aligned
+
+
+def ewm_panel(values, alpha, adjust=False, state=None, mask=None):
+    """Row-wise exponential mean, identical to pandas `ewm(alpha=...).mean()`.
+
+    Follows the pandas recursion (ignore_na=False): leading NaNs are
+    skipped, and once started the old weight decays on every step. Returns
+    `(out, state)`; passing `state` back in continues the series, so new
+    bars can be appended without recomputing history. Cells where `mask`
+    is False are padding: they leave the state untouched and come out NaN.
+    """
+    values = np.asarray(values, dtype=float)
+    rows, cols = values.shape
+    out = np.empty_like(values)
+    if state is None:
+        weighted = np.full(rows, np.nan)
+        old_wt = np.ones(rows)
+    else:
+        weighted = np.array(state[0], dtype=float)
+        old_wt = np.array(state[1], dtype=float)
+    new_wt = 1.0 if adjust else alpha
+    decay = 1.0 - alpha
+    for t in range(cols):
+        cur = values[:, t]
+        obs = ~np.isnan(cur)
+        started = ~np.isnan(weighted)
+        wt = np.where(started, old_wt * decay, old_wt)
+        upd = started & obs
+        w = np.where(upd, (wt * weighted + new_wt * cur) / (wt + new_wt), weighted)
+        wt = np.where(upd, wt + new_wt if adjust else 1.0, wt)
+        first = ~started & obs
+        w = np.where(first, cur, w)
+        wt = np.where(first, 1.0, wt)
+        if mask is None:
+            weighted, old_wt = w, wt
+            out[:, t] = weighted
+        else:
+            active = mask[:, t]
+            weighted = np.where(active, w, weighted)
+            old_wt = np.where(active, wt, old_wt)
+            out[:, t] = np.where(active, weighted, np.nan)
+    return out, (weighted, old_wt)
+
+
+def rolling_panel(values, window, how):
+    """Row-wise rolling min/max with pandas' default min_periods=window."""
+    values = np.asarray(values, dtype=float)
+    out = np.full(values.shape, np.nan)
+    if values.shape[1] >= window:
+        windows = sliding_window_view(values, window, axis=1)
+        # NaN in a window propagates, same as an incomplete pandas window
+        out[:, window - 1:] = windows.max(axis=2) if how == "max" else windows.min(axis=2)
+    return out
+
+
+def kdj_panel(high, low, close, n=9, m1=3, m2=3):
+    """K, D, J arrays for a whole panel; same numbers as `calculate_kdj`."""
+    low_list = rolling_panel(low, n, "min")
+    high_list = rolling_panel(high, n, "max")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rsv = (close - low_list) / (high_list - low_list) * 100
+    k, _ = ewm_panel(rsv, 1.0 / m1)
+    d, _ = ewm_panel(k, 1.0 / m2)
+    return k, d, 3 * k - 2 * d
+
+
+def double_line_panel(close):
+    """short and long arrays for a whole panel; same numbers as `double_line`."""
+    short, _ = ewm_panel(close, 2.0 / 11, adjust=True)
+    short, _ = ewm_panel(short, 2.0 / 11, adjust=True)
+    long = sum(ewm_panel(close, 2.0 / (span + 1), adjust=True)[0] for span in (14, 28, 57, 114)) * 0.25
+    return short, long
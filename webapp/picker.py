@@ -1,59 +1,97 @@
 import pandas as pd
-from webapp.ui.plot import calculate_kdj
+from webapp.panel import PricePanel, kdj_panel
 from datetime import date
 
 from webapp.db.stock_db import StockDatabase
+from webapp.db.connection import get_db_path
+from webapp.db.indicator_store import IndicatorStore
+from webapp.db.fetcher import last_dates
+from webapp.screen_pool import load_panel, screen_panel
+from webapp import signals
 
 class StockPicker:
     db_path: str
 
     def __init__(self):
-        self.db_path = "stock_data.db"
-        self.db = StockDatabase(self.db_path)
+        self.db_path = get_db_path()
+        # 列式副本存在时全市场扫描直接读它
+        self.db = StockDatabase(self.db_path, columnar=True)
 
-    def find_stocks_with_j_below(self, cols, threshold=12):
+    def find_stocks_with_j_below(self, cols, threshold=12, chunk_size=500, workers=1):
         stock_list = self.db.get_a_share_list_local()
         stock_list = stock_list.sort_values(by="code")  # sort by code
+        codes = stock_list['code'].astype(str).str.strip().tolist()
+        names = stock_list['name'].astype(str).str.strip().tolist()
+
+        # indicators 表中已是最新的股票直接取最后一个J值
+        last_j = {}
+        try:
+            latest = IndicatorStore(self.db.conn, ensure=False).latest()
+            newest = last_dates(self.db.conn)
+            fresh = latest[latest['日期'] == latest['stock'].map(newest)]
+            last_j.update(zip(fresh['stock'], fresh['J']))
+        except Exception:
+            pass
+        pending = [name for name in names if name not in last_j]
 
-        matches = []
         day_count = 60
-        count = 0
-        for idx, row in stock_list.iterrows():
-            code = str(row['code']).strip()
-            name = str(row['name']).strip()
+        if workers > 1 and pending:
+            # 多进程：整个面板放进共享内存，按分片并行计算
+            panel = load_panel(self.db, pending, day_count=day_count)
+            last_j.update(screen_panel(panel, workers=workers)["J"].to_dict())
+            pending = []
+        # 其余的分批读取最近 day_count 根K线，整批一起计算KDJ
+        for start in range(0, len(pending), chunk_size):
+            chunk = pending[start:start + chunk_size]
+            df = self.db.query_daily_panel(chunk, day_count=day_count)
+            panel = PricePanel.from_frame(df, length=day_count)
+            _, _, j = kdj_panel(panel['最高'], panel['最低'], panel['收盘'])
+            last_j.update(zip(panel.stocks, j[:, -1]))
+            print(f"{min(start + chunk_size, len(pending))}/{len(pending)}")
+
+        matches = []
+        for code, name in zip(codes, names):
+            j = last_j.get(name)
+            if j is not None and pd.notna(j) and j < threshold:
+                matches.append((code, name, float(j)))
 
-            df = self.db.query_daily_data(name, day_count=day_count)
-            df = df[self.db.candle_columns]
-            df = calculate_kdj(df)
-            
-            try:
-                last_j = pd.to_numeric(df["J"].iloc[-1], errors="coerce")
-                if pd.notna(last_j) and last_j < threshold:
-                    matches.append((code, name, float(last_j)))
-            except:
-                pass
-            count += 1
-            if count % 100 == 0:
-                print(f"{count}/{len(stock_list)}")
-        
         cols.append('J')
         return matches, cols
 
-    def filter_by_market_value(self, matches,cols, min_value=None, max_value=None):
-        filtered = []
-        for code, name, j in matches:
-            market_value = self.db.get_market_value_by_code(code)
-            if market_value is None:
-                continue
-            if (min_value is not None and market_value < min_value):
-                continue
-            if (max_value is not None and market_value > max_value):
-                continue
-            filtered.append((code, name, j, market_value/1e8))
+    def filter_by_market_value(self, matches,cols, min_value=None, max_value=None, as_of=None):
+        # as_of: 按该日的市值快照筛选，默认最新；一次索引范围查询后在内存中连接
+        in_range = self.db.codes_by_market_value(min_value, max_value, as_of=as_of)
+        mv = dict(zip(in_range["code"], in_range["mv"]))
+        filtered = [(code, name, j, mv[code] / 1e8) for code, name, j in matches if code in mv]
         
         cols.append('market_value')
         return filtered, cols
     
+    def scan_signals(self, names=None, within=1, day_count=120, chunk_size=500):
+        """
+        Events of the registered signals (or just `names`) on each stock's
+        last `within` bars, market-wide. Indicators are computed over the
+        last `day_count` bars, like the panel screen.
+        """
+        stock_list = self.db.get_a_share_list_local().sort_values(by="code")
+        codes = dict(zip(stock_list['name'].astype(str).str.strip(), stock_list['code'].astype(str).str.strip()))
+        stocks = list(codes)
+        found = []
+        for start in range(0, len(stocks), chunk_size):
+            chunk = stocks[start:start + chunk_size]
+            bars = self.db.query_daily_panel(chunk, day_count=day_count)
+            bars["code"] = bars["stock"].map(codes)
+            bars = signals.add_indicators(bars)
+            events = signals.run_signals(bars, names=names)
+            recent = bars.groupby("stock", sort=False).tail(within)[["stock", "日期"]]
+            found.append(events.merge(recent, on=["stock", "日期"]))
+            print(f"{min(start + chunk_size, len(stocks))}/{len(stocks)}")
+        if not found:
+            return pd.DataFrame(columns=["code"] + signals.EVENT_COLS)
+        events = pd.concat(found, ignore_index=True)
+        events.insert(0, "code", events["stock"].map(codes))
+        return events.sort_values(["code", "日期"], kind="stable").reset_index(drop=True)
+
     @staticmethod
     def detect_high_volume_days(df, volume_col="成交量"):
         """
@@ -66,18 +104,30 @@ class StockPicker:
         return df[df["high_volume"]]
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Screen stocks with J below a threshold")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes for the indicator screen")
+    parser.add_argument("--signals", nargs="*", default=None,
+                        help="Write the signal events of the last bar instead (optionally only these signals)")
+    args = parser.parse_args()
+
     picker = StockPicker()
-    # df = picker.db.query_daily_data('江西铜业', 60)
-    # print(StockPicker.detect_high_volume_days(df))
-    
-    cols = ["code", "name"]
-    matches,cols = picker.find_stocks_with_j_below(cols, threshold=12)
-    matches,cols = picker.filter_by_market_value(matches, cols, min_value=80_0000_0000)
-    
-    df = pd.DataFrame(matches, columns=cols)
-    float_cols = [col for col in ["J", "market_value"] if col in df.columns]
-    df[float_cols] = df[float_cols].astype(float).round(2)
-    csv_name = f"result/{date.today().isoformat()}.csv"
-    df.to_csv(csv_name, index=False)
-    
+    if args.signals is not None:
+        events = picker.scan_signals(names=args.signals or None)
+        events["value"] = events["value"].astype(float).round(2)
+        csv_name = f"result/{date.today().isoformat()}-signals.csv"
+        events.to_csv(csv_name, index=False)
+        print(events.groupby(["signal", "kind"]).size().to_string())
+    else:
+        # df = picker.db.query_daily_data('江西铜业', 60)
+        # print(StockPicker.detect_high_volume_days(df))
+
+        cols = ["code", "name"]
+        matches,cols = picker.find_stocks_with_j_below(cols, threshold=12, workers=args.workers)
+        matches,cols = picker.filter_by_market_value(matches, cols, min_value=80_0000_0000)
 
+        df = pd.DataFrame(matches, columns=cols)
+        float_cols = [col for col in ["J", "market_value"] if col in df.columns]
+        df[float_cols] = df[float_cols].astype(float).round(2)
+        csv_name = f"result/{date.today().isoformat()}.csv"
+        df.to_csv(csv_name, index=False)
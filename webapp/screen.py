@@ -0,0 +1,261 @@
+"""Declarative stock screens.
+
+A screen is a JSON (or YAML, when PyYAML is installed) mapping, e.g.
+
+    {
+        "market_value": {"min": 80},
+        "exclude_st": true,
+        "active_within_days": 10,
+        "price": {"min": 3, "max": 50},
+        "J": {"max": 12},
+        "double_volume": {"within": 5}
+    }
+
+Market values are in 亿 and every range is inclusive. The planner runs the
+filters cheapest first:
+
+1. market_value / circ_market_value / exclude_st: one SQL query on `stocks`
+2. active_within_days: the per-stock last bar dates
+3. price, J/K/D, short_above_long, double_volume: the indicator
+   screen, computed only for stocks that survived steps 1-2. Last-bar
+   indicators come from the indicator store when it is current, the same
+   values `latest_snapshot` holds, so both paths agree
+
+When the `latest_snapshot` table is populated and the spec only looks at
+the last bar (double_volume within 1 day at most), all of this collapses
+into a single SELECT over that table (see `snapshot_screen`).
+
+The result has the columns of the picker CSV (code, name, J,
+market_value) plus any other screened values, in code order.
+
+Usage:
+    python app.py screen spec.json [--out result/2024-01-01.csv] [--workers 8]
+"""
+import argparse
+import json
+import os
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from webapp.db import latest_snapshot
+from webapp.db.fetcher import last_dates
+from webapp.screen_pool import load_panel, screen_panel
+
+try:
+    import yaml
+except ImportError:  # optional dependency
+    yaml = None
+
+RANGE_KEYS = {"market_value", "circ_market_value", "price", "J", "K", "D"}
+SPEC_KEYS = RANGE_KEYS | {"exclude_st", "active_within_days", "double_volume", "short_above_long",
+                          "day_count", "workers"}
+DEFAULT_SPEC = {"J": {"max": 12}, "market_value": {"min": 80}}
+
+
+def load_spec(path):
+    with open(path, encoding="utf-8") as f:
+        if path.endswith((".yaml", ".yml")):
+            if yaml is None:
+                raise RuntimeError("PyYAML is required for YAML screen specs")
+            spec = yaml.safe_load(f)
+        else:
+            spec = json.load(f)
+    return validate_spec(spec or {})
+
+
+def validate_spec(spec):
+    unknown = set(spec) - SPEC_KEYS
+    if unknown:
+        raise ValueError(f"unknown screen keys: {', '.join(sorted(unknown))}")
+    for key in RANGE_KEYS & set(spec):
+        bad = set(spec[key]) - {"min", "max"}
+        if bad:
+            raise ValueError(f"{key}: only 'min' and 'max' are allowed, got {', '.join(sorted(bad))}")
+    return spec
+
+
+def _range_sql(expr, bounds, params, scale=1.0):
+    clauses = []
+    if bounds.get("min") is not None:
+        clauses.append(f"{expr} >= ?")
+        params.append(bounds["min"] * scale)
+    if bounds.get("max") is not None:
+        clauses.append(f"{expr} <= ?")
+        params.append(bounds["max"] * scale)
+    return clauses
+
+
+def _in_range(values, bounds):
+    keep = np.ones(len(values), dtype=bool)
+    with np.errstate(invalid="ignore"):
+        if bounds.get("min") is not None:
+            keep &= values >= bounds["min"]
+        if bounds.get("max") is not None:
+            keep &= values <= bounds["max"]
+    return keep
+
+
+def candidates(conn, spec):
+    """Step 1: stocks passing the `stocks` table filters, in code order."""
+    # 市值是带索引的数值列，范围条件直接走索引
+    where, params = [], []
+    if "market_value" in spec:
+        where += _range_sql("mv", spec["market_value"], params, 1e8)
+    if "circ_market_value" in spec:
+        where += _range_sql("circ_mv", spec["circ_market_value"], params, 1e8)
+    if spec.get("exclude_st"):
+        where.append("name NOT LIKE '%ST%' AND name NOT LIKE '%退%'")
+    sql = "SELECT code, name, mv / 1e8 AS market_value, circ_mv / 1e8 AS circ_market_value FROM stocks"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    df = pd.read_sql(sql + " ORDER BY code", conn, params=params)
+    df["code"] = df["code"].astype(str).str.strip()
+    df["name"] = df["name"].astype(str).str.strip()
+    return df.drop_duplicates("name").reset_index(drop=True)
+
+
+def _output_columns(spec, df):
+    cols = ["code", "name", "J", "market_value"]
+    cols += [c for c in ("circ_market_value", "price", "K", "D", "double_volume") if c in spec and c in df]
+    if spec.get("short_above_long"):
+        cols += ["short", "long"]
+    return cols
+
+
+def snapshot_ready(conn, spec):
+    """Whether `spec` can be answered from `latest_snapshot` alone."""
+    dv = spec.get("double_volume")
+    if dv is not None and (dv.get("within", 1) != 1 or dv.get("min_count", 1) > 1):
+        return False
+    return latest_snapshot.exists(conn)
+
+
+def snapshot_screen(conn, spec):
+    """The whole screen as one SELECT over `latest_snapshot`."""
+    where, params = ["code IS NOT NULL"], []
+    if "market_value" in spec:
+        where += _range_sql("mv", spec["market_value"], params, 1e8)
+    if "circ_market_value" in spec:
+        where += _range_sql("circ_mv", spec["circ_market_value"], params, 1e8)
+    if spec.get("exclude_st"):
+        where.append("stock NOT LIKE '%ST%' AND stock NOT LIKE '%退%'")
+    if spec.get("active_within_days") is not None:
+        where.append(f"日期 >= date((SELECT MAX(日期) FROM {latest_snapshot.TABLE}), ?)")
+        params.append(f"-{int(spec['active_within_days'])} days")
+    where += _range_sql("收盘", spec.get("price", {}), params)
+    for key in ("J", "K", "D"):
+        where += _range_sql(key, spec.get(key, {}), params)
+    if spec.get("short_above_long"):
+        where.append("short > long")
+    if "double_volume" in spec:
+        where.append("volume_ratio > 2")
+    sql = f"""
+        SELECT code, stock AS name, J, mv / 1e8 AS market_value, circ_mv / 1e8 AS circ_market_value,
+               收盘 AS price, K, D, CAST(volume_ratio > 2 AS INTEGER) AS double_volume, short, long
+        FROM {latest_snapshot.TABLE} WHERE {" AND ".join(where)} ORDER BY code
+    """
+    df = pd.read_sql(sql, conn, params=params)
+    df["code"] = df["code"].astype(str).str.strip()
+    return df[_output_columns(spec, df)].reset_index(drop=True)
+
+
+def _use_stored_indicators(db, snap, newest):
+    """
+    Overwrite the panel's last-bar K/D/J/short/long with the stored
+    full-history values wherever the indicator store is current, so this
+    path and `snapshot_screen` judge every stock on the same numbers. The
+    panel values (computed over `day_count` bars) only remain for stocks
+    the store has not caught up with.
+    """
+    chunk_size = 900  # SQLite 参数个数上限
+    names = list(snap.index)
+    for start in range(0, len(names), chunk_size):
+        stored = db.latest_indicators(names[start:start + chunk_size])
+        if stored.empty:
+            continue
+        last = stored["stock"].map(newest).astype(str).str.slice(0, 10)
+        stored = stored[stored["日期"].astype(str).str.slice(0, 10) == last].set_index("stock")
+        cols = ["K", "D", "J", "short", "long"]
+        snap.loc[stored.index, cols] = stored[cols].to_numpy(dtype=float)
+
+
+def run_screen(db, spec, workers=None):
+    spec = validate_spec(dict(spec))
+    if snapshot_ready(db.conn, spec):
+        df = snapshot_screen(db.conn, spec)
+        print(f"latest snapshot: {len(df)} stocks")
+        return df
+    db.ensure_stock_tables()
+    df = candidates(db.conn, spec)
+    print(f"sql filters: {len(df)} stocks")
+
+    newest = last_dates(db.conn)
+    df = df[df["name"].isin(newest)]
+    if spec.get("active_within_days") is not None and not df.empty:
+        latest = pd.to_datetime(max(str(d)[:10] for d in newest.values()))
+        last = pd.to_datetime(df["name"].map(newest).astype(str).str.slice(0, 10))
+        df = df[(latest - last).dt.days <= spec["active_within_days"]]
+    print(f"listing filters: {len(df)} stocks")
+
+    needs_bars = {"price", "J", "K", "D", "double_volume", "short_above_long"} & set(spec)
+    # 没有指标条件时仍给出 J 列，与 picker 输出一致
+    day_count = max(spec.get("day_count", 60), spec.get("double_volume", {}).get("within", 1) + 1)
+    panel = load_panel(db, df["name"].tolist(), day_count=day_count)
+    snap = screen_panel(panel, workers=workers or spec.get("workers", 1))
+    _use_stored_indicators(db, snap, newest)
+    snap["price"] = panel["收盘"][:, -1]
+    volume = panel["成交量"]
+    if "double_volume" in spec:
+        n = spec["double_volume"].get("within", 1)
+        with np.errstate(invalid="ignore"):
+            snap["double_volume"] = (volume[:, -n:] > 2 * volume[:, -n - 1:-1]).sum(axis=1)
+    df = df.join(snap, on="name", how="inner")
+
+    if needs_bars:
+        keep = np.ones(len(df), dtype=bool)
+        for key in ("price", "J", "K", "D"):
+            if key in spec:
+                keep &= _in_range(df[key].to_numpy(dtype=float), spec[key])
+        if "double_volume" in spec:
+            keep &= df["double_volume"].to_numpy() >= spec["double_volume"].get("min_count", 1)
+        if spec.get("short_above_long"):
+            keep &= (df["short"] > df["long"]).to_numpy()
+        df = df[keep]
+    print(f"indicator filters: {len(df)} stocks")
+
+    return df[_output_columns(spec, df)].reset_index(drop=True)
+
+
+def write_csv(df, path=None):
+    path = path or f"result/{date.today().isoformat()}.csv"
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    out = df.copy()
+    float_cols = [c for c in out.columns if c not in ("code", "name", "double_volume")]
+    out[float_cols] = out[float_cols].astype(float).round(2)
+    out.to_csv(path, index=False)
+    return path
+
+
+def main(argv=None):
+    from webapp.db.stock_db import StockDatabase
+    from webapp.db.connection import get_db_path, set_db_path
+
+    parser = argparse.ArgumentParser(prog="app.py screen", description="Run a declarative stock screen")
+    parser.add_argument("spec", nargs="?", default=None, help="JSON/YAML screen spec (default: J < 12, mv >= 80亿)")
+    parser.add_argument("--out", default=None, help="CSV path (default: result/<today>.csv)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for the indicator screen")
+    parser.add_argument("--db", default=None, help="SQLite DB path (default: $STOCK_DB_PATH or stock_data.db)")
+    args = parser.parse_args(argv)
+    if args.db:
+        set_db_path(args.db)
+
+    spec = load_spec(args.spec) if args.spec else DEFAULT_SPEC
+    db = StockDatabase(get_db_path(), columnar=True)
+    df = run_screen(db, spec, workers=args.workers)
+    print(f"{len(df)} stocks written to {write_csv(df, args.out)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""Multi-core screening over a shared-memory OHLCV panel.
+
+The parent process loads the last `day_count` bars of every stock once
+into a (fields, stocks, days) float64 array in `multiprocessing.shared_memory`.
+Worker processes attach to that block by name and view it as a numpy
+array, so no price data is pickled. Each task is just a (start, stop)
+range of rows. A worker runs the panel KDJ / double_line / volume checks
+on its rows and returns one small array per indicator; shards are
+concatenated in submission order, i.e. stock code order.
+
+Usage:
+    python -m webapp.screen_pool [--workers 8] [--days 60] [--bench 1,2,4,8]
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from webapp.panel import PricePanel, kdj_panel, double_line_panel
+
+FIELDS = ("开盘", "最高", "最低", "收盘", "成交量")
+RESULT_COLS = ["K", "D", "J", "short", "long", "high_volume"]
+
+# 子进程里挂载的共享面板
+_shm = None
+_panel = None
+
+
+def _attach(name, shape):
+    global _shm, _panel
+    _shm = shared_memory.SharedMemory(name=name)
+    _panel = np.ndarray(shape, dtype=np.float64, buffer=_shm.buf)
+
+
+def _screen_rows(bounds):
+    start, stop = bounds
+    high, low, close, volume = (_panel[FIELDS.index(f), start:stop] for f in ("最高", "最低", "收盘", "成交量"))
+    return screen_arrays(high, low, close, volume)
+
+
+def screen_arrays(high, low, close, volume):
+    """Last-bar K/D/J, short/long and the double-volume flag for each row."""
+    k, d, j = kdj_panel(high, low, close)
+    short, long = double_line_panel(close)
+    high_volume = volume[:, -1] > 2 * volume[:, -2] if volume.shape[1] >= 2 else np.zeros(len(volume), dtype=bool)
+    return np.column_stack([k[:, -1], d[:, -1], j[:, -1], short[:, -1], long[:, -1], high_volume])
+
+
+class SharedPanel:
+    """OHLCV panel copied into a named shared-memory block; use as a context manager."""
+
+    def __init__(self, panel):
+        self.stocks = panel.stocks
+        self.shape = (len(FIELDS), len(panel.stocks), panel[FIELDS[0]].shape[1])
+        self.shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(self.shape)) * 8, 1))
+        self.array = np.ndarray(self.shape, dtype=np.float64, buffer=self.shm.buf)
+        for i, f in enumerate(FIELDS):
+            self.array[i] = panel[f]
+
+    def close(self):
+        self.array = None
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_panel(db, names, day_count=60, chunk_size=1000):
+    """Right-aligned PricePanel for `names`, rows kept in the given order."""
+    frames = [db.query_daily_panel(names[s:s + chunk_size], day_count=day_count)
+              for s in range(0, len(names), chunk_size)]
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["stock", "日期", *FIELDS])
+    panel = PricePanel.from_frame(df, fields=FIELDS, length=day_count)
+    # from_frame 按名字排序，这里换回调用方给的顺序（代码顺序）
+    order = {s: i for i, s in enumerate(panel.stocks)}
+    rows = [order[n] for n in names if n in order]
+    return PricePanel([panel.stocks[r] for r in rows], panel.dates[rows],
+                      {f: panel[f][rows] for f in FIELDS})
+
+
+def screen_panel(panel, workers=None, shard_size=None):
+    """
+    Indicator snapshot (RESULT_COLS) for every stock in `panel`, indexed by
+    stock in panel order. workers=1 runs in-process.
+    """
+    workers = workers or os.cpu_count() or 1
+    n = len(panel)
+    if n == 0:
+        return pd.DataFrame(columns=RESULT_COLS)
+    if workers == 1:
+        out = screen_arrays(panel["最高"], panel["最低"], panel["收盘"], panel["成交量"])
+    else:
+        # 每个进程分几片，慢的分片不会拖住整批
+        shard_size = shard_size or max(1, -(-n // (workers * 4)))
+        shards = [(s, min(s + shard_size, n)) for s in range(0, n, shard_size)]
+        with SharedPanel(panel) as shared:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_attach,
+                                     initargs=(shared.shm.name, shared.shape)) as pool:
+                out = np.concatenate(list(pool.map(_screen_rows, shards)))
+    df = pd.DataFrame(out, index=pd.Index(panel.stocks, name="stock"), columns=RESULT_COLS)
+    df["high_volume"] = df["high_volume"].astype(bool)
+    return df
+
+
+def benchmark(panel, worker_counts, repeat=3):
+    """Best-of-`repeat` wall time of screen_panel for each worker count."""
+    rows = []
+    base = None
+    for w in worker_counts:
+        best = min(_timed(panel, w) for _ in range(repeat))
+        base = base or best
+        rows.append((w, best, base / best))
+        print(f"workers={w:>3}  {best:.3f}s  speedup {base / best:.2f}x")
+    return pd.DataFrame(rows, columns=["workers", "seconds", "speedup"])
+
+
+def _timed(panel, workers):
+    started = time.perf_counter()
+    screen_panel(panel, workers=workers)
+    return time.perf_counter() - started
+
+
+def main():
+    from webapp.db.stock_db import StockDatabase
+    from webapp.db.connection import get_db_path, set_db_path
+
+    parser = argparse.ArgumentParser(description="Parallel KDJ/double_line/volume screen over a shared-memory panel")
+    parser.add_argument("--db", default=None, help="SQLite DB path (default: $STOCK_DB_PATH or stock_data.db)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes")
+    parser.add_argument("--days", type=int, default=60, help="Bars per stock")
+    parser.add_argument("--bench", default=None, help="Comma-separated worker counts to benchmark, e.g. 1,2,4,8")
+    args = parser.parse_args()
+    if args.db:
+        set_db_path(args.db)
+
+    db = StockDatabase(get_db_path(), columnar=True)
+    names = db.get_a_share_list_local().sort_values("code")["name"].astype(str).str.strip().tolist()
+    started = time.perf_counter()
+    panel = load_panel(db, names, day_count=args.days)
+    print(f"loaded {len(panel)} stocks x {args.days} bars in {time.perf_counter() - started:.2f}s")
+
+    if args.bench:
+        benchmark(panel, [int(w) for w in args.bench.split(",")])
+    else:
+        print(screen_panel(panel, workers=args.workers))
+
+
+if __name__ == "__main__":
+    main()
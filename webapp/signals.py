@@ -0,0 +1,206 @@
+"""Bar signals: vectorized detectors registered by name.
+
+A signal is a function over a frame of daily bars: one stock's bars, or
+many stocks in one long frame with a `stock` column (sorted by stock and
+日期, as `query_daily_panel` returns them). It returns
+`[(kind, mask, value), ...]`, one boolean mask over the rows per kind of
+event, and never loops over rows, so the same code runs on a 60-bar chart
+and on the whole market.
+
+`run_signals` runs every registered signal whose columns are present in
+one pass and returns the events as a frame:
+
+    stock, 日期, signal, kind, value
+
+`events` turns that frame into `Event` tuples. New signals register with
+the `signal` decorator and show up in the analyze panel and in
+`StockPicker.scan_signals` without further changes.
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from webapp.panel import double_line_panel, kdj_panel
+
+Signal = namedtuple("Signal", ["name", "label", "columns", "kinds", "fn"])
+Event = namedtuple("Event", ["stock", "date", "signal", "kind", "value"])
+EVENT_COLS = ["stock", "日期", "signal", "kind", "value"]
+
+HIGH_J = 80
+LOW_J = 12
+
+_registry = {}
+
+
+def signal(name, label, columns, kinds):
+    """Register `fn(df) -> [(kind, mask, value), ...]`; `kinds` maps kind to its 中文 label."""
+    def register(fn):
+        _registry[name] = Signal(name, label, tuple(columns), dict(kinds), fn)
+        return fn
+    return register
+
+
+def registered():
+    return list(_registry.values())
+
+
+def get(name):
+    return _registry[name]
+
+
+def _keys(df):
+    if "stock" in df.columns:
+        return df["stock"].to_numpy()
+    return np.zeros(len(df), dtype=int)
+
+
+def _prev(df, col):
+    """Previous bar's `col` within each stock; NaN on every stock's first row."""
+    values = df[col].to_numpy(dtype=float)
+    prev = np.empty_like(values)
+    if len(values):
+        prev[0] = np.nan
+        prev[1:] = values[:-1]
+        keys = _keys(df)
+        prev[1:][keys[1:] != keys[:-1]] = np.nan
+    return prev
+
+
+def j_zone(j):
+    """'high' / 'low' / 'mid' for each J value (NaN -> '')."""
+    j = np.asarray(j, dtype=float)
+    with np.errstate(invalid="ignore"):
+        return np.select([j > HIGH_J, j < LOW_J, ~np.isnan(j)], ["high", "low", "mid"], "")
+
+
+def limit_pct(codes=None, names=None, size=0):
+    """Daily price limit in % per row: 主板 10, 创业板/科创板 20, 北交所 30, 主板 ST 5."""
+    if codes is None:
+        codes = pd.Series([""] * size)
+    codes = pd.Series(codes).astype(str).str.strip()
+    pct = np.full(len(codes), 10.0)
+    pct[codes.str.startswith(("300", "301", "688", "689")).to_numpy()] = 20.0
+    pct[codes.str.startswith(("8", "4", "92")).to_numpy()] = 30.0
+    if names is not None:
+        st = pd.Series(names).astype(str).str.contains("ST").to_numpy()
+        pct[st & (pct == 10.0)] = 5.0
+    return pct
+
+
+@signal("double_volume", "倍量柱", ["成交量"], {"double_volume": "倍量柱"})
+def double_volume(df):
+    volume = df["成交量"].to_numpy(dtype=float)
+    prev = _prev(df, "成交量")
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return [("double_volume", volume > 2 * prev, volume / prev)]
+
+
+@signal("j_zone", "J值区间", ["J"], {"high": "相对高位", "low": "相对低位", "mid": "相对中部位置"})
+def j_zone_entries(df):
+    # 每次进入新的区间记一个事件，最后一个事件就是当前所处区间
+    j = df["J"].to_numpy(dtype=float)
+    zone = j_zone(j)
+    prev = np.empty_like(zone)
+    if len(zone):
+        prev[0] = ""
+        prev[1:] = zone[:-1]
+        keys = _keys(df)
+        prev[1:][keys[1:] != keys[:-1]] = ""
+    changed = zone != prev
+    return [(kind, changed & (zone == kind), j) for kind in ("high", "low", "mid")]
+
+
+@signal("ma_cross", "均线交叉", ["short", "long"], {"golden": "短线上穿长线", "dead": "短线下穿长线"})
+def ma_cross(df):
+    diff = df["short"].to_numpy(dtype=float) - df["long"].to_numpy(dtype=float)
+    prev = _prev(df.assign(_diff=diff), "_diff")
+    with np.errstate(invalid="ignore"):
+        return [("golden", (prev <= 0) & (diff > 0), df["short"].to_numpy(dtype=float)),
+                ("dead", (prev >= 0) & (diff < 0), df["short"].to_numpy(dtype=float))]
+
+
+@signal("gap", "跳空缺口", ["最高", "最低"], {"up": "向上跳空", "down": "向下跳空"})
+def gap(df):
+    high = df["最高"].to_numpy(dtype=float)
+    low = df["最低"].to_numpy(dtype=float)
+    prev_high = _prev(df, "最高")
+    prev_low = _prev(df, "最低")
+    # value: 缺口大小，占前一日价格的百分比
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return [("up", low > prev_high, (low / prev_high - 1) * 100),
+                ("down", high < prev_low, (high / prev_low - 1) * 100)]
+
+
+@signal("limit", "涨跌停", ["收盘"], {"up": "涨停", "down": "跌停"})
+def limit(df):
+    close = df["收盘"].to_numpy(dtype=float)
+    prev = _prev(df, "收盘")
+    with np.errstate(invalid="ignore", divide="ignore"):
+        pct = (close / prev - 1) * 100
+        if "涨跌幅" in df.columns:
+            reported = df["涨跌幅"].to_numpy(dtype=float)
+            pct = np.where(np.isnan(reported), pct, reported)
+        # 价格按分取整，低价股的涨跌幅离限幅最多差半分钱
+        tol = np.maximum(0.05, 0.5 / prev)
+    cap = limit_pct(df["code"] if "code" in df.columns else None,
+                    df["stock"] if "stock" in df.columns else None, size=len(df))
+    with np.errstate(invalid="ignore"):
+        return [("up", pct >= cap - tol, pct), ("down", pct <= -(cap - tol), pct)]
+
+
+def run_signals(df, names=None):
+    """All registered signals (or just `names`) over `df`, as one event frame in row order."""
+    if df.empty:
+        return pd.DataFrame(columns=EVENT_COLS)
+    df = df.reset_index(drop=True)
+    stock = df["stock"].to_numpy() if "stock" in df.columns else np.full(len(df), None)
+    dates = df["日期"].to_numpy()
+    parts = []
+    for sig in registered():
+        if names is not None and sig.name not in names:
+            continue
+        if not set(sig.columns) <= set(df.columns):
+            continue
+        for kind, mask, value in sig.fn(df):
+            rows = np.flatnonzero(mask)
+            if len(rows):
+                parts.append(pd.DataFrame({
+                    "row": rows, "stock": stock[rows], "日期": dates[rows],
+                    "signal": sig.name, "kind": kind, "value": np.asarray(value, dtype=float)[rows],
+                }))
+    if not parts:
+        return pd.DataFrame(columns=EVENT_COLS)
+    out = pd.concat(parts, ignore_index=True).sort_values("row", kind="stable")
+    return out[EVENT_COLS].reset_index(drop=True)
+
+
+def events(frame):
+    """`Event` tuples for the rows of a `run_signals` frame."""
+    for row in frame.itertuples(index=False, name=None):
+        yield Event(*row)
+
+
+def add_indicators(df):
+    """
+    K/D/J and short/long for a long multi-stock frame, computed over the
+    bars in the frame (like `webapp.screen_pool`); rows are returned sorted
+    by stock and 日期.
+    """
+    df = df.sort_values(["stock", "日期"], kind="stable").reset_index(drop=True)
+    if df.empty:
+        return df.assign(K=[], D=[], J=[], short=[], long=[])
+    _, idx = np.unique(df["stock"].to_numpy(), return_inverse=True)
+    counts = np.bincount(idx)
+    length = int(counts.max())
+    col = length - counts[idx] + df.groupby("stock", sort=False).cumcount().to_numpy()
+    fields = {}
+    for f in ("最高", "最低", "收盘"):
+        arr = np.full((len(counts), length), np.nan)
+        arr[idx, col] = df[f].to_numpy(dtype=float)
+        fields[f] = arr
+    k, d, j = kdj_panel(fields["最高"], fields["最低"], fields["收盘"])
+    short, long = double_line_panel(fields["收盘"])
+    for name, arr in (("K", k), ("D", d), ("J", j), ("short", short), ("long", long)):
+        df[name] = arr[idx, col]
+    return df
@@ -2,11 +2,14 @@ import dash
 from dash import html, dcc, callback, Output, Input, State
 from dash.dependencies import ALL
 import ast
-import sqlite3
 import pandas as pd
 from datetime import datetime
 from webapp.db.stock_db import StockDatabase
+from webapp.db.symbols import get_symbol_index
 from webapp.ui.plot import calculate_kdj, double_line
+from webapp import metrics, signals
+
+ANALYZE_DAYS = 60
 
 def draw_analyze_panel():
     return html.Div([
@@ -20,46 +23,87 @@ def draw_analyze_panel():
     ], style={'background': '#181818', 'color': '#f5f5f5', 'padding': '10px', 'borderRadius': '8px'})
 
 
+def _date(value):
+    return pd.Timestamp(value).strftime('%Y年%m月%d日')
+
+
 def analyze_df(df):
-    df = calculate_kdj(df)
-    df = double_line(df)
-    df = df.tail(60)
-
-    result = []
-    for i in range(1, len(df)):
-        if df.iloc[i]['成交量'] >= 2 * df.iloc[i - 1]['成交量']:
-            date = df.iloc[i]['日期'].strftime('%Y年%m月%d日')
-            result.append(f"{date}")
+    # 指标已由 indicators 表提供时不再重算
+    stored = [c for c in ('K', 'D', 'J', 'short', 'long') if c in df.columns]
+    if len(stored) < 5 or df[stored].iloc[-1].isna().any():
+        with metrics.stage("indicators"):
+            df = calculate_kdj(df)
+            df = double_line(df)
+
+    # 所有注册的信号一次跑完，只报告最近 ANALYZE_DAYS 根K线内的事件
+    with metrics.stage("signals"):
+        events = signals.run_signals(df)
+    start = df['日期'].iloc[-ANALYZE_DAYS:].iloc[0]
+    events = events[events['日期'] >= start]
+
+    result = events.loc[events['signal'] == 'double_volume', '日期'].map(_date).tolist()
     if result:
-        result_str = "倍量柱:\n" + "\n".join(result) + "\n存在倍量柱，值得关注\n" 
+        result_str = "倍量柱:\n" + "\n".join(result) + "\n存在倍量柱，值得关注\n"
     else:
         result_str = "没有倍量柱\n"
 
     j = df.iloc[-1]['J']
-    result_str += "当前的J值:\n" + f"{j:.2f}" +'\n'
-    if j > 80:
-        result_str += '属于相对高位\n'
-    elif j < 12:
-        result_str += '属于相对低位\n'
-    else:
-        result_str += '属于相对中部位置\m'
+    zone = signals.get('j_zone').kinds.get(str(signals.j_zone([j])[0]), '')
+    result_str += "当前的J值:\n" + f"{j:.2f}" + '\n'
+    if zone:
+        result_str += '属于' + zone + '\n'
+
+    for sig in signals.registered():
+        if sig.name in ('double_volume', 'j_zone'):
+            continue
+        hits = events[events['signal'] == sig.name]
+        if hits.empty:
+            continue
+        result_str += f"{sig.label}:\n"
+        result_str += "".join(f"{_date(e.date)} {sig.kinds[e.kind]}\n" for e in signals.events(hits))
     return result_str
 
+
+def _stock_code(db, stock_name):
+    # 涨跌停幅度按板块区分，需要代码
+    try:
+        row = db.conn.execute("SELECT code FROM stocks WHERE name = ?", (stock_name,)).fetchone()
+    except Exception:
+        return None
+    return str(row[0]).strip() if row else None
+
+
 @callback(
     Output('analyze-result', 'value'),
     Input('analyze-btn', 'n_clicks'),
     State('dropdown-selection', 'value'),
     prevent_initial_call=True,
 )
+@metrics.instrument
 def analyze_main_chart(n_clicks, stock_name):
     if not stock_name:
         return '未选择股票'
+    # 输入框里可以是代码、名称或拼音首字母，和主图一样先解析成股票名称
+    index = get_symbol_index()
+    stock = index.resolve(stock_name)
+    if stock is None:
+        if len(index):
+            return f"未找到 {stock_name}"
+        stock = stock_name
+    stock_name = stock
     try:
+        # 连接来自连接池，akshare 缓存也到第一次抓取时才打开：构造 StockDatabase 不再打开新连接
         db = StockDatabase()
-        df = db.query_daily_data(stock_name, day_count=180)
+        with metrics.stage("analyze_load"):
+            # 多读一根，窗口第一天也能和前一天比较；没有存好的指标时读180根重算
+            df = db.query_daily_data(stock_name, day_count=ANALYZE_DAYS + 1, with_indicators=True)
+            stored = not df.empty and 'J' in df and not df[['J', 'short', 'long']].iloc[-1].isna().any()
+            if not stored:
+                df = db.query_daily_data(stock_name, day_count=180, with_indicators=True)
         if df.empty:
             return f"未找到 {stock_name} 的数据"
-        # 这里只显示前5行和列名作为占位符
+        df['stock'] = stock_name
+        df['code'] = _stock_code(db, stock_name)
         return analyze_df(df)
     
 
@@ -0,0 +1,48 @@
+"""Bounded LRU + TTL cache for built Plotly figures."""
+import threading
+import time
+from collections import OrderedDict
+
+
+class FigureCache:
+    def __init__(self, maxsize=64, ttl=600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and time.monotonic() - item[0] > self.ttl:
+                del self._data[key]
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, stocks=None):
+        """Drop every entry, or only those whose key starts with one of `stocks`."""
+        with self._lock:
+            if stocks is None:
+                self._data.clear()
+                return
+            stocks = set(stocks)
+            for key in [k for k in self._data if k[0] in stocks]:
+                del self._data[key]
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
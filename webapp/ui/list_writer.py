@@ -0,0 +1,118 @@
+"""Background persistence for the recent / favorite sidebar lists.
+
+The lists live in the browser (dcc.Store) and are edited by clientside
+callbacks. Each edit is sent as a small op
+
+    {"list": "recent" | "favorite", "op": "touch" | "add" | "remove", "query": ..., "ts": ...}
+
+and queued here. A daemon thread applies whatever has queued up in one
+transaction on the shared writer connection, keeping only the last op
+per (list, query). Callbacks therefore never wait on SQLite. A batch that
+fails to commit is kept and retried with backoff, merged with whatever
+arrives meanwhile.
+"""
+import queue
+import threading
+import time
+from datetime import datetime
+
+from webapp.db.connection import reader, writer
+
+TABLES = {"recent": "recent_queries", "favorite": "favorite_collection"}
+LIMITS = {"recent": 10, "favorite": 20}
+# 攒一小段时间再写，连续点击合并成一次提交
+FLUSH_DELAY = 0.5
+# 写失败后的重试间隔，每次翻倍直到上限
+RETRY_DELAY = 1.0
+MAX_RETRY_DELAY = 30.0
+
+
+def ensure_tables(conn):
+    for table in TABLES.values():
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                query TEXT,
+                ts TEXT
+            )
+        """)
+
+
+def load_list(name, limit=None):
+    """[{'query', 'ts'}] newest first; the store's initial data."""
+    limit = limit or LIMITS[name]
+    try:
+        rows = reader().execute(
+            f"SELECT query, ts FROM {TABLES[name]} ORDER BY id DESC LIMIT ?", (limit,)
+        ).fetchall()
+    except Exception:
+        rows = []
+    return [{"query": str(q), "ts": ts or ""} for q, ts in rows]
+
+
+def apply_ops(conn, ops):
+    """Apply a batch of ops in order, collapsed to the last op per (list, query)."""
+    last = {}
+    for op in ops:
+        if op.get("list") not in TABLES or not op.get("query"):
+            continue
+        key = (op["list"], op["query"])
+        last.pop(key, None)
+        last[key] = op
+    ensure_tables(conn)
+    for (name, query), op in last.items():
+        table = TABLES[name]
+        # 删除后重新插入，自增 id 决定列表顺序
+        conn.execute(f"DELETE FROM {table} WHERE query = ?", (query,))
+        if op["op"] in ("add", "touch"):
+            conn.execute(f"INSERT INTO {table} (query, ts) VALUES (?, ?)",
+                         (query, op.get("ts") or datetime.utcnow().isoformat()))
+    return len(last)
+
+
+class ListWriter:
+    def __init__(self, flush_delay=FLUSH_DELAY):
+        self.flush_delay = flush_delay
+        self.queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, op):
+        self._start()
+        self.queue.put(op)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="sidebar-list-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        batch, delay = [], self.flush_delay
+        while True:
+            if not batch:
+                batch.append(self.queue.get())
+            time.sleep(delay)
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with writer() as conn:
+                    apply_ops(conn, batch)
+            except Exception as e:
+                # 不丢这批：保留下来，退避后连同新到的 op 一起重试
+                delay = min(max(delay * 2, RETRY_DELAY), MAX_RETRY_DELAY)
+                print(f"sidebar list write of {len(batch)} ops failed, retrying in {delay:.0f}s: {e}")
+                continue
+            for _ in batch:
+                self.queue.task_done()
+            batch, delay = [], self.flush_delay
+
+    def flush(self):
+        """Block until every submitted op is written."""
+        self.queue.join()
+
+
+list_writer = ListWriter()
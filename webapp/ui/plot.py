@@ -1,7 +1,33 @@
-import sqlite3
+import re
+
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
+from dash import Patch
 from plotly.subplots import make_subplots
+from webapp.db.connection import reader
+from webapp.db.events import bars_version, on_bars_written
+from webapp.db.adjust import load_factors, price_mode, to_qfq
+from webapp.ui.figure_cache import FigureCache
+from webapp import metrics
+
+# (stock, day_count, period, 最新K线日期, bars_version) -> figure
+# 抓取通常在另一个进程里跑，新鲜度靠 key 里的 meta.bars_version；
+# 同进程写入时监听器再顺手清掉旧条目
+figure_cache = FigureCache(maxsize=64, ttl=600)
+
+# 每条曲线最多这么多个点，区间再长就换成周线/月线
+POINT_BUDGET = 500
+# K线数超过这个值时线条和成交量改用 WebGL，x 轴改为日期轴
+WEBGL_MIN_BARS = 200
+PERIOD_DAYS = {"D": 1, "W": 5, "M": 21}
+# 周线/月线的指标在这么多根额外K线上预热
+RESAMPLE_WARMUP = 120
+
+
+@on_bars_written
+def _invalidate_figures(stocks):
+    figure_cache.invalidate(stocks)
 
 def calculate_kdj(df:pd.DataFrame, n=9, m1=3, m2=3):
     low_list = df['最低'].rolling(window=n).min()
@@ -23,27 +49,153 @@ def double_line(df:pd.DataFrame):
     return df
 
 
-def make_stock_figure(stock, day_count=60):
-    conn = sqlite3.connect("stock_data.db")
+def load_chart_frame(conn, stock, day_count, until=None):
+    """
+    Last `day_count` bars (up to and including `until`, 'YYYY-MM-DD', when
+    given) with K/D/J/short/long read from the indicators store;
+    recomputes from raw bars if the store is missing or behind.
+    """
+    until = until or "9999-12-31"
+    query = f"""
+        SELECT d.日期, d.开盘, d.最高, d.最低, d.收盘, d.成交量, d.涨跌幅, d.振幅,
+               i.K, i.D, i.J, i.short, i.long
+        FROM daily_data d
+        LEFT JOIN indicators i ON i.stock = d.stock AND i.日期 = d.日期
+        WHERE d.stock = ? AND d.日期 <= ?
+        ORDER BY d.日期 DESC
+        LIMIT ?
+    """
+    # 不复权库读出后按因子换成前复权价
+    factors = load_factors(conn, [stock]) if price_mode(conn) == "raw" else None
+    try:
+        df = pd.read_sql(query, conn, params=(stock, until, day_count))
+        if not df.empty and df[['K', 'short']].iloc[0].notna().all():
+            df["日期"] = pd.to_datetime(df["日期"])
+            if factors is not None:
+                df = to_qfq(df, factors, stock)
+            return df.sort_values("日期")
+    except Exception:
+        pass
+
+    df = load_bars(conn, stock, day_count + 120, factors, until)
+
+    # df['MA10'] = df['收盘'].rolling(window=10).mean()
+    with metrics.stage("indicators"):
+        df = calculate_kdj(df)
+        df = double_line(df)
+
+    return df.tail(day_count)
+
+
+def load_bars(conn, stock, count, factors=None, until=None):
+    """Last `count` daily bars up to `until` (qfq when `factors` is given), oldest first."""
     query = f"""
         SELECT 日期, 开盘, 最高, 最低, 收盘, 成交量, 涨跌幅, 振幅 FROM daily_data
-        WHERE stock = ?
+        WHERE stock = ? AND 日期 <= ?
         ORDER BY 日期 DESC
         LIMIT ?
     """
-    df = pd.read_sql(query, conn, params=(stock, day_count+120))
-    conn.close()
+    df = pd.read_sql(query, conn, params=(stock, until or "9999-12-31", count))
 
     df["日期"] = pd.to_datetime(df["日期"])
     df = df.sort_values("日期")
+    if factors is not None:
+        df = to_qfq(df, factors, stock)
+    return df
 
-    # df['MA10'] = df['收盘'].rolling(window=10).mean()
-    df = calculate_kdj(df)
-    df = double_line(df)
 
-    df = df.tail(day_count)
+def choose_period(day_count, budget=POINT_BUDGET):
+    """Finest bar period ('D', 'W' or 'M') that fits `day_count` trading days into `budget` bars."""
+    for period in ("D", "W"):
+        if day_count <= budget * PERIOD_DAYS[period]:
+            return period
+    return "M"
+
+
+def resample_ohlcv(df, period):
+    """
+    Daily bars to weekly ('W') or monthly ('M') bars. Each bar is dated by
+    its last trading day; 涨跌幅/振幅 are against the previous bar's close.
+    """
+    if period == "D" or df.empty:
+        return df
+    days = df["日期"].to_numpy().astype("datetime64[D]")
+    if period == "W":
+        # 1970-01-01 是周四，+3 后按周一分周
+        key = (days.astype(np.int64) + 3) // 7
+    else:
+        key = days.astype("datetime64[M]").astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+    ends = np.r_[starts[1:], len(df)] - 1
+
+    high = np.maximum.reduceat(df["最高"].to_numpy(dtype=float), starts)
+    low = np.minimum.reduceat(df["最低"].to_numpy(dtype=float), starts)
+    close = df["收盘"].to_numpy(dtype=float)[ends]
+    prev = np.r_[np.nan, close[:-1]]
+    return pd.DataFrame({
+        "日期": df["日期"].to_numpy()[ends],
+        "开盘": df["开盘"].to_numpy(dtype=float)[starts],
+        "最高": high,
+        "最低": low,
+        "收盘": close,
+        "成交量": np.add.reduceat(df["成交量"].to_numpy(dtype=float), starts),
+        "涨跌幅": (close - prev) / prev * 100,
+        "振幅": (high - low) / prev * 100,
+    })
+
+
+def load_long_frame(conn, stock, day_count, period, budget=POINT_BUDGET):
+    """
+    Bars covering the last `day_count` trading days at `period`, with
+    indicators computed on the resampled bars, at most `budget` rows.
+    """
+    if period == "D":
+        return load_chart_frame(conn, stock, min(day_count, budget))
+    size = PERIOD_DAYS[period]
+    factors = load_factors(conn, [stock]) if price_mode(conn) == "raw" else None
+    df = load_bars(conn, stock, day_count + RESAMPLE_WARMUP * size, factors)
+    df = resample_ohlcv(df, period)
+    with metrics.stage("indicators"):
+        df = calculate_kdj(df)
+        df = double_line(df)
+    return df.tail(min(-(-day_count // size), budget)).reset_index(drop=True)
+
 
+def make_stock_figure(stock, day_count=60, period=None):
+    """
+    Chart of the last `day_count` trading days (None: the whole history).
+    `period` defaults to the finest of daily/weekly/monthly that stays
+    within POINT_BUDGET points per trace.
+    """
+    conn = reader()
+    cur = conn.execute("SELECT MAX(日期), COUNT(*) FROM daily_data WHERE stock = ?", (stock,))
+    newest, total = cur.fetchone()
+    if day_count is None:
+        day_count = total or 1
+    period = period or choose_period(day_count)
+    key = (stock, day_count, period, newest, bars_version(conn))
+    fig = figure_cache.get(key)
+    if fig is None:
+        with metrics.stage("figure_load"):
+            if period == "D" and day_count <= POINT_BUDGET:
+                df = load_chart_frame(conn, stock, day_count)
+            else:
+                df = load_long_frame(conn, stock, day_count, period)
+        with metrics.stage("figure_build"):
+            fig = build_stock_figure(df, webgl=len(df) > WEBGL_MIN_BARS or period != "D", period=period)
+        figure_cache.put(key, fig)
+    return fig
+
+
+def build_stock_figure(df, webgl=False, period="D"):
+    """
+    webgl=True draws the lines and volume with Scattergl on a date axis
+    for long ranges; the default keeps the SVG category-axis chart.
+    """
+    df = df.reset_index(drop=True)
     df['Date_Str'] = df['日期'].dt.strftime('%Y-%m-%d')
+    Line = go.Scattergl if webgl else go.Scatter
+    x = df['日期'] if webgl else df['Date_Str']
 
     fig = make_subplots(rows=3, cols=1,
                         shared_xaxes=True,
@@ -62,42 +214,52 @@ def make_stock_figure(stock, day_count=60):
         '振幅: %{customdata[1]:.2f}%'
     )
     fig.add_trace(go.Candlestick(
-        x=df['Date_Str'],
+        x=x,
         open=df['开盘'], high=df['最高'],
         low=df['最低'], close=df['收盘'],
         name='K-Line',
         increasing_line_color='red', increasing_fillcolor='red',
         decreasing_line_color='green', decreasing_fillcolor='green',
-        customdata=list(zip(df['涨跌幅'], df['振幅'])),
+        customdata=np.column_stack([df['涨跌幅'], df['振幅']]),
         hovertemplate=hovertemplate
     ), row=1, col=1)
 
-    fig.add_trace(go.Scatter(
-        x=df['Date_Str'], y=df['short'],
+    fig.add_trace(Line(
+        x=x, y=df['short'],
         line=dict(color='white', width=1),
         name='短线'
     ), row=1, col=1)
-    fig.add_trace(go.Scatter(
-        x=df['Date_Str'], y=df['long'],
+    fig.add_trace(Line(
+        x=x, y=df['long'],
         line=dict(color='#D4A135', width=1),
         name='主力'
     ), row=1, col=1)
 
     # Row 2 Volume
-    vol_colors = ['red' if c >= o else 'green' for c, o in zip(df['收盘'], df['开盘'])]
-    fig.add_trace(go.Bar(
-        x=df['Date_Str'], y=df['成交量'],
-        marker_color=vol_colors,
-        name='Volume',
-        showlegend=False,
-    ), row=2, col=1)
+    if webgl:
+        # WebGL 没有柱状图，长区间用阶梯面积图代替
+        fig.add_trace(go.Scattergl(
+            x=x, y=df['成交量'],
+            mode='lines', line=dict(color='#888888', width=1, shape='hvh'),
+            fill='tozeroy',
+            name='Volume',
+            showlegend=False,
+        ), row=2, col=1)
+    else:
+        vol_colors = np.where(df['收盘'] >= df['开盘'], 'red', 'green')
+        fig.add_trace(go.Bar(
+            x=x, y=df['成交量'],
+            marker_color=vol_colors,
+            name='Volume',
+            showlegend=False,
+        ), row=2, col=1)
 
     # Mark high volume days (volume > 2x previous day)
     df['prev_volume'] = df['成交量'].shift(1)
     high_vol_mask = df['成交量'] > 2 * df['prev_volume']
-    high_vol_dates = df.loc[high_vol_mask, 'Date_Str']
+    high_vol_dates = x[high_vol_mask]
     high_vol_values = df.loc[high_vol_mask, '成交量']
-    fig.add_trace(go.Scatter(
+    fig.add_trace(Line(
         x=high_vol_dates,
         y=high_vol_values,
         mode='markers',
@@ -107,14 +269,16 @@ def make_stock_figure(stock, day_count=60):
     ), row=2, col=1)
 
     # Row 3 KDJ
-    fig.add_trace(go.Scatter(x=df['Date_Str'], y=df['K'], line=dict(color='black', width=1), name='K'), row=3, col=1)
-    fig.add_trace(go.Scatter(x=df['Date_Str'], y=df['D'], line=dict(color='orange', width=1), name='D'), row=3, col=1)
-    fig.add_trace(go.Scatter(x=df['Date_Str'], y=df['J'], line=dict(color='purple', width=1), name='J'), row=3, col=1)
+    fig.add_trace(Line(x=x, y=df['K'], line=dict(color='black', width=1), name='K'), row=3, col=1)
+    fig.add_trace(Line(x=x, y=df['D'], line=dict(color='orange', width=1), name='D'), row=3, col=1)
+    fig.add_trace(Line(x=x, y=df['J'], line=dict(color='purple', width=1), name='J'), row=3, col=1)
 
     fig.add_hline(y=80, line_dash="dot", line_color="red", row=3, col=1)
     fig.add_hline(y=13, line_dash="dot", line_color="green", row=3, col=1)
 
     fig.update_layout(
+        # 实际使用的K线周期，chart_state 据此决定能否往前补日K线
+        meta={"period": period},
         xaxis_rangeslider_visible=False,
         height=1000,
         width=800,
@@ -171,10 +335,146 @@ def make_stock_figure(stock, day_count=60):
         ),
         hovermode='x',
     )
-    fig.update_xaxes(type='category', showticklabels=False)
+    if webgl:
+        # 日期轴；日线去掉周末空档，宽度随容器
+        breaks = [dict(bounds=["sat", "mon"])] if period == "D" else []
+        fig.update_layout(width=None, autosize=True)
+        fig.update_xaxes(type='date', rangebreaks=breaks)
+        fig.update_xaxes(showticklabels=False, row=1, col=1)
+        fig.update_xaxes(showticklabels=False, row=2, col=1)
+    else:
+        # 分类轴按日期字符串排序，往前补的K线追加在数组末尾也能排到左边
+        fig.update_xaxes(type='category', categoryorder='category ascending', showticklabels=False)
 
     return fig
 
+# ---- 往前拖动时补历史K线 ----
+
+# build_stock_figure 的曲线顺序
+TRACE_CANDLE, TRACE_SHORT, TRACE_LONG, TRACE_VOLUME, TRACE_HIGH_VOL, TRACE_K, TRACE_D, TRACE_J = range(8)
+LINE_TRACES = {TRACE_SHORT: "short", TRACE_LONG: "long", TRACE_K: "K", TRACE_D: "D", TRACE_J: "J"}
+# 每次至少补这么多根；日K线总数超过 POINT_BUDGET 时整张图换成周线/月线
+LAZY_CHUNK = 120
+
+_RANGE_KEY = re.compile(r"xaxis\d*\.range(\[0\])?")
+
+
+def chart_state(stock, fig, period=None):
+    """
+    Loaded-range record kept in the browser (dcc.Store) next to the chart.
+    `period` defaults to the one build_stock_figure tagged the figure with.
+    """
+    period = period or (fig.layout.meta or {}).get("period", "D")
+    x = fig.data[TRACE_CANDLE].x
+    x = [] if x is None else x
+    return {
+        "stock": stock,
+        "webgl": fig.data[TRACE_SHORT].type == "scattergl",
+        "oldest": str(x[0])[:10] if len(x) else None,
+        "bars": len(x),
+        # 周线/月线已按整段区间绘制，不再补
+        "done": period != "D" or not len(x),
+    }
+
+
+def bars_requested(relayout, state):
+    """(older bars the new x range needs, x range) for a relayoutData event; 0 if none."""
+    if not relayout or not state or state.get("done"):
+        return 0, None
+    for key, value in relayout.items():
+        m = _RANGE_KEY.fullmatch(key)
+        if not m:
+            continue
+        if m.group(1):
+            end = relayout.get(key.replace("[0]", "[1]"))
+            x_range = [value, end]
+        else:
+            x_range = list(value)
+        start = x_range[0]
+        if state["webgl"]:
+            start_day = np.datetime64(str(start)[:10])
+            oldest = np.datetime64(state["oldest"])
+            return (int(np.busday_count(start_day, oldest)) if start_day < oldest else 0), x_range
+        # 分类轴的坐标是K线序号，负数表示拖到了第一根左边
+        return (int(np.ceil(-float(start))) if float(start) < 0 else 0), x_range
+    return 0, None
+
+
+def history_patch(conn, state, need, x_range=None):
+    """
+    Patch that adds max(need, LAZY_CHUNK) bars older than state['oldest']
+    to every trace, and the updated state. Returns (None, state) when
+    nothing is left to load. When the daily bars would exceed
+    POINT_BUDGET, returns a whole resampled figure of the wider range
+    instead (see make_stock_figure), which ends lazy loading.
+    """
+    count = max(need, LAZY_CHUNK)
+    if state["bars"] + count > POINT_BUDGET:
+        fig = make_stock_figure(state["stock"], day_count=state["bars"] + count)
+        return fig, chart_state(state["stock"], fig)
+    state = dict(state)
+    # 多取两根：最前一根只作放量判断的前一日，最后一根是图上原来的第一根
+    df = load_chart_frame(conn, state["stock"], count + 2, until=state["oldest"])
+    df = df.reset_index(drop=True)
+    has_prev = len(df) == count + 2
+    new = df.iloc[1 if has_prev else 0:-1]
+    if new.empty:
+        state["done"] = True
+        return None, state
+    first = df.iloc[-1]
+
+    # 增量是普通 JSON 列表，压掉多余小数位
+    new = new.round({c: 3 for c in ("开盘", "最高", "最低", "收盘", "涨跌幅", "振幅")}
+                    | {c: 3 for c in LINE_TRACES.values()})
+    to_x = (lambda d: d.strftime('%Y-%m-%d'))
+    x = [to_x(d) for d in new['日期']]
+    first_x = to_x(first['日期'])
+    patch = Patch()
+    candle = patch["data"][TRACE_CANDLE]
+    candle["x"].extend(x)
+    for attr, col in (("open", "开盘"), ("high", "最高"), ("low", "最低"), ("close", "收盘")):
+        candle[attr].extend(new[col].tolist())
+    candle["customdata"].extend(np.column_stack([new['涨跌幅'], new['振幅']]).tolist())
+
+    # 曲线按数组顺序连线：先用 None 断开，再接回原来的第一根
+    def extend_line(trace, values, first_value):
+        patch["data"][trace]["x"].extend([x[0]] + x + [first_x])
+        patch["data"][trace]["y"].extend([None] + values + [first_value])
+
+    for trace, col in LINE_TRACES.items():
+        extend_line(trace, new[col].tolist(), float(first[col]))
+    if state["webgl"]:
+        extend_line(TRACE_VOLUME, new['成交量'].tolist(), float(first['成交量']))
+    else:
+        patch["data"][TRACE_VOLUME]["x"].extend(x)
+        patch["data"][TRACE_VOLUME]["y"].extend(new['成交量'].tolist())
+        patch["data"][TRACE_VOLUME]["marker"]["color"].extend(
+            np.where(new['收盘'] >= new['开盘'], 'red', 'green').tolist())
+
+    # 新K线的放量标记；原第一根建图时缺前一日成交量，这里补判一次
+    volume = df['成交量'].to_numpy(dtype=float)
+    high_vol = np.r_[False, volume[1:] > 2 * volume[:-1]]
+    if state.get("first_checked"):
+        high_vol[-1] = False
+    rows = np.flatnonzero(high_vol[1 if has_prev else 0:]) + (1 if has_prev else 0)
+    if len(rows):
+        patch["data"][TRACE_HIGH_VOL]["x"].extend([to_x(df['日期'][i]) for i in rows])
+        patch["data"][TRACE_HIGH_VOL]["y"].extend(volume[rows].tolist())
+
+    if not state["webgl"] and x_range is not None:
+        # 分类序号整体右移，视野保持在刚才拖到的位置
+        shifted = [float(x_range[0]) + len(new), float(x_range[1]) + len(new)]
+        for axis in ("xaxis", "xaxis2", "xaxis3"):
+            patch["layout"][axis]["range"] = shifted
+            patch["layout"][axis]["autorange"] = False
+
+    state["oldest"] = x[0]
+    state["first_checked"] = has_prev
+    state["bars"] += len(new)
+    state["done"] = not has_prev
+    return patch, state
+
+
 def plot_interactive_stock():
     fg = make_stock_figure("江西铜业")
     fg.show()
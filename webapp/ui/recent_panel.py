@@ -1,80 +1,43 @@
-import dash
-from dash import html, dcc, callback, Output, Input, State, callback_context
+from dash import html, dcc, callback, clientside_callback, ClientsideFunction, Output, Input, State
 from dash.dependencies import ALL
-import ast
-import sqlite3
-import pandas as pd
-from datetime import datetime
+from webapp.ui.list_writer import list_writer, load_list
+from webapp import metrics
 
-def add_recent_query(query: str):
-    conn = sqlite3.connect('stock_data.db')
-    cur = conn.cursor()
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS recent_queries (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            query TEXT,
-            ts TEXT
-        )
-    ''')
-    # remove any existing entries with the same query so list stays deduplicated
-    try:
-        cur.execute('DELETE FROM recent_queries WHERE query = ?', (query,))
-    except Exception:
-        pass
-    cur.execute('INSERT INTO recent_queries (query, ts) VALUES (?, ?)', (query, datetime.utcnow().isoformat()))
-    conn.commit()
-    conn.close()
+# 最近查询保存在浏览器端的 recent-store 里，由 assets/sidebar.js 渲染和修改；
+# 每次修改发一个 op 到 recent-op，服务端只负责后台落库
 
 
-def get_recent_queries_data(limit=10):
-    conn = sqlite3.connect('stock_data.db')
-    try:
-        df = pd.read_sql_query(f"SELECT query FROM recent_queries ORDER BY id DESC LIMIT {limit}", conn)
-        return [str(x) for x in df['query'].tolist()]
-    except Exception:
-        return []
-    finally:
-        conn.close()
+def recent_panel_layout():
+    return html.Div([
+        dcc.Store(id='recent-store', data=load_list("recent")),
+        dcc.Store(id='recent-op'),
+        html.Div(id='recent-list'),
+    ], id='recent-panel')
 
-def draw_recent_panel(limit=10):
-    conn = sqlite3.connect('stock_data.db')
-    try:
-        df = pd.read_sql_query(f"SELECT query, ts FROM recent_queries ORDER BY id DESC LIMIT {limit}", conn)
-    except Exception:
-        df = pd.DataFrame(columns=['query', 'ts'])
-    conn.close()
-    items = []
-    # build clickable buttons with pattern-matching ids; enumerate to keep indexes stable
-    for i, (_, row) in enumerate(df.iterrows()):
-        q = f"{row['query']}"
-        label = f"{row['query']}  ({row['ts']})"
-        btn = html.Button(label, id={'type': 'recent-query', 'index': i}, n_clicks=0, style={'width': '100%', 'textAlign': 'left', 'border': 'none', 'background': '#222', 'color': '#f5f5f5', 'padding': '6px 0'})
-        items.append(html.Li(btn, style={'background': '#181818', 'color': '#f5f5f5', 'marginBottom': '2px'}))
-    if not items:
-        return html.Div("No recent queries yet.", style={'color': '#888'})
-    return html.Ul(items, style={'background': '#181818', 'color': '#f5f5f5', 'padding': '0', 'listStyle': 'none'})
 
-@callback(
+clientside_callback(
+    ClientsideFunction(namespace='sidebar', function_name='renderRecent'),
+    Output('recent-list', 'children'),
+    Input('recent-store', 'data'),
+)
+
+# 按钮 id 用查询文本作 key，列表变化时不会点错行
+clientside_callback(
+    ClientsideFunction(namespace='sidebar', function_name='onRecentClick'),
     Output('dropdown-selection', 'value', allow_duplicate=True),
-    Output('sidebar-content', 'children', allow_duplicate=True),
-    Input({'type': 'recent-query', 'index': ALL}, 'n_clicks'),
-    State('sidebar-tabs', 'value'),
+    Output('recent-store', 'data'),
+    Output('recent-op', 'data'),
+    Input({'type': 'recent-query', 'key': ALL}, 'n_clicks'),
+    State('recent-store', 'data'),
+    prevent_initial_call=True,
+)
+
+
+@callback(
+    Input('recent-op', 'data'),
     prevent_initial_call=True,
 )
-def on_recent_click(n_clicks_list, tab):
-    ctx = callback_context
-    if not ctx.triggered:
-        raise dash.exceptions.PreventUpdate
-    prop_id = ctx.triggered[0]['prop_id'].split('.')[0]
-    try:
-        triggered_obj = ast.literal_eval(prop_id)
-        idx = int(triggered_obj.get('index', 0))
-    except Exception:
-        raise dash.exceptions.PreventUpdate
-    
-    queries = get_recent_queries_data()
-    if idx < 0 or idx >= len(queries):
-        raise dash.exceptions.PreventUpdate
-    selected = queries[idx]
-    add_recent_query(selected)
-    return selected, draw_recent_panel()
\ No newline at end of file
+@metrics.instrument
+def persist_recent(op):
+    if op:
+        list_writer.submit(op)
@@ -1,27 +1,29 @@
-import dash
-from dash import html, dcc, callback, Output, Input, State, callback_context
-from dash.dependencies import ALL
-import ast
-import sqlite3
-import pandas as pd
-from datetime import datetime
-from webapp.ui.favorite_panel import draw_favorite_panel
-from webapp.ui.recent_panel import draw_recent_panel
+from dash import html, dcc, callback, clientside_callback, ClientsideFunction, Output, Input
+from webapp.ui.favorite_panel import favorite_panel_layout
+from webapp.ui.recent_panel import recent_panel_layout
 from webapp.ui.analyze_panel import draw_analyze_panel
+from webapp import metrics
+
+
+# 切换标签只在浏览器里显示/隐藏列表；切到分析页时才通知服务端
+clientside_callback(
+    ClientsideFunction(namespace='sidebar', function_name='showTab'),
+    Output('recent-panel', 'style'),
+    Output('favorite-panel', 'style'),
+    Output('sidebar-content', 'style'),
+    Output('analyze-open', 'data'),
+    Input('sidebar-tabs', 'value'),
+)
 
 
 @callback(
     Output('sidebar-content', 'children'),
-    Input('sidebar-tabs', 'value')
+    Input('analyze-open', 'data'),
+    prevent_initial_call=True,
 )
-def on_tab_clicked(tab):
-    if tab == 'recent':
-        return draw_recent_panel()
-    elif tab == 'favorite':
-        return draw_favorite_panel()
-    elif tab == 'analyze':
-        return draw_analyze_panel()
-    return None
+@metrics.instrument
+def on_tab_clicked(opened):
+    return draw_analyze_panel()
 
 
 def get_sidebar_layout():
@@ -35,5 +37,10 @@ def get_sidebar_layout():
             ],
             style={'backgroundColor': '#181818', 'color': '#f5f5f5'}
         ),
-        html.Div(id='sidebar-content', style={'overflowY': 'auto', 'maxHeight': '80vh', 'marginTop': '10px', 'backgroundColor': '#181818', 'color': '#f5f5f5'}),
+        dcc.Store(id='analyze-open'),
+        html.Div([
+            recent_panel_layout(),
+            favorite_panel_layout(),
+            html.Div(id='sidebar-content', style={'display': 'none'}),
+        ], style={'overflowY': 'auto', 'maxHeight': '80vh', 'marginTop': '10px', 'backgroundColor': '#181818', 'color': '#f5f5f5'}),
     ], style={'width': '300px', 'padding': '10px', 'borderRight': '1px solid #333', 'backgroundColor': '#181818', 'color': '#f5f5f5'})